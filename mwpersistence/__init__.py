@@ -1,6 +1,6 @@
-from .token import Token
+from .token import Token, AggregateToken
 from .state import State, DiffState
 
 __version__ = "0.2.5"
 
-__all__ = [Token, State, DiffState]
+__all__ = [Token, AggregateToken, State, DiffState]
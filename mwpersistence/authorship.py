@@ -0,0 +1,247 @@
+"""
+An index of the revision that added each token of a version ("blame").
+
+Rather than walking the `revisions` of every token, a
+:class:`~mwpersistence.authorship.Authorship` records the origin of the
+tokens of a version as runs of consecutive tokens that were added by the same
+revision.  A :class:`~mwpersistence.DiffState` constructed with
+``authorship=True`` carries the index from version to version using the
+"equal" operations of each diff, so maintaining it costs O(runs) per revision
+rather than O(tokens), and queries about who wrote a span of tokens or how
+much of the page each user owns cost O(runs) too.
+
+Each run also refers to the tokens of the operation that inserted it, so that
+the bytes (UTF-8) owned by a revision can be counted without looking at the
+tokens.
+
+.. autoclass:: mwpersistence.authorship.Authorship
+    :members:
+"""
+from bisect import bisect_right
+from itertools import accumulate
+
+
+class Authorship:
+    """
+    Constructs an (empty) index of the origin of the tokens of a version.
+    Indexes are immutable.  See
+    :func:`~mwpersistence.authorship.Authorship.transition`.
+
+    :Example:
+        >>> import mwpersistence
+        >>> import deltas
+        >>>
+        >>> state = mwpersistence.DiffState(deltas.SegmentMatcher(),
+        ...                                 revert_radius=15, authorship=True)
+        >>> _ = state.update("Apples are red.", revision=1)
+        >>> _ = state.update("Apples are blue.", revision=2)
+        >>> list(state.authorship.spans())
+        [(0, 4, 1), (4, 5, 2), (5, 6, 1)]
+        >>> state.authorship.tokens_owned()
+        {1: 5, 2: 1}
+        >>> state.authorship.to_json()
+        [[4, 1], [1, 2], [1, 1]]
+    """
+    __slots__ = ('origins', 'segments', 'offsets', 'ends', 'byte_ends')
+
+    def __init__(self):
+        self.origins = []
+        """
+        The origin of each run
+        """
+        self.segments = []
+        self.offsets = []
+        self.ends = []
+        """
+        The token offset of the end of each run
+        """
+        self.byte_ends = []
+
+    @property
+    def runs(self):
+        """
+        The number of runs
+        """
+        return len(self.origins)
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes of text in the version
+        """
+        return self.byte_ends[-1] if len(self.byte_ends) > 0 else 0
+
+    def transition(self, ranges, origin):
+        """
+        Constructs the index of a new version.
+
+        :Parameters:
+            ranges : `iterable` ( `tuple` )
+                ``(a1, a2, texts)`` triples that describe the new version in
+                order.  If `texts` is `None`, tokens `a1` to `a2` of this
+                version are copied.  Otherwise, `texts` are inserted.
+            origin : `mixed`
+                The origin of the inserted tokens (e.g. a revision id)
+
+        :Returns:
+            A new :class:`~mwpersistence.authorship.Authorship`
+        """
+        authorship = Authorship()
+        for a1, a2, texts in ranges:
+            if texts is None:
+                authorship._copy(self, a1, a2)
+            elif len(texts) > 0:
+                segment = list(accumulate(
+                    (len(text.encode('utf-8')) for text in texts), initial=0))
+                authorship._append(origin, segment, 0, len(texts))
+        return authorship
+
+    def origin(self, i):
+        """
+        Returns the origin of token `i`.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Token index out of range")
+        return self.origins[bisect_right(self.ends, i)]
+
+    def spans(self, start=0, end=None, key=None):
+        """
+        Generates the runs that overlap tokens `start` to `end`, clipped to
+        them.  Adjacent runs with the same origin (or `key` of the origin)
+        are merged.
+
+        :Parameters:
+            start : `int`
+                The first token
+            end : `int`
+                The token after the last one.  Defaults to the end of the
+                version.
+            key : `func`
+                Maps origins to what is reported (e.g. a revision id to a
+                user)
+
+        :Returns:
+            A generator of ``(start, end, origin)`` triples
+        """
+        end = len(self) if end is None else min(end, len(self))
+        k = bisect_right(self.ends, start)
+        current = None
+        while start < end:
+            origin = self.origins[k]
+            if key is not None:
+                origin = key(origin)
+            run_end = min(self.ends[k], end)
+            if current is not None and current[2] == origin:
+                current = (current[0], run_end, origin)
+            else:
+                if current is not None:
+                    yield current
+                current = (start, run_end, origin)
+            start = run_end
+            k += 1
+        if current is not None:
+            yield current
+
+    def tokens_owned(self, key=None):
+        """
+        Returns a `dict` of the number of tokens added by each origin (or
+        `key` of the origin).
+        """
+        owned = {}
+        start = 0
+        for origin, end in zip(self.origins, self.ends):
+            if key is not None:
+                origin = key(origin)
+            owned[origin] = owned.get(origin, 0) + end - start
+            start = end
+        return owned
+
+    def bytes_owned(self, key=None):
+        """
+        Returns a `dict` of the number of bytes of text added by each origin
+        (or `key` of the origin).
+        """
+        owned = {}
+        start = 0
+        for origin, end in zip(self.origins, self.byte_ends):
+            if key is not None:
+                origin = key(origin)
+            owned[origin] = owned.get(origin, 0) + end - start
+            start = end
+        return owned
+
+    def to_json(self, key=None):
+        """
+        Returns a compact, JSON-able representation of the index: a list of
+        ``[tokens, origin]`` pairs with one pair per run of tokens with the
+        same origin (or `key` of the origin).
+        """
+        return [[end - start, origin]
+                for start, end, origin in self.spans(key=key)]
+
+    def _append(self, origin, segment, start, end):
+        if end <= start:
+            return
+        last = len(self.origins) - 1
+        token_end = self.ends[last] if last >= 0 else 0
+        byte_end = self.byte_ends[last] if last >= 0 else 0
+        if last >= 0 and self.segments[last] is segment:
+            length = token_end - (self.ends[last - 1] if last > 0 else 0)
+            contiguous = self.offsets[last] + length == start
+        else:
+            contiguous = False
+
+        if contiguous:
+            # Continues the last run
+            self.ends[last] += end - start
+            self.byte_ends[last] += segment[end] - segment[start]
+        else:
+            self.origins.append(origin)
+            self.segments.append(segment)
+            self.offsets.append(start)
+            self.ends.append(token_end + end - start)
+            self.byte_ends.append(byte_end + segment[end] - segment[start])
+
+    def _copy(self, other, a1, a2):
+        k = bisect_right(other.ends, a1)
+        while a1 < a2 and k < len(other.ends):
+            run_start = other.ends[k - 1] if k > 0 else 0
+            run_end = min(other.ends[k], a2)
+            offset = other.offsets[k] - run_start
+            self._append(other.origins[k], other.segments[k],
+                         a1 + offset, run_end + offset)
+            a1 = run_end
+            k += 1
+
+    def __len__(self):
+        return self.ends[-1] if len(self.ends) > 0 else 0
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__,
+                                 repr(self.to_json()))
+
+
+def opdoc_ranges(op_docs):
+    """
+    Converts operation documents into the ``(a1, a2, texts)`` ranges that
+    :func:`~mwpersistence.authorship.Authorship.transition` expects.
+    """
+    for op_doc in op_docs:
+        if op_doc['name'] in ("replace", "insert"):
+            yield None, None, op_doc['tokens']
+        elif op_doc['name'] == "equal":
+            yield op_doc['a1'], op_doc['a2'], None
+
+
+def operation_ranges(operations, b):
+    """
+    Converts :class:`deltas.Operation` into the ``(a1, a2, texts)`` ranges
+    that :func:`~mwpersistence.authorship.Authorship.transition` expects.
+    """
+    for op in operations:
+        if op.name in ("replace", "insert"):
+            yield None, None, b[op.b1:op.b2]
+        elif op.name == "equal":
+            yield op.a1, op.a2, None
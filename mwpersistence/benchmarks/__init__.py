@@ -0,0 +1,39 @@
+"""
+Benchmarks for tracking the performance of mwpersistence over time.
+
+A :class:`~mwpersistence.benchmarks.generator.PageHistoryGenerator` generates
+reproducible synthetic page histories, and
+:func:`~mwpersistence.benchmarks.suite.run_benchmarks` times
+:func:`~mwpersistence.DiffState.update` (with a
+:class:`deltas.SegmentMatcher`),
+:func:`~mwpersistence.DiffState.update_opdocs`,
+:func:`~mwpersistence.state.apply_opdocs`,
+:func:`~mwpersistence.utilities.diffs2persistence` and
+:func:`~mwpersistence.utilities.persistence2stats` on them.  Run
+``python -m mwpersistence.benchmarks -h`` for more information.
+
+``baselines/default.json`` holds results for the default parameters.  Timings
+depend on the machine, so save a baseline on your own machine (``--save``)
+before comparing against it (``--baseline``).
+
+.. automodule:: mwpersistence.benchmarks.generator
+
+.. autoclass:: mwpersistence.benchmarks.generator.PageHistoryGenerator
+    :members:
+
+.. autofunction:: mwpersistence.benchmarks.generator.add_diffs
+
+.. automodule:: mwpersistence.benchmarks.suite
+
+.. autoclass:: mwpersistence.benchmarks.suite.Corpus
+    :members:
+
+.. autofunction:: mwpersistence.benchmarks.suite.run_benchmarks
+
+.. autofunction:: mwpersistence.benchmarks.suite.compare
+"""
+from .generator import PageHistoryGenerator, add_diffs
+from .suite import BENCHMARKS, Corpus, compare, run_benchmarks
+
+__all__ = [PageHistoryGenerator, add_diffs, BENCHMARKS, Corpus, compare,
+           run_benchmarks]
@@ -0,0 +1,103 @@
+"""
+Times mwpersistence on a synthetic corpus of page histories.  Run with
+``python -m mwpersistence.benchmarks``.
+
+Usage:
+    benchmarks (-h|--help)
+    benchmarks [--pages=<num>] [--revisions=<num>] [--page-length=<words>]
+               [--edit-size=<words>] [--revert-rate=<prob>]
+               [--vandalism-rate=<prob>] [--vandalism-burst=<revs>]
+               [--users=<num>] [--anon-rate=<prob>] [--seed=<num>]
+               [--benchmark=<name>...] [--repeat=<num>] [--save=<path>]
+               [--baseline=<path>] [--tolerance=<prop>]
+
+Options:
+    -h|--help                 Prints this documentation
+    --pages=<num>             The number of pages to generate [default: 10]
+    --revisions=<num>         The number of revisions of each page
+                              [default: 100]
+    --page-length=<words>     The number of words in the first revision of a
+                              page [default: 500]
+    --edit-size=<words>       The mean number of words changed by an edit
+                              [default: 10]
+    --revert-rate=<prob>      The probability that an edit is a revert
+                              [default: 0.05]
+    --vandalism-rate=<prob>   The probability that an edit starts a vandalism
+                              burst [default: 0.02]
+    --vandalism-burst=<revs>  The maximum number of edits in a vandalism burst
+                              [default: 3]
+    --users=<num>             The number of registered users [default: 20]
+    --anon-rate=<prob>        The probability that an edit is anonymous
+                              [default: 0.3]
+    --seed=<num>              Seeds the generator [default: 0]
+    --benchmark=<name>        The name of a benchmark to run.  Can be repeated.
+                              [default: <all>]
+    --repeat=<num>            The number of times to run each benchmark.  The
+                              best time is reported. [default: 3]
+    --save=<path>             Write the results to a JSON file
+                              [default: <none>]
+    --baseline=<path>         Compare the results with a JSON file that was
+                              saved earlier.  Exits with status 1 if any
+                              benchmark regressed. [default: <none>]
+    --tolerance=<prop>        The proportion by which a benchmark can be
+                              slower than its baseline [default: 0.1]
+"""
+import sys
+
+import docopt
+
+from .generator import PageHistoryGenerator
+from .suite import Corpus, compare, load, run_benchmarks, save
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    generator = PageHistoryGenerator(
+        pages=int(args['--pages']),
+        revisions=int(args['--revisions']),
+        page_length=int(args['--page-length']),
+        edit_size=int(args['--edit-size']),
+        revert_rate=float(args['--revert-rate']),
+        vandalism_rate=float(args['--vandalism-rate']),
+        vandalism_burst=int(args['--vandalism-burst']),
+        users=int(args['--users']),
+        anon_rate=float(args['--anon-rate']),
+        seed=int(args['--seed']))
+
+    if args['--benchmark'] in ([], ["<all>"]):
+        names = None
+    else:
+        names = args['--benchmark']
+
+    sys.stderr.write("Generating {0} revisions...\n"
+                     .format(generator.pages * generator.revisions))
+    corpus = Corpus(generator)
+    results = run_benchmarks(corpus, names=names,
+                             repeat=int(args['--repeat']))
+
+    for name, result in results['results'].items():
+        sys.stdout.write("{0:<25} {1:>9.3f}s {2:>12.1f} revisions/s\n"
+                         .format(name, result['seconds'],
+                                 result['revisions_per_second'] or 0))
+
+    if args['--save'] != "<none>":
+        save(results, args['--save'])
+
+    if args['--baseline'] != "<none>":
+        comparisons = compare(results, load(args['--baseline']),
+                              tolerance=float(args['--tolerance']))
+        regressed = False
+        sys.stdout.write("\nCompared with {0}:\n".format(args['--baseline']))
+        for name, seconds, baseline_seconds, ratio, slower in comparisons:
+            sys.stdout.write("{0:<25} {1:>9.3f}s {2:>9.3f}s {3:>7.2f}x{4}\n"
+                             .format(name, seconds, baseline_seconds,
+                                     ratio or 0,
+                                     "  REGRESSED" if slower else ""))
+            regressed = regressed or slower
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
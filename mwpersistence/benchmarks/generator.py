@@ -0,0 +1,223 @@
+"""
+Generates reproducible synthetic page histories.
+
+Histories are generated from a seeded :class:`random.Random`, so the same
+parameters always produce the same revision documents.  Each page starts from
+a random text and evolves through a mix of edits:
+
+* *Ordinary edits* insert, delete or replace a run of about `edit_size`
+  words at a random position.
+* *Reverts* restore the text of one of the last few revisions.
+* *Vandalism bursts* are a series of anonymous edits that blank the page or
+  insert junk, followed by a revert to the text before the burst.
+
+Editors are drawn from a pool of `users` registered users (a few of whom make
+most of the edits) and anonymous users.
+"""
+import random
+from hashlib import sha1
+
+from mwtypes import Timestamp
+
+WORDS = 5000
+"""
+The number of distinct words in the vocabulary
+"""
+
+
+class PageHistoryGenerator:
+    """
+    Constructs a generator of synthetic page histories.  Iterating over a
+    generator yields page-partitioned, chronological revision documents with
+    a 'text' field.
+
+    :Parameters:
+        pages : `int`
+            The number of pages to generate
+        revisions : `int`
+            The number of revisions of each page
+        page_length : `int`
+            The number of words in the first revision of a page
+        edit_size : `int`
+            The mean number of words changed by an ordinary edit
+        revert_rate : `float`
+            The probability that an edit is a revert
+        vandalism_rate : `float`
+            The probability that an edit starts a vandalism burst
+        vandalism_burst : `int`
+            The maximum number of vandalism edits in a burst
+        users : `int`
+            The number of registered users that edit
+        anon_rate : `float`
+            The probability that an ordinary edit is anonymous
+        seed : `int`
+            Seeds the random number generator
+    """
+
+    def __init__(self, pages=10, revisions=100, page_length=500, edit_size=10,
+                 revert_rate=0.05, vandalism_rate=0.02, vandalism_burst=3,
+                 users=20, anon_rate=0.3, seed=0):
+        self.pages = int(pages)
+        self.revisions = int(revisions)
+        self.page_length = int(page_length)
+        self.edit_size = int(edit_size)
+        self.revert_rate = float(revert_rate)
+        self.vandalism_rate = float(vandalism_rate)
+        self.vandalism_burst = int(vandalism_burst)
+        self.users = int(users)
+        self.anon_rate = float(anon_rate)
+        self.seed = seed
+
+    def params(self):
+        """
+        Returns the parameters of the generator as a `dict`.
+        """
+        return {'pages': self.pages, 'revisions': self.revisions,
+                'page_length': self.page_length,
+                'edit_size': self.edit_size,
+                'revert_rate': self.revert_rate,
+                'vandalism_rate': self.vandalism_rate,
+                'vandalism_burst': self.vandalism_burst,
+                'users': self.users, 'anon_rate': self.anon_rate,
+                'seed': self.seed}
+
+    def __iter__(self):
+        random_ = random.Random(self.seed)
+        vocabulary = [_word(random_) for _ in range(WORDS)]
+        user_weights = [1 / (i + 1) for i in range(self.users)]
+
+        rev_id = 1
+        for page_id in range(1, self.pages + 1):
+            page_doc = {'id': page_id, 'title': "Page " + str(page_id),
+                        'namespace': 0}
+            for rev_doc in self._page(random_, vocabulary, user_weights,
+                                      page_doc, rev_id):
+                yield rev_doc
+            rev_id += self.revisions
+
+    def _page(self, random_, vocabulary, user_weights, page_doc, rev_id):
+        words = [random_.choice(vocabulary)
+                 for _ in range(self.page_length)]
+        history = []
+        timestamp = 1000000000 + random_.randint(0, 10000000)
+        burst, before_burst = 0, None
+
+        for i in range(self.revisions):
+            if i == 0:
+                user = self._user(random_, user_weights)
+            elif burst > 0:
+                burst -= 1
+                user = self._anon(random_)
+                if random_.random() < 0.5:
+                    words = []
+                else:
+                    words = self._insert(random_, words,
+                                         ["JUNK"] * self._size(random_))
+            elif before_burst is not None:
+                user = self._user(random_, user_weights)
+                words, before_burst = before_burst, None
+            elif random_.random() < self.vandalism_rate:
+                burst = random_.randint(1, max(self.vandalism_burst, 1)) - 1
+                before_burst = words
+                user = self._anon(random_)
+                words = []
+            elif len(history) > 1 and random_.random() < self.revert_rate:
+                user = self._user(random_, user_weights)
+                words = history[-random_.randint(2, min(len(history), 5))]
+            else:
+                if random_.random() < self.anon_rate:
+                    user = self._anon(random_)
+                else:
+                    user = self._user(random_, user_weights)
+                words = self._edit(random_, vocabulary, words)
+
+            history.append(words)
+            text = _text(words)
+            timestamp += random_.randint(60, 86400)
+            yield {'id': rev_id + i,
+                   'timestamp': str(Timestamp(timestamp)),
+                   'sha1': sha1(bytes(text, 'utf8')).hexdigest(),
+                   'page': dict(page_doc),
+                   'user': user,
+                   'text': text}
+
+    def _edit(self, random_, vocabulary, words):
+        size = self._size(random_)
+        action = random_.choice(("insert", "delete", "replace"))
+        if action != "insert" and len(words) > 0:
+            start = random_.randint(0, len(words) - 1)
+            words = words[:start] + words[start + size:]
+            if action == "delete":
+                return words
+        return self._insert(random_, words,
+                            [random_.choice(vocabulary)
+                             for _ in range(size)])
+
+    def _insert(self, random_, words, new_words):
+        position = random_.randint(0, len(words))
+        return words[:position] + new_words + words[position:]
+
+    def _size(self, random_):
+        return max(1, int(random_.expovariate(1 / max(self.edit_size, 1))))
+
+    def _user(self, random_, user_weights):
+        if len(user_weights) == 0:
+            return self._anon(random_)
+        user_id = random_.choices(range(1, len(user_weights) + 1),
+                                  weights=user_weights)[0]
+        return {'id': user_id, 'text': "User " + str(user_id)}
+
+    def _anon(self, random_):
+        return {'id': None,
+                'text': "10.0.{0}.{1}".format(random_.randint(0, 255),
+                                              random_.randint(1, 254))}
+
+
+def add_diffs(rev_docs, diff_engine):
+    """
+    Adds a 'diff' field to page-partitioned revision documents with a 'text'
+    field, in the format generated by `mwdiffs revdocs2diffs`.
+
+    :Parameters:
+        rev_docs : `iterable` ( `dict` )
+            Page-partitioned revision documents
+        diff_engine : :class:`deltas.DiffEngine`
+            A diff engine for comparing revisions
+
+    :Returns:
+        A generator of revision documents
+    """
+    page_id, processor, last_id = None, None, None
+    for rev_doc in rev_docs:
+        if rev_doc['page']['id'] != page_id:
+            page_id = rev_doc['page']['id']
+            processor, last_id = diff_engine.processor(), None
+
+        operations, a, b = processor.process(rev_doc['text'])
+        rev_doc['diff'] = {'last_id': last_id,
+                           'ops': [_opdoc(operation, a, b)
+                                   for operation in operations]}
+        last_id = rev_doc['id']
+        yield rev_doc
+
+
+def _opdoc(operation, a, b):
+    name, a1, a2, b1, b2 = operation
+    op_doc = {'name': name, 'a1': a1, 'a2': a2, 'b1': b1, 'b2': b2}
+    if name == "insert":
+        op_doc['tokens'] = [str(t) for t in b[b1:b2]]
+    elif name == "delete":
+        op_doc['tokens'] = [str(t) for t in a[a1:a2]]
+    return op_doc
+
+
+def _word(random_):
+    return "".join(random_.choice("abcdefghijklmnopqrstuvwxyz")
+                   for _ in range(random_.randint(2, 10)))
+
+
+def _text(words):
+    lines = []
+    for start in range(0, len(words), 12):
+        lines.append(" ".join(words[start:start + 12]) + ".")
+    return "\n".join(lines)
@@ -0,0 +1,230 @@
+"""
+Times the processing of a synthetic corpus.
+
+Each benchmark is a pair of functions.  `setup` prepares fresh input from a
+:class:`~mwpersistence.benchmarks.suite.Corpus` and is not timed.  `run`
+processes the input.  The best of several repetitions is reported.
+
+Results are stored as JSON documents that record the generator parameters
+and the Python and mwpersistence versions along with the timings, so a run can
+be compared with a baseline that was saved earlier.
+"""
+import json
+import platform
+import time
+from itertools import groupby
+
+import deltas
+from mwtypes import Timestamp
+
+from .. import __version__
+from ..state import DiffState, apply_opdocs
+from ..utilities.diffs2persistence import diffs2persistence
+from ..utilities.persistence2stats import persistence2stats
+from .generator import add_diffs
+
+
+class Corpus:
+    """
+    Generates and holds the revision documents of a synthetic corpus.
+
+    :Parameters:
+        generator : :class:`~mwpersistence.benchmarks.generator.PageHistoryGenerator`
+            Generates the page histories
+        diff_engine : :class:`deltas.DiffEngine`
+            The diff engine used to generate 'diff' fields.  Defaults to a
+            :class:`deltas.SegmentMatcher`.
+    """  # noqa
+
+    def __init__(self, generator, diff_engine=None):
+        self.params = generator.params()
+        self.diff_engine = diff_engine or deltas.SegmentMatcher()
+        self.rev_docs = list(add_diffs(generator, self.diff_engine))
+        self.sunset = Timestamp(max((int(Timestamp(d['timestamp']))
+                                     for d in self.rev_docs), default=0) + 1)
+        self._persistence_docs = None
+
+    @property
+    def revisions(self):
+        return len(self.rev_docs)
+
+    def pages(self):
+        """
+        Returns a list of the lists of revision documents of each page.
+        """
+        return [list(page_docs) for _, page_docs in
+                groupby(self.rev_docs, key=lambda d: d['page']['id'])]
+
+    def persistence_docs(self):
+        """
+        Returns the revision documents with a 'persistence' field (see
+        :func:`~mwpersistence.utilities.diffs2persistence`).  Generated once.
+        """
+        if self._persistence_docs is None:
+            self._persistence_docs = list(diffs2persistence(
+                [dict(d) for d in self.rev_docs], sunset=self.sunset))
+        return self._persistence_docs
+
+
+def _pages(corpus):
+    return (corpus.pages(),)
+
+
+def _diffstate_update(pages):
+    for page_docs in pages:
+        state = DiffState(deltas.SegmentMatcher(), revert_radius=15)
+        for rev_doc in page_docs:
+            state.update(rev_doc['text'], revision=rev_doc['id'])
+
+
+def _diffstate_update_opdocs(pages):
+    for page_docs in pages:
+        state = DiffState(revert_radius=15)
+        for rev_doc in page_docs:
+            state.update_opdocs(rev_doc['sha1'], rev_doc['diff']['ops'],
+                                revision=rev_doc['id'])
+
+
+def _diffstate_update_opdocs_many(pages):
+    for page_docs in pages:
+        # Outputs are discarded, as in _diffstate_update_opdocs
+        state = DiffState(revert_radius=15)
+        state.update_opdocs_many([(rev_doc['sha1'], rev_doc['diff']['ops'],
+                                   rev_doc['id'])
+                                  for rev_doc in page_docs], outputs=())
+
+
+def _apply_opdocs(pages):
+    for page_docs in pages:
+        tokens = []
+        for rev_doc in page_docs:
+            tokens, _, _ = apply_opdocs(rev_doc['diff']['ops'], tokens)
+
+
+def _diffs2persistence_setup(corpus):
+    return [dict(d) for d in corpus.rev_docs], corpus.sunset
+
+
+def _diffs2persistence(rev_docs, sunset):
+    for _ in diffs2persistence(rev_docs, sunset=sunset):
+        pass
+
+
+def _persistence2stats_setup(corpus):
+    return ([dict(d, persistence=dict(d['persistence']))
+             for d in corpus.persistence_docs()],)
+
+
+def _persistence2stats(rev_docs):
+    for _ in persistence2stats(rev_docs):
+        pass
+
+
+BENCHMARKS = {
+    'DiffState.update': (_pages, _diffstate_update),
+    'DiffState.update_opdocs': (_pages, _diffstate_update_opdocs),
+    'DiffState.update_opdocs_many': (_pages,
+                                     _diffstate_update_opdocs_many),
+    'apply_opdocs': (_pages, _apply_opdocs),
+    'diffs2persistence': (_diffs2persistence_setup, _diffs2persistence),
+    'persistence2stats': (_persistence2stats_setup, _persistence2stats)
+}
+"""
+Maps benchmark names to `(setup, run)` pairs
+"""
+
+
+def run_benchmarks(corpus, names=None, repeat=3):
+    """
+    Times benchmarks on a corpus.
+
+    :Parameters:
+        corpus : :class:`~mwpersistence.benchmarks.suite.Corpus`
+            The corpus to process
+        names : `iterable` ( `str` )
+            The names of the benchmarks to run.  Defaults to all of
+            :data:`~mwpersistence.benchmarks.suite.BENCHMARKS`.
+        repeat : `int`
+            The number of times to run each benchmark
+
+    :Returns:
+        A results document (`dict`)
+    """
+    names = list(names) if names is not None else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError("Benchmark {0} not supported.  Type {1}"
+                             .format(repr(name), tuple(BENCHMARKS.keys())))
+
+    results = {}
+    for name in names:
+        setup, run = BENCHMARKS[name]
+        timings = []
+        for _ in range(max(int(repeat), 1)):
+            args = setup(corpus)
+            start = time.perf_counter()
+            run(*args)
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        rate = corpus.revisions / seconds if seconds > 0 else None
+        results[name] = {'seconds': seconds,
+                         'revisions': corpus.revisions,
+                         'revisions_per_second': rate}
+
+    return {'mwpersistence': __version__,
+            'python': platform.python_version(),
+            'params': corpus.params,
+            'repeat': int(repeat),
+            'results': results}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares results with a baseline.
+
+    :Parameters:
+        results : `dict`
+            A results document
+        baseline : `dict`
+            A results document saved earlier
+        tolerance : `float`
+            The proportion by which a benchmark can be slower than its
+            baseline before it is reported as a regression
+
+    :Returns:
+        A list of `(name, seconds, baseline_seconds, ratio, regressed)`
+        tuples for the benchmarks in both documents
+    """
+    if results.get('params') != baseline.get('params'):
+        raise ValueError("Results and baseline were generated with different "
+                         "parameters: {0} vs. {1}"
+                         .format(results.get('params'),
+                                 baseline.get('params')))
+
+    comparisons = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        seconds = result['seconds']
+        baseline_seconds = baseline['results'][name]['seconds']
+        ratio = seconds / baseline_seconds if baseline_seconds > 0 else None
+        comparisons.append((name, seconds, baseline_seconds, ratio,
+                            ratio is not None and ratio > 1 + tolerance))
+    return comparisons
+
+
+def save(results, path):
+    """
+    Writes a results document to a JSON file.
+    """
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    """
+    Reads a results document from a JSON file.
+    """
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,34 @@
+import deltas
+from nose.tools import eq_
+
+from ...state import apply_opdocs
+from ..generator import PageHistoryGenerator, add_diffs
+
+
+def test_generator():
+    generator = PageHistoryGenerator(pages=2, revisions=30, page_length=50,
+                                     revert_rate=0.2, vandalism_rate=0.1)
+    rev_docs = list(generator)
+
+    eq_(len(rev_docs), 60)
+    eq_(rev_docs, list(generator))
+    eq_(len({d['id'] for d in rev_docs}), 60)
+    eq_([d['page']['id'] for d in rev_docs], [1] * 30 + [2] * 30)
+    assert len({d['sha1'] for d in rev_docs}) < 60  # Some reverts
+
+    other = PageHistoryGenerator(pages=2, revisions=30, page_length=50,
+                                 seed=1)
+    assert list(other) != rev_docs
+
+
+def test_add_diffs():
+    generator = PageHistoryGenerator(pages=2, revisions=10, page_length=20)
+    tokens, last_id = [], None
+    for rev_doc in add_diffs(generator, deltas.SegmentMatcher()):
+        if rev_doc['diff']['last_id'] is None:
+            tokens = []
+        else:
+            eq_(rev_doc['diff']['last_id'], last_id)
+        tokens, _, _ = apply_opdocs(rev_doc['diff']['ops'], tokens)
+        eq_("".join(str(t) for t in tokens), rev_doc['text'])
+        last_id = rev_doc['id']
@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+from nose.tools import eq_, raises
+
+from ..generator import PageHistoryGenerator
+from ..suite import BENCHMARKS, Corpus, compare, load, run_benchmarks, save
+
+
+def test_run_benchmarks():
+    corpus = Corpus(PageHistoryGenerator(pages=2, revisions=5,
+                                         page_length=20))
+    results = run_benchmarks(corpus, repeat=1)
+
+    eq_(set(results['results'].keys()), set(BENCHMARKS.keys()))
+    eq_(results['params'], corpus.params)
+    eq_(results['results']['apply_opdocs']['revisions'], 10)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "baseline.json")
+        save(results, path)
+        baseline = load(path)
+
+    baseline['results']['apply_opdocs']['seconds'] /= 10
+    comparisons = {c[0]: c for c in compare(results, baseline)}
+    eq_(comparisons['apply_opdocs'][4], True)
+    eq_(comparisons['persistence2stats'][4], False)
+
+
+@raises(ValueError)
+def test_compare_params():
+    results = {'params': {'seed': 0}, 'results': {}}
+    compare(results, {'params': {'seed': 1}, 'results': {}})
@@ -0,0 +1,406 @@
+"""
+A columnar, `numpy`-backed alternative to :class:`~mwpersistence.DiffState`.
+
+:class:`~mwpersistence.columnar.ColumnarDiffState` stores every token a page
+has seen as a row in a set of parallel arrays and represents the tokens of a
+revision as an array of row numbers.  Applying a diff is slicing and
+concatenation of row arrays and marking a revision as persisting for the
+tokens that are present is a single vectorized update.  Requires `numpy`.
+
+The rows of tokens that are no longer part of a version that the revert
+detector remembers and aren't referred to by any
+:class:`~mwpersistence.columnar.TokenColumns` are reclaimed when tokens are
+settled and reused for new tokens, so the size of the columns follows the
+size of the page (and the processing window) rather than its history.
+
+.. autoclass:: mwpersistence.columnar.ColumnarDiffState
+    :members:
+
+.. autoclass:: mwpersistence.columnar.TokenColumns
+    :members:
+"""
+import logging
+import weakref
+from hashlib import sha1
+
+import mwreverts
+
+from .util import detector_state, restore_detector, user_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('text_id', 'user', 'birth', 'persisted', 'non_self_persisted',
+           'seconds_visible')
+
+# Rows are only reclaimed once this many are in use
+MIN_RECLAIM = 1024
+
+
+class Version:
+    __slots__ = ('rows', )
+
+    def __init__(self, rows=None):
+        self.rows = rows
+
+
+class TokenColumns:
+    """
+    A sequence of tokens stored in a
+    :class:`~mwpersistence.columnar.ColumnarDiffState`.  Iterating yields the
+    text of each token.
+
+    :Parameters:
+        state : :class:`~mwpersistence.columnar.ColumnarDiffState`
+            The state that stores the tokens
+        rows : :class:`numpy.ndarray`
+            The rows of the tokens in `state`
+    """
+    __slots__ = ('state', 'rows', '__weakref__')
+
+    def __init__(self, state, rows):
+        self.state = state
+        self.rows = rows
+        _views(state)[id(self)] = self
+
+    def __getstate__(self):
+        return self.state, self.rows
+
+    def __setstate__(self, state):
+        self.state, self.rows = state
+        _views(self.state)[id(self)] = self
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        texts = self.state.texts
+        return (texts[text_id]
+                for text_id in self.state.text_id[self.rows].tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TokenColumns(self.state, self.rows[index])
+        else:
+            return self.state.texts[self.state.text_id[self.rows[index]]]
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return False
+
+    def token_docs(self):
+        """
+        Generates a persistence document for each token.  See
+        :func:`~mwpersistence.utilities.diffs2persistence`.
+        """
+        state, rows = self.state, self.rows
+        for text, persisted, non_self_persisted, seconds_visible in zip(
+                self, state.persisted[rows].tolist(),
+                state.non_self_persisted[rows].tolist(),
+                state.seconds_visible[rows].tolist()):
+            yield {
+                "text": text,
+                "persisted": persisted,
+                "non_self_persisted": non_self_persisted,
+                "seconds_visible": seconds_visible
+            }
+
+    def token_values(self):
+        """
+        Generates a ``(text, persisted, non_self_persisted,
+        seconds_visible)`` tuple for each token.
+        """
+        state, rows = self.state, self.rows
+        return zip(self, state.persisted[rows].tolist(),
+                   state.non_self_persisted[rows].tolist(),
+                   state.seconds_visible[rows].tolist())
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, repr(list(self)))
+
+
+class ColumnarDiffState:
+    """
+    Constructs a state object with a diff-based transition function that
+    stores tokens in columns.  Revision metadata is expected to be a
+    ``(user, seconds_visible)`` pair.
+
+    :Parameters:
+        diff_engine : :class:`deltas.DiffEngine`
+            A "diff engine" processor for sequentially diffing text
+        revert_radius : int
+            a positive integer indicating the maximum revision distance
+            that a revert can span.
+        revert_detector : :class:`mwreverts.Detector`
+            A revert detector.
+        capacity : int
+            The number of token rows to allocate up front.
+        interner : :class:`~mwpersistence.interning.Interner`
+            If set, texts are interned before being added to the string
+            table (e.g. to share texts between pages).
+    """
+
+    def __init__(self, diff_engine=None, revert_radius=None,
+                 revert_detector=None, capacity=1024, interner=None):
+        if np is None:
+            raise ImportError("ColumnarDiffState requires numpy.")
+
+        if diff_engine is not None:
+            if not hasattr(diff_engine, 'process'):
+                raise TypeError("'diff_engine' of type {0} does not have a "
+                                "process() method.".format(type(diff_engine)))
+            else:
+                self.diff_engine = diff_engine
+                self.diff_processor = self.diff_engine.processor()
+        else:
+            self.diff_engine, self.diff_processor = None, None
+
+        # Either pass a detector or the revert radius so I can make one
+        if revert_detector is None and revert_radius is None:
+            raise TypeError("Either a 'revert_detector' or a " +
+                            "'revert_radius' must be provided.")
+
+        if revert_detector is None:
+            self.revert_detector = mwreverts.Detector(int(revert_radius))
+        else:
+            self.revert_detector = revert_detector
+
+        # String tables
+        self.interner = interner
+        self.texts = []
+        self.text_ids = {}
+        self.user_ids = {}
+
+        # Token columns
+        self.size = 0
+        self.text_id = np.zeros(capacity, dtype=np.int32)
+        self.user = np.zeros(capacity, dtype=np.int32)
+        self.birth = np.zeros(capacity, dtype=np.int32)
+        self.persisted = np.zeros(capacity, dtype=np.int64)
+        self.non_self_persisted = np.zeros(capacity, dtype=np.int64)
+        self.seconds_visible = np.zeros(capacity, dtype=np.int64)
+
+        # Reclaimed rows and the live TokenColumns that refer to rows
+        self.free = np.zeros(0, dtype=np.int32)
+        self.reclaim_at = MIN_RECLAIM
+        self.views = weakref.WeakValueDictionary()
+
+        self.epoch = 0
+        self.last = Version(np.zeros(0, dtype=np.int32))
+
+        # The number of reverts detected
+        self.reverts = 0
+
+    def update(self, text, revision=None):
+        """
+        Modifies the internal state based a change to the content and returns
+        the sets of words added and removed.
+
+        :Parameters:
+            text : str
+                The text content of a revision
+            revision : `mixed`
+                Revision metadata
+
+        :Returns:
+            A triple of :class:`~mwpersistence.columnar.TokenColumns`:
+            `current_tokens`, `tokens_added` and `tokens_removed`
+        """
+        return self._update(text=text, revision=revision)
+
+    def update_opdocs(self, checksum, opdocs, revision=None):
+        """
+        Modifies the internal state based a change to the content and returns
+        the sets of words added and removed.
+
+        :Parameters:
+            checksum : `hashable`
+                A checksum generated from the text of a revision
+            opdocs : `iterable` ( `dict` )
+                A sequence of operations that represent the diff of this new
+                revision
+            revision : `mixed`
+                Revision metadata
+
+        :Returns:
+            A triple of :class:`~mwpersistence.columnar.TokenColumns`:
+            `current_tokens`, `tokens_added` and `tokens_removed`
+        """
+        return self._update(checksum=checksum, opdocs=opdocs,
+                            revision=revision)
+
+    def settle(self, tokens):
+        """
+        Persistence is always up to date in a columnar state, so this method
+        is provided for compatibility with :class:`~mwpersistence.DiffState`.
+        It reclaims the rows of dead tokens once the number of rows in use
+        has doubled since they were last reclaimed.
+        """
+        if self.size - len(self.free) >= self.reclaim_at:
+            self.reclaim()
+
+    def reclaim(self):
+        """
+        Frees the rows of tokens that aren't in the last version, a version
+        that the revert detector remembers or a live
+        :class:`~mwpersistence.columnar.TokenColumns` so that they can be
+        reused.
+
+        :Returns:
+            The number of rows in use
+        """
+        used = np.zeros(self.size, dtype=bool)
+        used[self.last.rows] = True
+        for _, version in self.revert_detector.history:
+            used[version.rows] = True
+        for view in list(self.views.values()):
+            used[view.rows] = True
+
+        self.free = np.flatnonzero(~used).astype(np.int32)
+        in_use = self.size - len(self.free)
+        self.reclaim_at = max(2 * in_use, MIN_RECLAIM)
+        return in_use
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['views']
+        state['revert_detector'] = detector_state(self.revert_detector)
+        for name in COLUMNS:
+            # Don't store unused capacity
+            state[name] = state[name][:max(self.size, 1)]
+        return state
+
+    def __setstate__(self, state):
+        state['revert_detector'] = restore_detector(*state['revert_detector'])
+        self.__dict__.update(state)
+        # TokenColumns that were unpickled first have registered already
+        _views(self)
+
+    def _update(self, text=None, checksum=None, opdocs=None, revision=None):
+        if checksum is None:
+            if text is None:
+                raise TypeError("Either 'text' or 'checksum' must be " +
+                                "specified.")
+            else:
+                checksum = sha1(bytes(text, 'utf8')).hexdigest()
+
+        user, seconds_visible = revision
+        user_id = self.user_ids.setdefault(user_key(user), len(self.user_ids))
+
+        current_version = Version()
+        empty = self.last.rows[0:0]
+
+        revert = self.revert_detector.process(checksum, current_version)
+        if revert is not None:  # Revert
+            logger.debug("Revert detected between {0} and {1}"
+                         .format(revert.reverting, revert.reverted_to))
+            self.reverts += 1
+            current_version.rows = revert.reverted_to.rows
+
+            # Update diff_processor state.  The reverted-to text is the same
+            # as this one.
+            if self.diff_processor is not None and text is not None:
+                self.diff_processor.update(last_text=text)
+
+            rows, added, removed = current_version.rows, empty, empty
+
+        else:
+            if opdocs is not None:
+                operations = ((op_doc['name'], op_doc['a1'], op_doc['a2'],
+                               op_doc.get('tokens'))
+                              for op_doc in opdocs)
+            else:
+                if self.diff_processor is None:
+                    raise RuntimeError("ColumnarDiffState cannot process " +
+                                       "raw text without a diff_engine " +
+                                       "specified.")
+                ops, _, b = self.diff_processor.process(text)
+                operations = ((op.name, op.a1, op.a2, b[op.b1:op.b2])
+                              for op in ops)
+
+            pieces, added_pieces, removed_pieces = [], [], []
+            for name, a1, a2, tokens in operations:
+                if name in ("replace", "insert"):
+                    new_rows = self._append(tokens, user_id)
+                    pieces.append(new_rows)
+                    added_pieces.append(new_rows)
+
+                if name in ("replace", "delete"):
+                    removed_pieces.append(self.last.rows[a1:a2])
+
+                elif name == "equal":
+                    pieces.append(self.last.rows[a1:a2])
+
+            rows = np.concatenate(pieces) if pieces else empty
+            added = np.concatenate(added_pieces) if added_pieces else empty
+            removed = np.concatenate(removed_pieces) \
+                if removed_pieces else empty
+            current_version.rows = rows
+
+        # Record persistence.  Tokens that were copied are only counted once.
+        present = np.unique(rows)
+        self.persisted[present] += 1
+        self.non_self_persisted[present] += self.user[present] != user_id
+        self.seconds_visible[present] += seconds_visible
+
+        self.epoch += 1
+        self.last = current_version
+
+        return (TokenColumns(self, rows), TokenColumns(self, added),
+                TokenColumns(self, removed))
+
+    def _append(self, tokens, user_id):
+        # Reuse reclaimed rows first
+        reused, self.free = self.free[:len(tokens)], self.free[len(tokens):]
+        start, end = self.size, self.size + len(tokens) - len(reused)
+        if end > len(self.text_id):
+            self._grow(end)
+        rows = np.arange(start, end, dtype=np.int32)
+        if len(reused) > 0:
+            rows = np.concatenate((reused, rows))
+
+        text_ids = self.text_ids
+        texts = self.texts
+        row_text_ids = []
+        for text in tokens:
+            text_id = text_ids.get(text)
+            if text_id is None:
+                if self.interner is not None:
+                    text = self.interner.intern(text)
+                else:
+                    text = str(text)
+                text_id = text_ids[text] = len(texts)
+                texts.append(text)
+            row_text_ids.append(text_id)
+
+        self.text_id[rows] = row_text_ids
+        self.user[rows] = user_id
+        self.birth[rows] = self.epoch
+        self.persisted[rows] = -1
+        self.non_self_persisted[rows] = 0
+        self.seconds_visible[rows] = 0
+        self.size = end
+
+        return rows
+
+    def _grow(self, minimum):
+        capacity = max(minimum, len(self.text_id) * 2)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+
+def _views(state):
+    # A state that is being unpickled might not have its attributes yet
+    views = state.__dict__.get('views')
+    if views is None:
+        views = state.__dict__['views'] = weakref.WeakValueDictionary()
+    return views
@@ -0,0 +1,247 @@
+"""
+A columnar binary format for token persistence data.
+
+Most of the output of :func:`~mwpersistence.utilities.diffs2persistence` is
+the list of token documents in each revision's 'persistence' field.  This
+format stores that list as columns of numbers and the token texts in a
+string dictionary.  :func:`~mwpersistence.utilities.persistence2stats` can
+compute statistics straight from the columns without building a `dict` for
+every token.  Requires `numpy`.
+
+A columnar output is a directory that contains:
+
+* ``revisions.json`` -- One JSON revision document per line.  The
+  'persistence' field has no 'tokens'.
+* ``tokens.npy`` -- The number of tokens that each revision added (`int64`)
+* ``text.npy`` -- The index of each token's text in ``texts.json``
+  (`int32`)
+* ``persisted.npy``, ``non_self_persisted.npy`` (`int32`) and
+  ``seconds_visible.npy`` (`int64`) -- The statistics of each token
+* ``texts.json`` -- The string dictionary.  One JSON string per line.
+
+Tokens are stored in revision order, so the tokens of a revision start at the
+sum of the token counts of the revisions before it.  The ``.npy`` files are
+in the standard :mod:`numpy.lib.format` and can be read with
+:func:`numpy.load`.
+
+.. autoclass:: mwpersistence.columnar_format.ColumnarWriter
+    :members:
+
+.. autoclass:: mwpersistence.columnar_format.ColumnarReader
+    :members:
+"""
+import json
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOKEN_COLUMNS = (('text', '<i4'), ('persisted', '<i4'),
+                 ('non_self_persisted', '<i4'), ('seconds_visible', '<i8'))
+"""
+The name and dtype of each per-token column
+"""
+
+HEADER_SIZE = 128
+"""
+The size of the .npy headers that are written.  Headers are re-written with
+the final length when a column is closed, so they have a fixed size.
+"""
+
+
+class NpyWriter:
+    """
+    Appends values to a one-dimensional .npy file.
+    """
+
+    def __init__(self, path, dtype):
+        self.f = open(path, 'wb')
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.f.write(self._header())
+
+    def write(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        self.f.write(values.tobytes())
+        self.length += len(values)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self._header())
+        self.f.close()
+
+    def _header(self):
+        header = "{{'descr': {0}, 'fortran_order': False, " \
+                 "'shape': ({1},), }}" \
+                 .format(repr(np.lib.format.dtype_to_descr(self.dtype)),
+                         self.length)
+        header = header.ljust(HEADER_SIZE - 11) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + \
+            header.encode('latin1')
+
+
+class ColumnarWriter:
+    """
+    Writes revision documents with a 'persistence' field (see
+    :func:`~mwpersistence.utilities.diffs2persistence`) to a columnar
+    directory.
+
+    :Parameters:
+        path : `str`
+            The path of the directory to write.  It will be created if it
+            doesn't exist.
+        dumps : `func`
+            A function to encode revision documents as JSON
+    """
+
+    def __init__(self, path, dumps=json.dumps):
+        if np is None:
+            raise ImportError("ColumnarWriter requires numpy.")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dumps = dumps
+        self.revisions = open(os.path.join(path, "revisions.json"), 'w',
+                              encoding='utf-8')
+        self.texts = open(os.path.join(path, "texts.json"), 'w',
+                          encoding='utf-8')
+        self.text_ids = {}
+        self.tokens = NpyWriter(os.path.join(path, "tokens.npy"), '<i8')
+        self.columns = [(name, NpyWriter(os.path.join(path, name + ".npy"),
+                                         dtype))
+                        for name, dtype in TOKEN_COLUMNS]
+
+    def write(self, rev_doc):
+        """
+        Writes a revision document.
+        """
+        persistence_doc = rev_doc['persistence']
+        token_docs = persistence_doc.get('tokens') or []
+
+        text_ids = self.text_ids
+        for token_doc in token_docs:
+            text = token_doc['text']
+            if text not in text_ids:
+                text_ids[text] = len(text_ids)
+                self.texts.write(json.dumps(text))
+                self.texts.write("\n")
+
+        for name, column in self.columns:
+            if name == 'text':
+                column.write([text_ids[t['text']] for t in token_docs])
+            else:
+                column.write([t[name] for t in token_docs])
+        self.tokens.write([len(token_docs)])
+
+        rev_doc = dict(rev_doc)
+        rev_doc['persistence'] = {k: v for k, v in persistence_doc.items()
+                                  if k != 'tokens'}
+        self.revisions.write(self.dumps(rev_doc))
+        self.revisions.write("\n")
+
+    def close(self):
+        self.revisions.close()
+        self.texts.close()
+        self.tokens.close()
+        for _, column in self.columns:
+            column.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ColumnarReader:
+    """
+    Reads a columnar directory written by
+    :class:`~mwpersistence.columnar_format.ColumnarWriter`.  Iterating yields
+    the revision documents with their 'tokens' restored.
+
+    :Parameters:
+        path : `str`
+            The path of the directory or of its ``revisions.json``
+        loads : `func`
+            A function to decode revision documents from JSON
+    """
+
+    def __init__(self, path, loads=json.loads):
+        if np is None:
+            raise ImportError("ColumnarReader requires numpy.")
+
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        self.path = path
+        self.loads = loads
+
+        with open(os.path.join(path, "texts.json"), encoding='utf-8') as f:
+            self.texts = [json.loads(line) for line in f]
+        self.tokens = self._load("tokens")
+        self.columns = {name: self._load(name) for name, _ in TOKEN_COLUMNS}
+
+    @classmethod
+    def from_file(cls, f, loads=json.loads):
+        """
+        Constructs a reader from an open ``revisions.json`` (e.g. from
+        :func:`mwcli.files.reader`).
+        """
+        f.close()
+        return cls(f.name, loads=loads)
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name + ".npy"), mmap_mode='r')
+
+    def batches(self, batch_size):
+        """
+        Generates batches of revision documents (without 'tokens') along
+        with their token columns.
+
+        :Returns:
+            A generator of ``(rev_docs, token_counts, columns)`` triples where
+            `columns` maps column names to arrays
+        """
+        start = 0
+        offset = 0
+        rev_docs = []
+        with open(os.path.join(self.path, "revisions.json"),
+                  encoding='utf-8') as f:
+            for line in f:
+                rev_docs.append(self.loads(line))
+                if len(rev_docs) >= batch_size:
+                    token_counts = np.array(
+                        self.tokens[start:start + len(rev_docs)])
+                    end = offset + int(token_counts.sum())
+                    yield rev_docs, token_counts, self._slice(offset, end)
+                    start, offset, rev_docs = \
+                        start + len(rev_docs), end, []
+
+        if len(rev_docs) > 0:
+            token_counts = np.array(self.tokens[start:start + len(rev_docs)])
+            end = offset + int(token_counts.sum())
+            yield rev_docs, token_counts, self._slice(offset, end)
+
+    def _slice(self, start, end):
+        return {name: np.array(column[start:end])
+                for name, column in self.columns.items()}
+
+    def __iter__(self):
+        texts = self.texts
+        names = [name for name, _ in TOKEN_COLUMNS if name != 'text']
+        for rev_docs, token_counts, columns in self.batches(1000):
+            text_ids = columns['text'].tolist()
+            values = [columns[name].tolist() for name in names]
+            offset = 0
+            for rev_doc, count in zip(rev_docs, token_counts.tolist()):
+                token_docs = []
+                for i in range(offset, offset + count):
+                    token_doc = {'text': texts[text_ids[i]]}
+                    for name, column in zip(names, values):
+                        token_doc[name] = column[i]
+                    token_docs.append(token_doc)
+                rev_doc['persistence']['tokens'] = token_docs
+                offset += count
+                yield rev_doc
@@ -0,0 +1,66 @@
+"""
+Interning of token texts.
+
+Most of the token texts in wikitext are repeats (whitespace, punctuation,
+markup and common words).  An :class:`~mwpersistence.interning.Interner` maps
+each distinct text to a single `str` instance so that the copies held in
+diff operations, token documents and string tables share memory and cache
+their hashes.
+
+.. autoclass:: mwpersistence.interning.Interner
+    :members:
+"""
+
+
+class Interner:
+    """
+    Constructs a table of interned token texts.
+
+    :Parameters:
+        maxsize : `int`
+            The maximum number of distinct texts to hold.  Once the table is
+            full, texts that are not already interned are returned as-is.
+        shared : :class:`~mwpersistence.interning.Interner`
+            A (usually cross-page) interner to consult when a text has not
+            been seen by this one.  A shared interner is not pickled along
+            with this one.
+    """
+    __slots__ = ('texts', 'maxsize', 'shared')
+
+    def __init__(self, maxsize=None, shared=None):
+        self.texts = {}
+        self.maxsize = int(maxsize) if maxsize is not None else None
+        self.shared = shared
+
+    def intern(self, text):
+        """
+        Returns the interned instance of `text`.
+        """
+        interned = self.texts.get(text)
+        if interned is not None:
+            return interned
+
+        if text.__class__ is not str:
+            # Don't hold on to tokens or other str subclasses
+            text = str(text)
+        if self.shared is not None:
+            text = self.shared.intern(text)
+
+        if self.maxsize is None or len(self.texts) < self.maxsize:
+            self.texts[text] = text
+
+        return text
+
+    def __getstate__(self):
+        # The shared interner belongs to whoever constructed this one
+        return self.texts, self.maxsize
+
+    def __setstate__(self, state):
+        self.texts, self.maxsize = state
+        self.shared = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __contains__(self, text):
+        return text in self.texts
@@ -0,0 +1,111 @@
+"""
+Pluggable JSON codecs for reading and writing revision documents.
+
+The utilities read and write one JSON document per line.  A faster JSON
+library can be used in place of the standard library's :mod:`json` by
+selecting a codec with ``--json-codec``.  `orjson` and `ujson` are optional
+dependencies.  If a codec's library is not installed, the standard library
+codec is used instead.  Codecs produce equivalent JSON, but whitespace and
+escaping may differ.
+
+.. autoclass:: mwpersistence.json_codecs.JSONCodec
+    :members:
+
+.. autofunction:: mwpersistence.json_codecs.get_codec
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JSONCodec:
+    """
+    Constructs a codec for reading and writing lines of JSON documents.
+
+    :Parameters:
+        name : `str`
+            The name of the codec
+        loads : `func`
+            A function that decodes a `str` into a document
+        dumps : `func`
+            A function that encodes a document as a `str`
+    """
+    __slots__ = ('name', 'loads', 'dumps')
+
+    def __init__(self, name, loads, dumps):
+        self.name = str(name)
+        self.loads = loads
+        self.dumps = dumps
+
+    def read(self, f):
+        """
+        Generates a document for each line of a file.
+        """
+        loads = self.loads
+        return (loads(line) for line in f)
+
+    def write(self, doc, f):
+        """
+        Writes a document to a file as a line.
+        """
+        f.write(self.dumps(doc))
+        f.write("\n")
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, repr(self.name))
+
+
+def _orjson_dumps(doc):
+    import orjson
+    return orjson.dumps(doc).decode('utf-8')
+
+
+def _ujson_dumps(doc):
+    import ujson
+    return ujson.dumps(doc, escape_forward_slashes=False)
+
+
+def _load_json():
+    return JSONCodec("json", json.loads, json.dumps)
+
+
+def _load_orjson():
+    import orjson
+    return JSONCodec("orjson", orjson.loads, _orjson_dumps)
+
+
+def _load_ujson():
+    import ujson
+    return JSONCodec("ujson", ujson.loads, _ujson_dumps)
+
+
+CODECS = {
+    'json': _load_json,
+    'orjson': _load_orjson,
+    'ujson': _load_ujson
+}
+"""
+Maps codec names to functions that construct them
+"""
+
+
+def get_codec(name="json"):
+    """
+    Gets a :class:`~mwpersistence.json_codecs.JSONCodec` by name.  Falls back
+    to the standard library codec if the codec's library is not installed.
+
+    :Parameters:
+        name : `str`
+            One of "json", "orjson" or "ujson"
+    """
+    if name not in CODECS:
+        raise ValueError("JSON codec {0} not supported.  Type {1}"
+                         .format(repr(name), tuple(CODECS.keys())))
+
+    try:
+        return CODECS[name]()
+    except ImportError:
+        logger.warning("{0} is not installed.  Using json instead."
+                       .format(name))
+        return _load_json()
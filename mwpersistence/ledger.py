@@ -0,0 +1,156 @@
+"""
+Lazy persistence accounting for :class:`~mwpersistence.DiffState`.
+
+Rather than marking every token in a page as persisting through every
+revision, a :class:`~mwpersistence.ledger.Ledger` records the sequence of
+revisions processed (one per "epoch") and each live token remembers the epoch
+since which it has been continuously present.  A token's persistence is only
+settled when it is removed or when it is explicitly read.  Maintaining the
+live set only requires looking at the parts of a revision that changed.
+
+.. autoclass:: mwpersistence.ledger.Ledger
+    :members:
+"""
+from bisect import bisect_left
+from collections import Counter
+
+from .util import user_key
+
+
+class Ledger:
+    """
+    Constructs a ledger of the revisions processed for a page.
+    """
+    __slots__ = ('revisions', 'seconds_sums', 'user_epochs', 'indexed')
+
+    def __init__(self):
+        self.revisions = []
+        """
+        The metadata for every revision processed, indexed by epoch.
+        """
+        self.seconds_sums = [0]
+        self.user_epochs = {}
+        self.indexed = 0
+
+    @property
+    def epoch(self):
+        """
+        The epoch of the next revision to be recorded.
+        """
+        return len(self.revisions)
+
+    def record(self, revision):
+        """
+        Records a revision and returns its epoch.
+        """
+        self.revisions.append(revision)
+        return len(self.revisions) - 1
+
+    def seconds_between(self, start, end):
+        """
+        Returns the sum of `seconds_visible` for the ``(user,
+        seconds_visible)`` revisions between epochs `start` and `end`.
+        """
+        self._index()
+        return self.seconds_sums[end] - self.seconds_sums[start]
+
+    def user_revisions_between(self, user, start, end):
+        """
+        Returns the number of ``(user, seconds_visible)`` revisions saved by
+        `user` between epochs `start` and `end`.
+        """
+        self._index()
+        epochs = self.user_epochs.get(user_key(user), [])
+        return bisect_left(epochs, end) - bisect_left(epochs, start)
+
+    def _index(self):
+        for epoch in range(self.indexed, len(self.revisions)):
+            user, seconds_visible = self.revisions[epoch]
+            self.seconds_sums.append(self.seconds_sums[-1] +
+                                     seconds_visible)
+            self.user_epochs.setdefault(user_key(user), []).append(epoch)
+        self.indexed = len(self.revisions)
+
+    def transition(self, a, equal_ranges, tokens_added, revision):
+        """
+        Records a revision that was produced by a diff.
+
+        :Parameters:
+            a : `sequence` ( :class:`~mwpersistence.Token` )
+                The tokens of the last revision
+            equal_ranges : `iterable` ( (`int`, `int`) )
+                The (a1, a2) ranges of the "equal" operations in the diff
+            tokens_added : `list` ( :class:`~mwpersistence.Token` )
+                The tokens that were inserted
+            revision : `mixed`
+                Revision metadata
+        """
+        epoch = self.record(revision)
+
+        # Find the copy count for each span of `a`
+        boundaries = Counter()
+        for a1, a2 in equal_ranges:
+            if a1 < a2:
+                boundaries[a1] += 1
+                boundaries[a2] -= 1
+        boundaries[0] += 0
+        boundaries[len(a)] += 0
+
+        removed_spans = []
+        copies, last = 0, 0
+        for position in sorted(boundaries):
+            if position > last:
+                if copies == 0:
+                    removed_spans.append((last, position))
+                elif copies > 1:
+                    for token in a[last:position]:
+                        self._add_copies(token, copies - 1, epoch)
+            copies += boundaries[position]
+            last = position
+
+        for token in tokens_added:
+            self._add_copies(token, 1, epoch)
+
+        for start, end in removed_spans:
+            for token in a[start:end]:
+                self._remove_copy(token, epoch)
+
+    def revert(self, a, b, revision):
+        """
+        Records a revision that reverted the tokens of the last revision (`a`)
+        back to `b`.
+        """
+        epoch = self.record(revision)
+
+        tokens = {id(token): token for token in a}
+        tokens.update((id(token), token) for token in b)
+        copies = Counter(id(token) for token in b)
+
+        for token_id, token in tokens.items():
+            if copies[token_id] > 0 and token.live_copies == 0:
+                token.live_since = epoch
+            elif copies[token_id] == 0 and token.live_copies > 0:
+                token.persist_span(self, token.live_since, epoch)
+                token.live_since = None
+            token.live_copies = copies[token_id]
+
+    def settle(self, tokens):
+        """
+        Brings the persistence of a set of tokens up to date.
+        """
+        epoch = len(self.revisions)
+        for token in tokens:
+            if token.live_copies > 0 and token.live_since < epoch:
+                token.persist_span(self, token.live_since, epoch)
+                token.live_since = epoch
+
+    def _add_copies(self, token, copies, epoch):
+        if token.live_copies == 0:
+            token.live_since = epoch
+        token.live_copies += copies
+
+    def _remove_copy(self, token, epoch):
+        token.live_copies -= 1
+        if token.live_copies == 0:
+            token.persist_span(self, token.live_since, epoch)
+            token.live_since = None
@@ -0,0 +1,306 @@
+"""
+Low-overhead instrumentation of processing stages.
+
+A :class:`~mwpersistence.metrics.Metrics` records the time spent in each
+stage of processing and counts of the items that passed through it.  Stage
+time is exclusive: when a stage pulls its input from another stage (or calls
+one), the time spent in the other stage is not charged to it.  The utilities
+record these stages:
+
+* ``read`` -- Reading and parsing input
+* ``diff`` -- Diffing revision texts
+* ``state`` -- :class:`~mwpersistence.DiffState` updates
+* ``window`` -- Generating token statistics at the tail of the window
+* ``persistence`` -- The rest of
+  :func:`~mwpersistence.utilities.diffs2persistence`
+* ``stats`` -- :func:`~mwpersistence.utilities.persistence2stats`
+* ``write`` -- Serializing and writing output
+
+and these counters: ``pages``, ``revisions``, ``tokens`` (tokens added),
+``opdocs`` (diff operations processed), ``reverts`` (reverts detected),
+``window_flushes`` (revisions whose statistics were generated when the
+window was flushed at the end of a page), ``spilled`` (revisions written
+to disk while in the window) and ``evictions`` (page states compacted by a
+:class:`~mwpersistence.pool.StatePool`).  The slowest pages are recorded
+too.
+
+Snapshots of the metrics are passed to callbacks every `interval` seconds
+and at the end of processing.  The utilities' ``--metrics=<path>`` option
+dumps them to a JSON file with :func:`~mwpersistence.metrics.json_dumper`.
+When processes are used, the stages that run in the worker processes are
+recorded as a single ``workers`` (``--page-workers``) or ``pipeline``
+(``--pipeline``) stage.
+
+.. autoclass:: mwpersistence.metrics.Metrics
+    :members:
+
+.. autofunction:: mwpersistence.metrics.json_dumper
+"""
+import heapq
+import json
+import os
+import time
+
+
+class Metrics:
+    """
+    Constructs a collector of per-stage timings and counters.
+
+    :Parameters:
+        callbacks : `iterable` ( `func` )
+            Functions to call with a snapshot (see
+            :func:`~mwpersistence.metrics.Metrics.snapshot`) of the metrics
+        interval : `float`
+            The number of seconds between calls to `callbacks`
+        slowest : `int`
+            The number of slowest pages to record
+
+    :Example:
+        >>> from mwpersistence.metrics import Metrics
+        >>> from mwpersistence.utilities import diffs2persistence
+        >>>
+        >>> page = {'id': 1, 'title': "Apples", 'namespace': 0}
+        >>> diff_docs = [
+        ...     {'id': 1, 'sha1': "a", 'timestamp': "1970-01-01T00:00:00Z",
+        ...      'page': page, 'user': {'id': 1, 'text': "Alice"},
+        ...      'diff': {'last_id': None, 'ops': [
+        ...          {'name': "insert", 'a1': 0, 'a2': 0, 'b1': 0, 'b2': 3,
+        ...           'tokens': ["Apples", " ", "red"]}]}},
+        ...     {'id': 2, 'sha1': "b", 'timestamp': "1970-01-01T00:01:00Z",
+        ...      'page': page, 'user': {'id': 2, 'text': "Bob"},
+        ...      'diff': {'last_id': 1, 'ops': [
+        ...          {'name': "equal", 'a1': 0, 'a2': 2, 'b1': 0, 'b2': 2},
+        ...          {'name': "delete", 'a1': 2, 'a2': 3, 'b1': 2, 'b2': 2,
+        ...           'tokens': ["red"]},
+        ...          {'name': "insert", 'a1': 3, 'a2': 3, 'b1': 2, 'b2': 3,
+        ...           'tokens': ["blue"]}]}}]
+        >>>
+        >>> snapshots = []
+        >>> metrics = Metrics(callbacks=[snapshots.append], interval=60)
+        >>> for rev_doc in diffs2persistence(diff_docs, metrics=metrics):
+        ...     pass
+        >>> metrics.report()
+        >>> sorted(snapshots[-1]['counters'].items())
+        [('opdocs', 4), ('reverts', 0), ('tokens', 4), ('window_flushes', 2)]
+    """
+
+    def __init__(self, callbacks=None, interval=60, slowest=10):
+        self.callbacks = list(callbacks or [])
+        self.interval = float(interval)
+        self.slowest = int(slowest)
+        self.stages = {}
+        self.counters = {}
+        self.slow_pages = []
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self._stack = []
+
+    def subscribe(self, callback):
+        """
+        Adds a function to call with snapshots of the metrics.
+        """
+        self.callbacks.append(callback)
+
+    def count(self, name, n=1):
+        """
+        Adds `n` to a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, stage, seconds, items=1):
+        """
+        Adds time and items to a stage.
+        """
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = [0.0, 0]
+        totals[0] += seconds
+        totals[1] += items
+
+    def timer(self, stage, items=1):
+        """
+        Returns a context manager that charges the time spent in it (and
+        `items`) to `stage`.
+        """
+        return _Timer(self, stage, items)
+
+    def timed(self, stage, iterable):
+        """
+        Charges the time spent producing the items of `iterable` to `stage`.
+
+        :Returns:
+            A generator of the items
+        """
+        iterator = iter(iterable)
+        stack = self._stack
+        clock = time.perf_counter
+        while True:
+            stack.append(0.0)
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._pop(stage, clock() - start, 0)
+                return
+            except BaseException:
+                self._pop(stage, clock() - start, 0)
+                raise
+            self._pop(stage, clock() - start, 1)
+            yield item
+
+    def pages(self, docs, page_id):
+        """
+        Counts the pages and revisions of a page-partitioned sequence of
+        output documents, records the slowest pages and reports every
+        `interval` seconds.  The time spent consuming each document is
+        charged to the ``write`` stage.
+
+        :Parameters:
+            docs : `iterable`
+                Output documents
+            page_id : `func`
+                A function that returns the page id of a document
+
+        :Returns:
+            A generator of the documents
+        """
+        clock = time.perf_counter
+        current, seconds, revisions = None, 0.0, 0
+        start = clock()
+        for doc in docs:
+            produced = clock()
+            doc_page_id = page_id(doc)
+            if doc_page_id != current:
+                if current is not None:
+                    self.page(current, seconds, revisions)
+                current, seconds, revisions = doc_page_id, 0.0, 0
+            seconds += produced - start
+            revisions += 1
+            self.count('revisions')
+
+            if produced - self.reported >= self.interval:
+                self.report()
+
+            yield doc
+            start = clock()
+            self.record('write', start - produced)
+
+        if current is not None:
+            self.page(current, seconds, revisions)
+
+    def page(self, page_id, seconds, revisions):
+        """
+        Records the processing time of a page.
+        """
+        self.count('pages')
+        entry = (seconds, page_id, revisions)
+        if len(self.slow_pages) < self.slowest:
+            heapq.heappush(self.slow_pages, entry)
+        elif self.slowest > 0 and entry > self.slow_pages[0]:
+            heapq.heapreplace(self.slow_pages, entry)
+
+    def snapshot(self):
+        """
+        Returns the current metrics as a JSON-able `dict` with 'elapsed',
+        'stages', 'counters', 'rates' and 'slowest_pages' fields.
+        """
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for stage, (seconds, items) in self.stages.items():
+            stages[stage] = {
+                'seconds': seconds,
+                'items': items,
+                'items_per_second': items / seconds if seconds > 0 else None
+            }
+        rates = {name + "_per_second": count / elapsed if elapsed > 0
+                 else None
+                 for name, count in self.counters.items()}
+        slowest_pages = [{'page_id': page_id, 'seconds': seconds,
+                          'revisions': revisions}
+                         for seconds, page_id, revisions in
+                         sorted(self.slow_pages, reverse=True)]
+        return {'elapsed': elapsed, 'stages': stages,
+                'counters': dict(self.counters), 'rates': rates,
+                'slowest_pages': slowest_pages}
+
+    def report(self):
+        """
+        Calls the callbacks with a snapshot of the metrics.
+        """
+        self.reported = time.perf_counter()
+        if len(self.callbacks) > 0:
+            snapshot = self.snapshot()
+            for callback in self.callbacks:
+                callback(snapshot)
+
+    def _pop(self, stage, elapsed, items):
+        stack = self._stack
+        nested = stack.pop()
+        if len(stack) > 0:
+            stack[-1] += elapsed
+        self.record(stage, elapsed - nested, items)
+
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'items', 'start')
+
+    def __init__(self, metrics, stage, items=1):
+        self.metrics = metrics
+        self.stage = stage
+        self.items = items
+
+    def __enter__(self):
+        self.metrics._stack.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics._pop(self.stage, time.perf_counter() - self.start,
+                          self.items)
+
+
+class NullMetrics:
+    """
+    A stand-in for :class:`~mwpersistence.metrics.Metrics` that records
+    nothing.
+    """
+
+    def count(self, name, n=1):
+        pass
+
+    def timer(self, stage, items=1):
+        return _NULL_TIMER
+
+    def timed(self, stage, iterable):
+        return iterable
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+NO_METRICS = NullMetrics()
+
+
+def json_dumper(path):
+    """
+    Returns a callback for :class:`~mwpersistence.metrics.Metrics` that
+    (over)writes each snapshot to a JSON file.  The file is replaced
+    atomically, so it can be read while processing is running.
+    """
+    def dump(snapshot):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp_path, path)
+
+    return dump
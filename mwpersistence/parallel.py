@@ -0,0 +1,254 @@
+"""
+Parallel processing of a single page-partitioned stream of revision
+documents.
+
+:func:`~mwpersistence.parallel.map_pages` splits a stream between worker
+processes at page boundaries.  :func:`~mwpersistence.parallel.run_pipeline`
+runs the stages of processing (e.g. diffing, persistence and statistics)
+in separate processes that are connected by bounded queues, so that the
+stages overlap.
+
+.. autofunction:: mwpersistence.parallel.map_pages
+
+.. autofunction:: mwpersistence.parallel.run_pipeline
+"""
+import logging
+import multiprocessing
+import pickle
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+from queue import Empty
+
+logger = logging.getLogger(__name__)
+
+_worker = None
+"""
+The (process, kwargs) to apply to pages in a worker process.  Set by
+:func:`~mwpersistence.parallel._initialize` so that it doesn't need to be
+pickled.
+"""
+
+
+def map_pages(process, rev_docs, workers, buffer_size=None, **kwargs):
+    """
+    Splits a page-partitioned sequence of revision documents at page
+    boundaries and applies `process` to the documents of each page in a pool
+    of worker processes.  Output is yielded in input order.  In a daemonic
+    process, which can't start workers, the pages are processed serially.
+
+    :Parameters:
+        process : `func`
+            A function that takes a list of revision documents (and `kwargs`)
+            and returns an iterable of output documents
+        rev_docs : `iterable` ( `dict` )
+            Revision documents partitioned by page
+        workers : `int`
+            The number of worker processes to start
+        buffer_size : `int`
+            The maximum number of pages that can be in flight (or waiting to
+            be yielded in order) at any one time.  Defaults to 4 x `workers`.
+        kwargs : `mixed`
+            Extra arguments to pass to `process`.  These are inherited by the
+            worker processes rather than pickled, so lambdas are OK.
+
+    :Returns:
+        A generator of the output documents
+    """
+    workers = int(workers)
+    buffer_size = int(buffer_size or workers * 4)
+
+    page_docs = (list(docs) for _, docs in
+                 groupby(rev_docs, key=lambda d: d['page']['title']))
+
+    if not _can_fork():
+        logger.warning("Processing pages serially since daemonic processes "
+                       "can't start page workers")
+        for docs in page_docs:
+            yield from process(docs, **kwargs)
+        return
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_initialize,
+                             initargs=(process, kwargs)) as executor:
+        pending = deque()
+        for docs in page_docs:
+            if len(pending) >= buffer_size:
+                yield from pending.popleft().result()
+
+            pending.append(executor.submit(_process_page, docs))
+
+        while len(pending) > 0:
+            yield from pending.popleft().result()
+
+
+def _can_fork():
+    """
+    Daemonic processes (e.g. those that :func:`para.map` reads several input
+    files in) aren't allowed to start processes of their own.
+    """
+    return not multiprocessing.current_process().daemon
+
+
+def _initialize(process, kwargs):
+    global _worker
+    _worker = (process, kwargs)
+
+
+def _process_page(docs):
+    process, kwargs = _worker
+    return list(process(docs, **kwargs))
+
+
+def run_pipeline(docs, stages, queue_size=8, chunk_size=64):
+    """
+    Applies a chain of stages to a sequence of documents.  Each stage runs
+    in its own worker process and passes its output to the next stage
+    through a bounded queue, so a stage that gets ahead of the stages after
+    it blocks until they catch up.  The output of the last stage is yielded
+    in order in this process.  A stage that dies without finishing (e.g.
+    because it was killed) raises a :class:`RuntimeError`.  In a daemonic
+    process, which can't start stage processes, the stages are chained
+    serially.
+
+    :Parameters:
+        docs : `iterable` ( `dict` )
+            The input documents.  They are read in the first stage's process,
+            so reading and parsing input overlaps with the other stages.
+        stages : `list` ( `func` )
+            Functions that take an iterable of documents and return an
+            iterable of output documents.  They are inherited by the worker
+            processes rather than pickled, so closures are OK.
+        queue_size : `int`
+            The maximum number of chunks waiting between two stages
+        chunk_size : `int`
+            The number of documents sent between stages at a time
+
+    :Returns:
+        A generator of the output documents of the last stage
+    """
+    if len(stages) == 0:
+        yield from docs
+        return
+
+    if not _can_fork():
+        logger.warning("Running pipeline stages serially since daemonic "
+                       "processes can't start stage processes")
+        for stage in stages:
+            docs = stage(docs)
+        yield from docs
+        return
+
+    context = multiprocessing.get_context("fork")
+    processes = []
+    input_ = docs
+    for stage in stages:
+        queue = context.Queue(int(queue_size))
+        process = context.Process(target=_run_stage,
+                                  args=(stage, input_, queue,
+                                        int(chunk_size)),
+                                  daemon=True)
+        process.start()
+        processes.append(process)
+        input_ = _receive(queue)
+
+    try:
+        # Only this process can check on the stages, so it's the one that
+        # notices if a stage dies
+        yield from _receive(queue, processes)
+    except _Forward as forward:
+        for line in forward.failure.traceback.splitlines():
+            logger.error(line)
+        raise forward.failure.error
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+class _Failure:
+    __slots__ = ('error', 'traceback')
+
+    def __init__(self, error, traceback):
+        self.error = error
+        self.traceback = traceback
+
+
+class _Forward(Exception):
+    def __init__(self, failure):
+        super().__init__()
+        self.failure = failure
+
+
+_DONE = "done"
+
+POLL_SECONDS = 1
+"""
+How often the stages of a pipeline are checked while waiting for output
+"""
+
+
+def _run_stage(stage, docs, output, chunk_size):
+    try:
+        output_docs = iter(stage(docs))
+        while True:
+            chunk = list(islice(output_docs, chunk_size))
+            if len(chunk) == 0:
+                break
+            output.put(chunk)
+    except _Forward as forward:
+        output.put(forward.failure)
+    except BaseException as e:
+        try:
+            pickle.dumps(e)
+            error = e
+        except Exception:
+            error = RuntimeError(repr(e))
+        output.put(_Failure(error, traceback.format_exc()))
+    else:
+        output.put(_DONE)
+    output.close()
+    output.join_thread()
+
+
+def _receive(queue, processes=None, timeout=POLL_SECONDS):
+    """
+    Reads the chunks that a stage puts on a queue.  If `processes` are
+    provided, they are checked whenever the queue has been empty for
+    `timeout` seconds, so that a stage that dies without finishing raises an
+    error rather than leaving the reader waiting forever.
+    """
+    finished = False
+    while True:
+        if processes is None:
+            chunk = queue.get()
+        else:
+            try:
+                chunk = queue.get(timeout=timeout)
+            except Empty:
+                exitcodes = [process.exitcode for process in processes]
+                for i, exitcode in enumerate(exitcodes):
+                    if exitcode:
+                        raise RuntimeError(
+                            "Pipeline stage {0} exited with code {1}"
+                            .format(i, exitcode))
+
+                # A stage flushes its output before it exits, so an empty
+                # queue after the last stage has exited means that its
+                # output was never finished
+                if finished:
+                    raise RuntimeError(
+                        "Pipeline stage {0} exited before it finished"
+                        .format(len(processes) - 1))
+                finished = exitcodes[-1] is not None
+                continue
+
+        if chunk == _DONE:
+            return
+        elif isinstance(chunk, _Failure):
+            raise _Forward(chunk)
+        else:
+            yield from chunk
@@ -0,0 +1,180 @@
+"""
+A pool of per-page states for revision streams that are not partitioned by
+page.
+
+:func:`~mwpersistence.utilities.diffs2persistence` normally expects the
+revisions of each page to be grouped together, so it only needs to keep
+the state of one page at a time.  A feed of recent changes interleaves the
+revisions of many pages instead.  A :class:`~mwpersistence.pool.StatePool`
+keeps the state of each page keyed by page id.  The states of recently active
+pages are kept in memory.  When there are more than `max_pages` of them or
+their estimated size passes `max_bytes`, the least recently used states are
+evicted to temporary files (see :class:`~mwpersistence.spill.SpillFile`) until
+the page's next revision arrives.  Only a small reference to each evicted
+state stays in memory, so `max_pages` and `max_bytes` bound the memory used by
+the pool.
+
+States are pickled by default.  A pool can be given functions that write
+states more compactly (e.g. :func:`~mwpersistence.DiffState.dump`).
+
+.. autoclass:: mwpersistence.pool.StatePool
+    :members:
+"""
+import io
+import pickle
+from collections import OrderedDict
+
+from .spill import SpillFile
+
+
+def _dump(state, fp):
+    pickle.dump(state, fp, pickle.HIGHEST_PROTOCOL)
+
+
+class StatePool:
+    """
+    Constructs a pool of page states with least-recently-used eviction.
+
+    :Parameters:
+        max_pages : `int`
+            The maximum number of states to keep in memory
+        max_bytes : `int`
+            If set, states are also evicted while the estimated size of the
+            states in memory is more than this many bytes
+        sizeof : `func`
+            A function that estimates the size of a state in bytes
+        dump : `func`
+            A function that writes a state to a binary file.  Defaults to
+            pickling.
+        load : `func`
+            A function that reads a state written by `dump` from a binary
+            file.  Defaults to unpickling.
+        directory : `str`
+            The directory to write evicted states to.  Defaults to the
+            system's temporary directory.
+
+    :Example:
+        >>> from mwpersistence.pool import StatePool
+        >>>
+        >>> pool = StatePool(max_pages=2)
+        >>> for page_id in [1, 2, 3]:
+        ...     pool.put(page_id, {'revisions': [page_id]})
+        ...
+        >>> pool.evictions, len(pool)
+        (1, 3)
+        >>> pool.get(1)
+        {'revisions': [1]}
+    """
+
+    def __init__(self, max_pages=1000, max_bytes=None, sizeof=None,
+                 dump=None, load=None, directory=None):
+        self.max_pages = max(int(max_pages), 1)
+        self.max_bytes = int(max_bytes) if max_bytes is not None else None
+        self.sizeof = sizeof or (lambda state: 0)
+        self.dump = dump or _dump
+        self.load = load or pickle.load
+        self.spill = SpillFile(directory)
+        self.states = OrderedDict()
+        self.evicted = {}
+        self.nbytes = 0
+        self.evictions = 0
+        self.restores = 0
+
+    def get(self, page_id, default=None):
+        """
+        Gets the state of a page and marks it as recently used.  Evicted
+        states are restored.
+        """
+        if page_id in self.states:
+            self.states.move_to_end(page_id)
+            state, _ = self.states[page_id]
+            return state
+        elif page_id in self.evicted:
+            state = self._restore(page_id)
+            self.restores += 1
+            self._keep(page_id, state)
+            return state
+        else:
+            return default
+
+    def put(self, page_id, state):
+        """
+        Sets the state of a page, marks it as recently used and evicts other
+        states as necessary.  Call again after a state has changed so that
+        its size is re-estimated.
+        """
+        if page_id in self.evicted:
+            self.spill.load_bytes(self.evicted.pop(page_id))
+        self._keep(page_id, state)
+
+    def pop(self, page_id, default=None):
+        """
+        Removes the state of a page from the pool and returns it.
+        """
+        if page_id in self.states:
+            state, size = self.states.pop(page_id)
+            self.nbytes -= size
+            return state
+        elif page_id in self.evicted:
+            return self._restore(page_id)
+        else:
+            return default
+
+    def drain(self):
+        """
+        Removes every state from the pool.
+
+        :Returns:
+            A generator of ``(page_id, state)`` pairs, least recently used
+            first
+        """
+        for page_id in list(self.evicted.keys()):
+            yield page_id, self.pop(page_id)
+        while len(self.states) > 0:
+            page_id = next(iter(self.states))
+            yield page_id, self.pop(page_id)
+
+    def evicted_bytes(self):
+        """
+        Returns the size of the evicted states on disk.
+        """
+        return sum(ref.length for ref in self.evicted.values())
+
+    def close(self):
+        """
+        Deletes the temporary files that hold evicted states.
+        """
+        self.spill.close()
+
+    def _keep(self, page_id, state):
+        if page_id in self.states:
+            _, size = self.states.pop(page_id)
+            self.nbytes -= size
+        size = self.sizeof(state)
+        self.states[page_id] = (state, size)
+        self.nbytes += size
+
+        # Never evict the state that was just kept
+        while len(self.states) > 1 and \
+                (len(self.states) > self.max_pages or
+                 (self.max_bytes is not None and
+                  self.nbytes > self.max_bytes)):
+            self._evict()
+
+    def _evict(self):
+        page_id, (state, size) = self.states.popitem(last=False)
+        self.nbytes -= size
+        f = io.BytesIO()
+        self.dump(state, f)
+        self.evicted[page_id] = self.spill.dump_bytes(f.getvalue())
+        self.evictions += 1
+
+    def _restore(self, page_id):
+        f = io.BytesIO(self.spill.load_bytes(self.evicted.pop(page_id)))
+        return self.load(f)
+
+    def __contains__(self, page_id):
+        return page_id in self.states or page_id in self.evicted
+
+    def __len__(self):
+        return len(self.states) + len(self.evicted)
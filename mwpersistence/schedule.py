@@ -0,0 +1,367 @@
+"""
+Scheduling of input files between processes.
+
+When several inputs are processed (see ``--threads``), each input is a task
+and idle processes take the next task in order.  Tasks are ordered by their
+estimated cost, most expensive first, so that a large input doesn't start
+last and run long after every other process has finished.  The cost of a
+task is the size of its file.  With ``--prescan``, the inputs are read once
+before processing starts and the cost is estimated from their decompressed
+size and number of revisions instead.
+
+Large multistream bz2 XML dumps (``*-multistream.xml.bz2``) can be split
+into several tasks with ``--split=<MB>``.  A multistream dump is a series of
+independent bz2 streams.  The first holds the dump's header and each of the
+others holds a group of whole pages, so the dump can be split at the start
+of any stream without splitting a page.  A part is read with the header
+prepended (and the closing tag appended), so it can be parsed as a dump of
+its own.  Each part writes its own output file, named after the input with a
+``.part-<n>`` suffix.
+
+Inputs that aren't paths (e.g. `<stdin>`) are read once, as they are, so they
+are never split or prescanned.
+
+.. autoclass:: mwpersistence.schedule.Task
+    :members:
+
+.. autofunction:: mwpersistence.schedule.schedule
+
+.. autofunction:: mwpersistence.schedule.split_multistream
+
+.. autofunction:: mwpersistence.schedule.is_stream
+"""
+import bz2
+import io
+import logging
+import os
+import re
+import sys
+from collections import deque
+from functools import partial
+
+import para
+from mwcli import files
+
+logger = logging.getLogger(__name__)
+
+REVISION_BYTES = 4096
+"""
+The cost of processing a revision, beyond reading its data, in bytes of
+decompressed input
+"""
+
+STREAM_MAGIC = re.compile(rb"BZh[1-9]1AY&SY")
+"""
+Matches the start of a bz2 stream
+"""
+
+SCAN_BYTES = 2 ** 20
+"""
+The number of bytes read at a time while searching for the start of a stream
+"""
+
+VERIFY_BYTES = 2 ** 23
+"""
+The maximum number of bytes to decompress while checking that a stream
+starts with a page
+"""
+
+CLOSING_STREAM = bz2.compress(b"</mediawiki>\n")
+
+
+class Task:
+    """
+    Constructs a task that processes an input file or a range of the streams
+    of a multistream bz2 dump.
+
+    :Parameters:
+        path : `str` | `file`
+            The path of the input file, a file object or ``"-"`` for
+            `<stdin>`
+        part : `int`
+            The number of the part of the file.  `None` for a whole file.
+        start : `int`
+            The offset of the first stream of the part
+        end : `int`
+            The offset after the last stream of the part
+        header_end : `int`
+            The offset after the dump's header stream
+        size : `int`
+            The size of the file.  `None` for a file object or `<stdin>`.
+    """
+    __slots__ = ('path', 'part', 'start', 'end', 'header_end', 'size',
+                 'revisions', 'bytes')
+
+    def __init__(self, path, part=None, start=0, end=None, header_end=None,
+                 size=None):
+        self.part = part
+        self.start = int(start)
+        self.header_end = header_end
+        self.revisions = None
+        self.bytes = None
+        if is_stream(path):
+            self.path, self.size, self.end = path, None, None
+        else:
+            self.path = str(path)
+            self.size = int(size if size is not None
+                            else os.path.getsize(path))
+            self.end = int(end if end is not None else self.size)
+
+    @property
+    def stream(self):
+        """
+        `True` if the input is a file object or `<stdin>` rather than a file
+        """
+        return self.size is None
+
+    @property
+    def name(self):
+        """
+        The file name that output paths are based on.
+        """
+        if self.stream:
+            return str(getattr(self.path, 'name', "<stdin>"))
+        elif self.part is None:
+            return os.path.basename(self.path)
+        else:
+            filename, extension = os.path.basename(self.path).rsplit(".", 1)
+            return "{0}.part-{1:04d}.{2}".format(filename, self.part,
+                                                 extension)
+
+    @property
+    def cost(self):
+        """
+        The estimated cost of the task
+        """
+        if self.revisions is not None:
+            return self.bytes + self.revisions * REVISION_BYTES
+        elif self.stream:
+            return 0
+        else:
+            return self.end - self.start
+
+    def open(self):
+        """
+        Opens the input of the task as a file of decompressed text.
+        """
+        if self.path == "-":
+            return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        elif self.part is None:
+            return files.reader(self.path)
+
+        ranges = [(self.start, self.end)]
+        if self.start > 0:
+            ranges.insert(0, (0, self.header_end))
+        tail = CLOSING_STREAM if self.end < self.size else b""
+        return io.TextIOWrapper(bz2.BZ2File(_Ranges(self.path, ranges, tail)),
+                                encoding='utf-8', errors='replace')
+
+    def prescan(self, marker=None):
+        """
+        Reads the input to record its decompressed size and number of
+        revisions.
+
+        :Parameters:
+            marker : `str`
+                Counts the lines that contain `marker` as revisions.  If not
+                set, every line is a revision (e.g. JSON revision documents).
+        """
+        if self.stream:
+            raise RuntimeError("{0} can't be prescanned.".format(self.name))
+        revisions, size = 0, 0
+        with self.open() as f:
+            for line in f:
+                size += len(line)
+                if marker is None or marker in line:
+                    revisions += 1
+        self.revisions, self.bytes = revisions, size
+        return self
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, repr(self.name))
+
+
+class _Ranges(io.RawIOBase):
+    """
+    Reads byte ranges of a file and then `tail` as one stream.
+    """
+
+    def __init__(self, path, ranges, tail=b""):
+        self.f = open(path, 'rb')
+        self.ranges = deque(ranges)
+        self.tail = tail
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.ranges) > 0:
+            start, end = self.ranges[0]
+            if start < end:
+                self.f.seek(start)
+                data = self.f.read(min(len(buffer), end - start))
+                if len(data) > 0:
+                    self.ranges[0] = (start + len(data), end)
+                    buffer[:len(data)] = data
+                    return len(data)
+            self.ranges.popleft()
+
+        data, self.tail = self.tail[:len(buffer)], self.tail[len(buffer):]
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def split_multistream(path, split_bytes):
+    """
+    Splits a multistream bz2 XML dump into tasks of about `split_bytes`
+    (compressed) at stream boundaries.  Returns a single task for the whole
+    file if it can't be split.
+
+    :Parameters:
+        path : `str`
+            The path of the dump
+        split_bytes : `int`
+            The approximate size of each part
+
+    :Returns:
+        A list of :class:`~mwpersistence.schedule.Task`
+    """
+    split_bytes = max(int(split_bytes), 1)
+    size = os.path.getsize(path)
+    if not path.endswith(".bz2") or size <= split_bytes:
+        return [Task(path, size=size)]
+
+    with open(path, 'rb') as f:
+        header_end = find_page_stream(f, 1)
+        if header_end is None:
+            return [Task(path, size=size)]
+
+        f.seek(0)
+        header = bz2.BZ2Decompressor().decompress(f.read(header_end))
+        if b"<page" in header:
+            # The first stream holds pages too.  Parts can't share it.
+            return [Task(path, size=size)]
+
+        boundaries = [0]
+        offset = split_bytes
+        while offset < size:
+            boundary = find_page_stream(f, offset)
+            if boundary is None:
+                break
+            boundaries.append(boundary)
+            offset = boundary + split_bytes
+
+    if len(boundaries) == 1:
+        return [Task(path, size=size)]
+
+    return [Task(path, part=i, start=start, end=end, header_end=header_end,
+                 size=size)
+            for i, (start, end) in
+            enumerate(zip(boundaries, boundaries[1:] + [size]))]
+
+
+def find_page_stream(f, offset):
+    """
+    Finds the offset of the first bz2 stream at or after `offset` in a
+    binary file that starts with a ``<page>``.  Returns `None` if there is
+    none.
+    """
+    overlap = 9
+    while True:
+        f.seek(offset)
+        chunk = f.read(SCAN_BYTES)
+        if len(chunk) == 0:
+            return None
+
+        for match in STREAM_MAGIC.finditer(chunk):
+            if _starts_page(f, offset + match.start()):
+                return offset + match.start()
+
+        if len(chunk) < SCAN_BYTES:
+            return None
+        offset += len(chunk) - overlap
+
+
+def _starts_page(f, offset):
+    decompressor = bz2.BZ2Decompressor()
+    f.seek(offset)
+    data, read = b"", 0
+    while read < VERIFY_BYTES and len(data.lstrip()) < 5:
+        if decompressor.needs_input:
+            chunk = f.read(2 ** 16)
+            if len(chunk) == 0:
+                break
+            read += len(chunk)
+        else:
+            chunk = b""
+        try:
+            data += decompressor.decompress(chunk, max_length=64)
+        except (OSError, EOFError):
+            return False
+        if decompressor.eof:
+            break
+    return data.lstrip().startswith(b"<page")
+
+
+def schedule(paths, split_bytes=None, prescan=False, marker=None,
+             threads=None):
+    """
+    Constructs the tasks for processing a set of input files, most expensive
+    first.
+
+    :Parameters:
+        paths : `list` ( `str` | `file` )
+            Paths of input files (or file objects, see
+            :func:`~mwpersistence.schedule.is_stream`)
+        split_bytes : `int`
+            If set, multistream bz2 dumps are split into parts of about this
+            many bytes (see
+            :func:`~mwpersistence.schedule.split_multistream`)
+        prescan : `bool`
+            Read the inputs before processing to estimate their cost (see
+            :func:`~mwpersistence.schedule.Task.prescan`)
+        marker : `str`
+            Identifies the lines of the input that start a revision when
+            prescanning
+        threads : `int`
+            The number of processes to prescan with
+
+    :Returns:
+        A list of :class:`~mwpersistence.schedule.Task`
+    """
+    tasks = []
+    for path in paths:
+        if is_stream(path):
+            tasks.append(Task(path))
+        elif split_bytes is not None:
+            tasks.extend(split_multistream(path, split_bytes))
+        else:
+            tasks.append(Task(path))
+
+    if prescan:
+        # Streams can only be read once
+        streams = [task for task in tasks if task.stream]
+        scanned = [task for task in tasks if not task.stream]
+        if len(scanned) > 0:
+            scanned = list(para.map(partial(_prescan, marker=marker),
+                                    scanned, mappers=threads))
+        tasks = streams + scanned
+
+    tasks.sort(key=lambda task: task.cost, reverse=True)
+    return tasks
+
+
+def is_stream(path):
+    """
+    Returns `True` if an input is a file object or ``"-"`` (`<stdin>`) rather
+    than the path of a file.
+    """
+    return hasattr(path, 'read') or path == "-"
+
+
+def _prescan(task, marker=None):
+    yield task.prescan(marker)
@@ -0,0 +1,202 @@
+"""
+A persistent sequence type for representing the tokens of a revision.
+
+:class:`~mwpersistence.sequence.TokenSequence` is a rope -- a balanced tree of
+token runs.  Slicing and concatenation share the existing runs rather than
+copying them, so building the tokens of a new revision from the "equal"
+operations of a diff costs O(edit * log(n)) rather than O(n) and successive
+revisions share most of their memory.
+
+.. autoclass:: mwpersistence.sequence.TokenSequence
+    :members:
+"""
+CHUNK_SIZE = 64
+"""
+The maximum number of tokens that will be merged into a single run.
+"""
+
+
+class _Node:
+    __slots__ = ('left', 'right', 'length', 'height')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = _length(left) + _length(right)
+        self.height = max(_height(left), _height(right)) + 1
+
+
+def _length(node):
+    return node.length if node.__class__ is _Node else len(node)
+
+
+def _height(node):
+    return node.height if node.__class__ is _Node else 0
+
+
+def _balance(left, right):
+    left_height, right_height = _height(left), _height(right)
+    if left_height > right_height + 1:
+        if _height(left.left) >= _height(left.right):
+            return _Node(left.left, _Node(left.right, right))
+        else:
+            middle = left.right
+            return _Node(_Node(left.left, middle.left),
+                         _Node(middle.right, right))
+    elif right_height > left_height + 1:
+        if _height(right.right) >= _height(right.left):
+            return _Node(_Node(left, right.left), right.right)
+        else:
+            middle = right.left
+            return _Node(_Node(left, middle.left),
+                         _Node(middle.right, right.right))
+    else:
+        return _Node(left, right)
+
+
+def _join(left, right):
+    if left is None or _length(left) == 0:
+        return right
+    elif right is None or _length(right) == 0:
+        return left
+
+    left_height, right_height = _height(left), _height(right)
+    if left_height > right_height + 1:
+        return _balance(left.left, _join(left.right, right))
+    elif right_height > left_height + 1:
+        return _balance(_join(left, right.left), right.right)
+    elif left_height == 0 and right_height == 0 and \
+            len(left) + len(right) <= CHUNK_SIZE:
+        # Merge small runs so that the tree doesn't fragment
+        return left + right
+    else:
+        return _Node(left, right)
+
+
+def _slice(node, start, stop):
+    if start >= stop:
+        return None
+    elif start <= 0 and stop >= _length(node):
+        return node
+    elif node.__class__ is not _Node:
+        return node[start:stop]
+
+    left_length = _length(node.left)
+    if stop <= left_length:
+        return _slice(node.left, start, stop)
+    elif start >= left_length:
+        return _slice(node.right, start - left_length, stop - left_length)
+    else:
+        return _join(_slice(node.left, start, left_length),
+                     _slice(node.right, 0, stop - left_length))
+
+
+def _build(tokens):
+    nodes = [tuple(tokens[i:i + CHUNK_SIZE])
+             for i in range(0, len(tokens), CHUNK_SIZE)]
+    if len(nodes) == 0:
+        return None
+
+    while len(nodes) > 1:
+        paired = [_Node(nodes[i], nodes[i + 1])
+                  for i in range(0, len(nodes) - 1, 2)]
+        if len(nodes) % 2 == 1:
+            paired[-1] = _join(paired[-1], nodes[-1])
+        nodes = paired
+
+    return nodes[0]
+
+
+def _runs(node):
+    stack = [node] if node is not None else []
+    while stack:
+        node = stack.pop()
+        if node.__class__ is _Node:
+            stack.append(node.right)
+            stack.append(node.left)
+        else:
+            yield node
+
+
+class TokenSequence:
+    """
+    Constructs a persistent sequence of tokens.  Slices of a `TokenSequence`
+    are `TokenSequence`s that share structure with the original and
+    :func:`~mwpersistence.sequence.TokenSequence.extend` shares the structure
+    of any `TokenSequence` it is passed.  This makes it a drop-in replacement
+    for `list` in :class:`~mwpersistence.DiffState`.
+
+    :Parameters:
+        tokens : `iterable`
+            Tokens to initialize the sequence with
+    """
+    __slots__ = ('root',)
+
+    def __init__(self, tokens=None):
+        self.root = None
+        if tokens is not None:
+            self.extend(tokens)
+
+    def extend(self, tokens):
+        """
+        Appends a sequence of tokens to the end of this sequence.
+        """
+        if isinstance(tokens, TokenSequence):
+            self.root = _join(self.root, tokens.root)
+        else:
+            self.root = _join(self.root, _build(list(tokens)))
+
+    def runs(self):
+        """
+        Iterates over the runs of tokens that make up the sequence.
+        """
+        return _runs(self.root)
+
+    def __len__(self):
+        return _length(self.root) if self.root is not None else 0
+
+    def __iter__(self):
+        for run in _runs(self.root):
+            yield from run
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return TokenSequence(list(self)[index])
+
+            sequence = TokenSequence()
+            if self.root is not None:
+                sequence.root = _slice(self.root, start, stop)
+            return sequence
+        else:
+            length = len(self)
+            if index < 0:
+                index += length
+            if index < 0 or index >= length:
+                raise IndexError("TokenSequence index out of range")
+
+            node = self.root
+            while node.__class__ is _Node:
+                left_length = _length(node.left)
+                if index < left_length:
+                    node = node.left
+                else:
+                    index -= left_length
+                    node = node.right
+            return node[index]
+
+    def __eq__(self, other):
+        try:
+            if len(self) != len(other):
+                return False
+        except TypeError:
+            return False
+
+        return all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, repr(list(self)))
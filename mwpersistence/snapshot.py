@@ -0,0 +1,596 @@
+"""
+A compact binary snapshot format for :class:`~mwpersistence.DiffState`.
+
+Pickling a :class:`~mwpersistence.DiffState` writes every token as an object
+of its own, with its slots and class reference, and memoizes the revision
+metadata and texts that tokens share one reference at a time.  That is slow to
+write and to read for large pages.  A snapshot stores the same state as
+tables instead:
+
+* **strings** -- every distinct token text and type, once
+* **meta** -- JSON of everything that isn't a token: the distinct objects
+  (e.g. revision metadata) that token slots refer to, the revert detector's
+  checksums, the ledger and the authorship indexes.  Objects may be `None`,
+  `bool`, `int`, `float`, `str`, `list`, `tuple` or `dict`.  Tuples and
+  dicts are written as ``{"tuple": [...]}`` and
+  ``{"dict": [[key, value], ...]}``.
+* **tokens** -- one column per token slot.  Integer slots are stored as arrays
+  of the narrowest integer type that fits them and the rest as indexes into
+  the objects of the meta section.  Lists (e.g. :class:`~mwpersistence.Token`
+  `revisions`) are stored as runs of consecutive indexes, so the revisions
+  that a token persisted through cost a few bytes rather than a few bytes
+  each.
+* **versions** -- the tokens of each version in the revert detector's history
+  (and the current version) as runs of indexes into the token table, so
+  versions share their tokens just as they do in memory and a version that
+  differs from the last one by an edit costs a few runs.  Other sequences of
+  the state's tokens (e.g. the tokens added by the revisions in a processing
+  window) can be stored along with the versions, so that they share their
+  tokens with the state when they are loaded.  Versions that were
+  :class:`~mwpersistence.sequence.TokenSequence` s are loaded as slices of a
+  single sequence of all of the tokens, so they share its runs (unless their
+  own runs are too short to share).
+
+Loading a snapshot doesn't import or call anything that the snapshot names.
+The token and sequence classes are looked up in ``CLASSES``.
+
+A snapshot starts with ``MAGIC`` and a format version, and each section is
+prefixed with its length.  Integers are little-endian.
+
+.. autofunction:: mwpersistence.snapshot.dump_state
+
+.. autofunction:: mwpersistence.snapshot.load_state
+"""
+import json
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from operator import attrgetter, is_
+
+from .authorship import Authorship
+from .ledger import Ledger
+from .sequence import CHUNK_SIZE, TokenSequence
+from .token import AggregateToken, Token
+from .util import detector_state, restore_detector
+
+MAGIC = b"MWPSTATE"
+
+FORMAT_VERSION = 2
+
+CLASSES = {'Token': Token, 'AggregateToken': AggregateToken,
+           'list': list, 'TokenSequence': TokenSequence}
+"""
+The token and sequence classes that a snapshot can name
+"""
+
+INT, OPTIONAL_INT, OBJECT, LIST = 0, 1, 2, 3
+
+_LENGTH = struct.Struct("<Q")
+_HEADER = struct.Struct("<8sH")
+
+# Integer arrays are written with a code for their signedness and width.
+# Array typecodes differ in width between platforms.
+_TYPECODES = {}
+for _typecode in "bBhHiIlLqQ":
+    _code = (_typecode.islower(), array(_typecode).itemsize)
+    if _code not in _TYPECODES:
+        _TYPECODES[_code] = _typecode
+_CODES = {code: i for i, code in
+          enumerate((signed, size) for signed in (True, False)
+                    for size in (1, 2, 4, 8))}
+_CODE_TYPECODES = {i: _TYPECODES[code] for code, i in _CODES.items()}
+
+
+def dump_state(state, fp, sequences=()):
+    """
+    Writes a snapshot of a :class:`~mwpersistence.DiffState` to a binary
+    file.  The diff engine and interner are not included.
+
+    :Parameters:
+        state : :class:`~mwpersistence.DiffState`
+            The state to write
+        fp : `file`
+            A file opened for writing bytes
+        sequences : `iterable` ( `iterable` ( :class:`~mwpersistence.Token` ) )
+            Other sequences of tokens to write along with the state
+    """
+    objects = _Objects()
+    maxsize, history = detector_state(state.revert_detector)
+
+    token_class = _class_name(state.token_class)
+    sequence_class = _class_name(state.sequence_class)
+
+    # Every version that the state can return to, and the current one
+    versions, version_index = [], {}
+    for version in [version for _, version in history] + [state.last]:
+        if id(version) not in version_index:
+            version_index[id(version)] = len(versions)
+            versions.append(version)
+
+    # Tokens are numbered in order of appearance, so each version is a few
+    # runs of consecutive numbers
+    sequences = [list(sequence) for sequence in sequences]
+    all_tokens = {}
+    for version in versions:
+        if version.tokens is not None:
+            all_tokens.update(zip(map(id, version.tokens), version.tokens))
+    for sequence in sequences:
+        all_tokens.update(zip(map(id, sequence), sequence))
+    tokens = list(all_tokens.values())
+    token_index = dict(zip(all_tokens.keys(), range(len(tokens))))
+    version_runs = [_runs(list(map(token_index.__getitem__,
+                                   map(id, sequence))))
+                    for sequence in [version.tokens or ()
+                                     for version in versions] + sequences]
+
+    strings = _Strings()
+    texts = [strings.ref(str(token)) for token in tokens]
+    types = [strings.ref(token.type) for token in tokens]
+
+    # The ledger is indexed first so that the revisions a token persisted
+    # through -- a slice of the ledger -- are a single run
+    if state.ledger is not None:
+        ledger = [objects.ref(revision) for revision in state.ledger.revisions]
+    else:
+        ledger = None
+
+    slots = [slot for slot in _slots(state.token_class) if slot != 'type']
+    columns = [_encode_column(_slot_values(tokens, slot), objects)
+               for slot in slots]
+
+    # Authorship runs share the byte offsets of the operation that inserted
+    # them, and are only merged when they refer to the same segment
+    segments = _Objects()
+    authorship = [_encode_authorship(getattr(version, 'authorship', None),
+                                     objects, segments)
+                  for version in versions]
+
+    meta = {
+        'token_class': token_class,
+        'sequence_class': sequence_class,
+        'maxsize': maxsize,
+        'checksums': [_encode_object(checksum) for checksum, _ in history],
+        'history': [version_index[id(version)] for _, version in history],
+        'last': version_index[id(state.last)],
+        'versions': [version.tokens is not None for version in versions],
+        'sequences': len(sequences),
+        'authorship': authorship,
+        'segments': segments.values,
+        'track_authorship': state.track_authorship,
+        'reverts': state.reverts,
+        'ledger': ledger,
+        'slots': slots,
+        'objects': [_encode_object(value) for value in objects.values]
+    }
+
+    fp.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+    _write_section(fp, strings.dump())
+    _write_section(fp, json.dumps(meta, separators=(",", ":"))
+                   .encode('utf-8'))
+
+    token_data = [_LENGTH.pack(len(tokens)), _pack(texts), _pack(types)]
+    for kind, data in columns:
+        token_data.append(bytes([kind]))
+        token_data.extend(_pack(values) for values in data)
+    _write_section(fp, b"".join(token_data))
+
+    version_data = []
+    for starts, lengths in version_runs:
+        version_data.append(_pack(starts))
+        version_data.append(_pack(lengths))
+    _write_section(fp, b"".join(version_data))
+
+
+def load_state(cls, fp, diff_engine=None, interner=None, sequences=False):
+    """
+    Reads a snapshot written by :func:`~mwpersistence.snapshot.dump_state`.
+
+    :Parameters:
+        cls : `class`
+            The class of state to construct (e.g.
+            :class:`~mwpersistence.DiffState`)
+        fp : `file`
+            A binary file positioned at the start of a snapshot
+        diff_engine : :class:`deltas.DiffEngine`
+            The diff engine to process raw text with
+        interner : :class:`~mwpersistence.interning.Interner`
+            The interner to use for the texts of new tokens
+        sequences : `bool`
+            Also return the other sequences of tokens that were written with
+            the state
+
+    :Returns:
+        A state or, if `sequences` is set, a pair of the state and a `list`
+        of the sequences (as `list` s of tokens)
+    """
+    header = fp.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError("Not a state snapshot: too short")
+    magic, format_version = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a state snapshot: bad magic {0}"
+                         .format(repr(magic)))
+    if format_version != FORMAT_VERSION:
+        raise ValueError("Snapshot format version {0} is not supported.  "
+                         "Expected {1}"
+                         .format(format_version, FORMAT_VERSION))
+
+    strings = _Strings.load(_read_section(fp))
+    meta = json.loads(_read_section(fp).decode('utf-8'))
+    objects = [_decode_object(value) for value in meta['objects']]
+    token_class = _lookup_class(meta['token_class'])
+    sequence_class = _lookup_class(meta['sequence_class'])
+
+    # Tokens
+    reader = _Reader(_read_section(fp))
+    reader.length()
+    new = token_class.__new__
+    tokens = [new(token_class, text)
+              for text in map(strings.__getitem__, reader.unpack())]
+    for token, token_type in zip(tokens,
+                                 map(strings.__getitem__, reader.unpack())):
+        token.type = token_type
+    for slot in meta['slots']:
+        for token, value in zip(tokens, _decode_column(reader, objects)):
+            setattr(token, slot, value)
+
+    state = cls(diff_engine, revert_radius=meta['maxsize'] - 1,
+                token_class=token_class, sequence_class=sequence_class,
+                lazy=meta['ledger'] is not None, interner=interner,
+                authorship=meta['track_authorship'])
+    version_class = type(state.last)
+
+    # Versions
+    if sequence_class is TokenSequence:
+        # Versions are slices of one sequence, so they share its runs
+        all_tokens = TokenSequence(tokens)
+
+        def sequence(starts, lengths):
+            if len(starts) * CHUNK_SIZE > sum(lengths):
+                # Runs shorter than a chunk would be copied anyway
+                return TokenSequence(_expand(starts, lengths, tokens))
+            version_tokens = TokenSequence()
+            for start, length in zip(starts, lengths):
+                version_tokens.extend(all_tokens[start:start + length])
+            return version_tokens
+    else:
+        def sequence(starts, lengths):
+            return sequence_class(_expand(starts, lengths, tokens))
+
+    segments = meta['segments']
+    reader = _Reader(_read_section(fp))
+    versions = []
+    for has_tokens, authorship in zip(meta['versions'], meta['authorship']):
+        starts, lengths = reader.unpack(), reader.unpack()
+        version = version_class()
+        if has_tokens:
+            version.tokens = sequence(starts, lengths)
+        if authorship is not None:
+            version.authorship = _decode_authorship(authorship, objects,
+                                                    segments)
+        versions.append(version)
+    token_sequences = [_expand(reader.unpack(), reader.unpack(), tokens)
+                       for _ in range(meta.get('sequences', 0))]
+
+    state.revert_detector = restore_detector(
+        meta['maxsize'], [(_decode_object(checksum), versions[i])
+                          for checksum, i in
+                          zip(meta['checksums'], meta['history'])])
+    state.last = versions[meta['last']]
+    state.reverts = meta['reverts']
+    if meta['ledger'] is not None:
+        state.ledger = Ledger()
+        state.ledger.revisions = [objects[i] for i in meta['ledger']]
+    if state.diff_processor is not None and state.last.tokens is not None:
+        state.diff_processor.update(last_tokens=list(state.last.tokens))
+
+    if sequences:
+        return state, token_sequences
+    else:
+        return state
+
+
+class _Objects:
+    """
+    Assigns indexes to objects by identity.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def ref(self, value):
+        i = self.index.get(id(value))
+        if i is None:
+            i = self.index[id(value)] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def runs(self, values):
+        """
+        Returns the indexes of a list of objects as runs.
+        """
+        if len(values) == 0:
+            return [], []
+
+        # Most lists are a single run of objects that were indexed in order.
+        # They can be recognized without looking up every object.
+        first = self.index.get(id(values[0]))
+        last = self.index.get(id(values[-1]))
+        if first is not None and last is not None and \
+           last - first + 1 == len(values) and \
+           all(map(is_, values, self.values[first:last + 1])):
+            return [first], [len(values)]
+
+        return _runs([self.ref(value) for value in values])
+
+
+class _Strings:
+    """
+    A table of distinct strings.  `None` is a string too.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self.index = {}
+
+    def ref(self, value):
+        if value is None:
+            return 0
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def dump(self):
+        # Lengths are in code points so that the blob is decoded at once
+        lengths = [len(value) for value in self.values[1:]]
+        blob = "".join(self.values[1:]).encode('utf-8', 'surrogatepass')
+        return _pack(lengths) + blob
+
+    @staticmethod
+    def load(data):
+        reader = _Reader(data)
+        lengths = reader.unpack()
+        blob = reader.rest().decode('utf-8', 'surrogatepass')
+        ends = list(accumulate(lengths))
+        return [None] + [blob[end - length:end]
+                         for length, end in zip(lengths, ends)]
+
+
+class _Reader:
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def length(self):
+        length, = _LENGTH.unpack_from(self.data, self.offset)
+        self.offset += _LENGTH.size
+        return length
+
+    def byte(self):
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def unpack(self):
+        """
+        Reads an array of integers written by `_pack`.
+        """
+        code = self.byte()
+        if code not in _CODE_TYPECODES:
+            raise ValueError("Corrupt state snapshot: integer type {0}"
+                             .format(code))
+        values = array(_CODE_TYPECODES[code])
+        n = self.length()
+        end = self.offset + n * values.itemsize
+        values.frombytes(self.data[self.offset:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        self.offset = end
+        return values
+
+    def rest(self):
+        return bytes(self.data[self.offset:])
+
+
+def _encode_column(values, objects):
+    kinds = set(map(type, values))
+    ints = [value for value in values if value is not None]
+    if kinds <= {int, type(None)} and \
+       (len(ints) == 0 or (-2 ** 63 <= min(ints) and max(ints) < 2 ** 63)):
+        if len(ints) == len(values):
+            return INT, [values]
+        else:
+            # None is stored as a mask so that the values stay narrow
+            return OPTIONAL_INT, [[int(value is None) for value in values],
+                                  [value or 0 for value in values]]
+    elif kinds == {list}:
+        counts, starts, lengths = [], [], []
+        for value in values:
+            value_starts, value_lengths = objects.runs(value)
+            counts.append(len(value_starts))
+            starts.extend(value_starts)
+            lengths.extend(value_lengths)
+        return LIST, [counts, starts, lengths]
+    else:
+        return OBJECT, [[objects.ref(value) for value in values]]
+
+
+def _decode_column(reader, objects):
+    kind = reader.byte()
+    if kind == INT:
+        return reader.unpack().tolist()
+    elif kind == OPTIONAL_INT:
+        nones, values = reader.unpack(), reader.unpack().tolist()
+        return [None if none else value for none, value in zip(nones, values)]
+    elif kind == LIST:
+        counts, starts, lengths = \
+            reader.unpack(), reader.unpack(), reader.unpack()
+        lists = []
+        i = 0
+        for count in counts:
+            if count == 1:
+                start = starts[i]
+                lists.append(objects[start:start + lengths[i]])
+            else:
+                lists.append(_expand(starts[i:i + count],
+                                     lengths[i:i + count], objects))
+            i += count
+        return lists
+    elif kind == OBJECT:
+        return list(map(objects.__getitem__, reader.unpack()))
+    else:
+        raise ValueError("Corrupt state snapshot: column kind {0}"
+                         .format(kind))
+
+
+def _runs(indexes):
+    """
+    Splits a list of indexes into runs of consecutive indexes.
+
+    :Returns:
+        A pair of lists: the start and length of each run
+    """
+    if len(indexes) == 0:
+        return [], []
+    breaks = [i for i, (a, b) in enumerate(zip(indexes, indexes[1:]), 1)
+              if b != a + 1]
+    bounds = [0] + breaks + [len(indexes)]
+    return ([indexes[start] for start in bounds[:-1]],
+            [end - start for start, end in zip(bounds, bounds[1:])])
+
+
+def _expand(starts, lengths, values):
+    expanded = []
+    for start, length in zip(starts, lengths):
+        expanded.extend(values[start:start + length])
+    return expanded
+
+
+def _slot_values(tokens, slot):
+    try:
+        return list(map(attrgetter(slot), tokens))
+    except AttributeError:
+        return [getattr(token, slot, None) for token in tokens]
+
+
+def _slots(cls):
+    slots = []
+    for klass in reversed(cls.__mro__):
+        klass_slots = klass.__dict__.get('__slots__', ())
+        if isinstance(klass_slots, str):
+            klass_slots = (klass_slots,)
+        for slot in klass_slots:
+            if slot not in ('__dict__', '__weakref__') and slot not in slots:
+                slots.append(slot)
+    return slots
+
+
+def _class_name(cls):
+    for name, value in CLASSES.items():
+        if value is cls:
+            return name
+    raise ValueError("{0} can't be written to a state snapshot.  Expected "
+                     "one of {1}".format(cls.__qualname__, sorted(CLASSES)))
+
+
+def _lookup_class(name):
+    if name not in CLASSES:
+        raise ValueError("Unknown class in state snapshot: {0}"
+                         .format(repr(name)))
+    return CLASSES[name]
+
+
+def _encode_object(value):
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    elif type(value) is list:
+        return [_encode_object(item) for item in value]
+    elif type(value) is tuple:
+        return {'tuple': [_encode_object(item) for item in value]}
+    elif type(value) is dict:
+        return {'dict': [[_encode_object(key), _encode_object(item)]
+                         for key, item in value.items()]}
+    else:
+        raise ValueError("{0} can't be written to a state snapshot"
+                         .format(type(value).__qualname__))
+
+
+def _decode_object(value):
+    if type(value) is list:
+        return [_decode_object(item) for item in value]
+    elif type(value) is dict:
+        if 'tuple' in value:
+            return tuple(_decode_object(item) for item in value['tuple'])
+        else:
+            return {_decode_object(key): _decode_object(item)
+                    for key, item in value['dict']}
+    else:
+        return value
+
+
+def _encode_authorship(authorship, objects, segments):
+    if authorship is None:
+        return None
+    return {'origins': [objects.ref(origin)
+                        for origin in authorship.origins],
+            'segments': [segments.ref(segment)
+                         for segment in authorship.segments],
+            'offsets': authorship.offsets,
+            'ends': authorship.ends,
+            'byte_ends': authorship.byte_ends}
+
+
+def _decode_authorship(doc, objects, segments):
+    authorship = Authorship()
+    authorship.origins = [objects[i] for i in doc['origins']]
+    authorship.segments = [segments[i] for i in doc['segments']]
+    authorship.offsets = doc['offsets']
+    authorship.ends = doc['ends']
+    authorship.byte_ends = doc['byte_ends']
+    return authorship
+
+
+def _pack(values):
+    """
+    Writes a list of integers as an array of the narrowest type that fits
+    them.
+    """
+    low, high = (min(values), max(values)) if len(values) > 0 else (0, 0)
+    for size in (1, 2, 4, 8):
+        if low >= 0 and high < 2 ** (8 * size):
+            signed = False
+        elif -2 ** (8 * size - 1) <= low and high < 2 ** (8 * size - 1):
+            signed = True
+        else:
+            continue
+        code = _CODES[(signed, size)]
+        break
+    else:
+        raise OverflowError("Integer {0} is too large for a snapshot"
+                            .format(high if high > -low else low))
+
+    values = array(_CODE_TYPECODES[code], values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return bytes([code]) + _LENGTH.pack(len(values)) + values.tobytes()
+
+
+def _write_section(fp, data):
+    fp.write(_LENGTH.pack(len(data)))
+    fp.write(data)
+
+
+def _read_section(fp):
+    header = fp.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        raise ValueError("Truncated state snapshot")
+    length, = _LENGTH.unpack(header)
+    data = fp.read(length)
+    if len(data) < length:
+        raise ValueError("Truncated state snapshot")
+    return data
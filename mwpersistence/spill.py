@@ -0,0 +1,138 @@
+"""
+Temporary on-disk storage for the revisions in a processing window.
+
+The revision documents of very large pages (and the diffs that they carry) can
+use a lot of memory while they wait in the window of
+:func:`~mwpersistence.utilities.diffs2persistence`.  A
+:class:`~mwpersistence.spill.SpillFile` pickles them to temporary files and
+loads them back when they reach the tail of the window.  Documents are
+written to segment files that are deleted as soon as all of their documents
+have been loaded, so disk usage stays close to the size of the window.
+Data that is already serialized can be stored as `bytes` too (see
+:class:`~mwpersistence.pool.StatePool`).
+
+.. autoclass:: mwpersistence.spill.SpillFile
+    :members:
+"""
+import pickle
+import tempfile
+
+
+class Spilled:
+    """
+    A reference to a document in a :class:`~mwpersistence.spill.SpillFile`.
+    """
+    __slots__ = ('segment', 'offset', 'length')
+
+    def __init__(self, segment, offset, length):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+
+
+class _Segment:
+    __slots__ = ('f', 'size', 'live')
+
+    def __init__(self, directory):
+        self.f = tempfile.TemporaryFile(dir=directory)
+        self.size = 0
+        self.live = 0
+
+
+class SpillFile:
+    """
+    Constructs a temporary store of pickled documents.
+
+    :Parameters:
+        directory : `str`
+            The directory to write temporary files to.  Defaults to the
+            system's temporary directory.
+        segment_bytes : `int`
+            The size after which a new segment file is started
+    """
+
+    def __init__(self, directory=None, segment_bytes=2 ** 26):
+        self.directory = directory
+        self.segment_bytes = int(segment_bytes)
+        self.segment = None
+        self.segments = set()
+        self.spilled = 0
+
+    def dump(self, doc):
+        """
+        Writes a document.
+
+        :Returns:
+            A :class:`~mwpersistence.spill.Spilled` reference
+        """
+        return self.dump_bytes(pickle.dumps(doc, pickle.HIGHEST_PROTOCOL))
+
+    def dump_bytes(self, data):
+        """
+        Writes `bytes`.
+
+        :Returns:
+            A :class:`~mwpersistence.spill.Spilled` reference
+        """
+        segment = self.segment
+        if segment is None or segment.size >= self.segment_bytes:
+            segment = self.segment = _Segment(self.directory)
+            self.segments.add(segment)
+
+        segment.f.seek(segment.size)
+        segment.f.write(data)
+        ref = Spilled(segment, segment.size, len(data))
+        segment.size += len(data)
+        segment.live += 1
+        self.spilled += 1
+        return ref
+
+    def read(self, ref):
+        """
+        Reads a document and keeps it stored.
+        """
+        return pickle.loads(self.read_bytes(ref))
+
+    def read_bytes(self, ref):
+        """
+        Reads `bytes` and keeps them stored.
+        """
+        segment = ref.segment
+        segment.f.seek(ref.offset)
+        return segment.f.read(ref.length)
+
+    def load(self, ref):
+        """
+        Reads a document and releases its storage.  A reference can only be
+        loaded once.
+        """
+        return pickle.loads(self.load_bytes(ref))
+
+    def load_bytes(self, ref):
+        """
+        Reads `bytes` and releases their storage.  A reference can only be
+        loaded once.
+        """
+        data = self.read_bytes(ref)
+        segment = ref.segment
+        segment.live -= 1
+        if segment.live == 0:
+            if segment is self.segment:
+                # Re-use the current segment from the start
+                segment.f.seek(0)
+                segment.f.truncate()
+                segment.size = 0
+            else:
+                segment.f.close()
+                self.segments.discard(segment)
+        return data
+
+    def close(self):
+        """
+        Closes (and so deletes) every segment file.  Documents that were
+        never loaded are lost.
+        """
+        for segment in self.segments:
+            segment.f.close()
+        self.segments.clear()
+        self.segment = None
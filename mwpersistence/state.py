@@ -3,16 +3,35 @@ from hashlib import sha1
 
 import mwreverts
 
+from .authorship import Authorship, opdoc_ranges, operation_ranges
+from .ledger import Ledger
+from .snapshot import dump_state, load_state
 from .token import Token
+from .util import detector_state, restore_detector
 
 logger = logging.getLogger(__name__)
 
+UPDATE_OUTPUTS = ("current_tokens", "tokens_added", "tokens_removed")
+"""
+The outputs that :func:`~mwpersistence.DiffState.update_opdocs_many` can
+collect
+"""
+
+
+TOKENS_PER_OPERATION = 1024
+"""
+A :class:`~mwpersistence.DiffState` with a `sequence_class` other than `list`
+falls back to a `list` for revisions whose diffs have more than one operation
+for every this many tokens of the previous revision
+"""
+
 
 class Version:
-    __slots__ = ('tokens', )
+    __slots__ = ('tokens', 'authorship')
 
     def __init__(self, tokens=None):
         self.tokens = tokens
+        self.authorship = None
 
 
 class State:
@@ -38,6 +57,30 @@ class DiffState:
             that a revert can span.
         revert_detector : :class:`mwreverts.Detector`
             A revert detector.
+        token_class : `class`
+            The class used to construct new tokens.  Use
+            :class:`~mwpersistence.AggregateToken` to keep running counters
+            rather than a list of revisions per token.
+        sequence_class : `class`
+            The class used to represent the sequence of tokens in a revision.
+            Use :class:`~mwpersistence.sequence.TokenSequence` so that
+            revisions share structure and applying a diff costs O(edit)
+            rather than O(page).  Revisions with very fragmented diffs (see
+            :data:`~mwpersistence.state.TOKENS_PER_OPERATION`) are still
+            represented with a `list`.
+        interner : :class:`~mwpersistence.interning.Interner`
+            If set, the texts of tokens in operation documents are interned
+            so that repeated texts share a single `str`.
+        lazy : `bool`
+            Settle the persistence of tokens lazily (see
+            :class:`~mwpersistence.ledger.Ledger`) rather than marking every
+            token in the page for every revision.  Token persistence is only
+            up to date once it has been removed or passed to
+            :func:`~mwpersistence.DiffState.settle`.
+        authorship : `bool`
+            Maintain an index of the revision that added each token of the
+            current version (see
+            :func:`~mwpersistence.DiffState.authorship`).
 
     :Example:
         >>> import mwpersistence
@@ -86,7 +129,9 @@ class DiffState:
             self.tokens = None
 
     def __init__(self, diff_engine=None, revert_radius=None,
-                 revert_detector=None):
+                 revert_detector=None, token_class=Token,
+                 sequence_class=list, lazy=False, interner=None,
+                 authorship=False):
         if diff_engine is not None:
             if not hasattr(diff_engine, 'process'):
                 raise TypeError("'diff_engine' of type {0} does not have a " +
@@ -107,10 +152,30 @@ class DiffState:
         else:
             self.revert_detector = revert_detector
 
+        self.token_class = token_class
+        self.sequence_class = sequence_class
+        self.ledger = Ledger() if lazy else None
+        self.interner = interner
+        self.track_authorship = bool(authorship)
+
         # Stores the last tokens
         self.last = Version()
 
-    def update(self, text, revision=None):
+        # The number of reverts detected
+        self.reverts = 0
+
+    @property
+    def authorship(self):
+        """
+        The :class:`~mwpersistence.authorship.Authorship` of the current
+        version, or `None` if authorship isn't maintained.
+        """
+        if self.track_authorship:
+            return self.last.authorship or Authorship()
+        else:
+            return None
+
+    def update(self, text, revision=None, origin=None):
         """
         Modifies the internal state based a change to the content and returns
         the sets of words added and removed.
@@ -120,6 +185,9 @@ class DiffState:
                 The text content of a revision
             revision : `mixed`
                 Revision metadata
+            origin : `mixed`
+                The origin of the tokens added by the revision in the
+                authorship index.  Defaults to `revision`.
 
         :Returns:
             A triple of lists:
@@ -132,9 +200,9 @@ class DiffState:
             tokens_removed : `list` ( :class:`~mwpersistence.Token` )
                 Tokens that were removed while updating state.
         """
-        return self._update(text=text, revision=revision)
+        return self._update(text=text, revision=revision, origin=origin)
 
-    def update_opdocs(self, checksum, opdocs, revision=None):
+    def update_opdocs(self, checksum, opdocs, revision=None, origin=None):
         """
         Modifies the internal state based a change to the content and returns
         the sets of words added and removed.
@@ -147,6 +215,9 @@ class DiffState:
                 revision
             revision : `mixed`
                 Revision metadata
+            origin : `mixed`
+                The origin of the tokens added by the revision in the
+                authorship index.  Defaults to `revision`.
 
         :Returns:
             A triple of lists:
@@ -160,9 +231,60 @@ class DiffState:
                 Tokens that were removed while updating state.
         """
         return self._update(checksum=checksum, opdocs=opdocs,
-                            revision=revision)
+                            revision=revision, origin=origin)
+
+    def update_opdocs_many(self, updates, outputs=("tokens_added",)):
+        """
+        Modifies the internal state based on a sequence of changes to the
+        content.  This is equivalent to calling
+        :func:`~mwpersistence.DiffState.update_opdocs` for each change, but
+        the changes are applied in a single loop and only the requested
+        outputs are collected.
 
-    def _update(self, text=None, checksum=None, opdocs=None, revision=None):
+        :Parameters:
+            updates : `iterable` ( `tuple` )
+                ``(checksum, opdocs, revision)`` triples (see
+                :func:`~mwpersistence.DiffState.update_opdocs`).  `revision`
+                is also the origin of the tokens each change adds in the
+                authorship index.
+            outputs : `iterable` ( `str` )
+                The outputs to collect for each change.  Any of
+                "current_tokens", "tokens_added" and "tokens_removed".
+
+        :Returns:
+            A :class:`~mwpersistence.state.Updates`
+        """
+        outputs = set(outputs)
+        for output in outputs:
+            if output not in UPDATE_OUTPUTS:
+                raise ValueError("Output {0} not supported.  Type {1}"
+                                 .format(repr(output), UPDATE_OUTPUTS))
+        updates_ = Updates(outputs)
+        current_tokens = updates_.current_tokens
+        all_added = updates_.tokens_added
+        all_removed = updates_.tokens_removed
+        removed = all_removed is not None
+
+        for checksum, opdocs, revision in updates:
+            reverts = self.reverts
+            tokens, tokens_added, tokens_removed = self._update(
+                checksum=checksum, opdocs=opdocs, revision=revision,
+                removed=removed)
+
+            if self.reverts > reverts:
+                updates_.reverts.append(updates_.revisions)
+            updates_.revisions += 1
+            if current_tokens is not None:
+                current_tokens.append(tokens)
+            if all_added is not None:
+                all_added.append(tokens_added)
+            if all_removed is not None:
+                all_removed.append(tokens_removed)
+
+        return updates_
+
+    def _update(self, text=None, checksum=None, opdocs=None, revision=None,
+                origin=None, removed=True):
         if checksum is None:
             if text is None:
                 raise TypeError("Either 'text' or 'checksum' must be " +
@@ -176,20 +298,46 @@ class DiffState:
         if revert is not None:  # Revert
             logger.debug("Revert detected between {0} and {1}"
                          .format(revert.reverting, revert.reverted_to))
+            self.reverts += 1
             # Extract reverted_to revision
             current_version.tokens = revert.reverted_to.tokens
+            if self.track_authorship:
+                current_version.authorship = revert.reverted_to.authorship
 
             # Update diff_processor state
             if self.diff_processor is not None:
-                self.diff_processor.update(last_tokens=current_version.tokens)
+                self.diff_processor.update(
+                    last_tokens=list(current_version.tokens))
 
             transition = current_version.tokens, [], []
 
+            if self.ledger is not None:
+                self.ledger.revert(self.last.tokens or [],
+                                   current_version.tokens, revision)
+
         else:
 
+            last_tokens = self.last.tokens or self.sequence_class()
+            if origin is None:
+                origin = revision
             if opdocs is not None:
-                transition = apply_opdocs(opdocs, self.last.tokens or [])
+                opdocs = list(opdocs)
+                if self.ledger is not None:
+                    equal_ranges = [(op_doc['a1'], op_doc['a2'])
+                                    for op_doc in opdocs
+                                    if op_doc['name'] == "equal"]
+
+                sequence_class = self._sequence_class(len(opdocs),
+                                                      last_tokens)
+                transition = apply_opdocs(opdocs, last_tokens,
+                                          token_class=self.token_class,
+                                          sequence_class=sequence_class,
+                                          interner=self.interner,
+                                          removed=removed)
                 current_version.tokens, _, _ = transition
+                if self.track_authorship:
+                    current_version.authorship = self._authorship(
+                        opdoc_ranges(opdocs), origin)
             else:
                 # NOTICE: HEAVY COMPUTATION HERE!!!
                 #
@@ -199,15 +347,30 @@ class DiffState:
                     raise RuntimeError("DiffState cannot process raw text " +
                                        "without a diff_engine specified.")
                 operations, _, current_tokens = \
-                    self.diff_processor.process(text, token_class=Token)
-
-                transition = apply_operations(operations,
-                                              self.last.tokens or [],
-                                              current_tokens)
+                    self.diff_processor.process(text,
+                                                token_class=self.token_class)
+                operations = list(operations)
+                if self.ledger is not None:
+                    equal_ranges = [(op.a1, op.a2) for op in operations
+                                    if op.name == "equal"]
+
+                transition = apply_operations(
+                    operations, last_tokens, current_tokens,
+                    sequence_class=self._sequence_class(len(operations),
+                                                        last_tokens))
                 current_version.tokens, _, _ = transition
+                if self.track_authorship:
+                    current_version.authorship = self._authorship(
+                        operation_ranges(operations, current_tokens), origin)
+
+            if self.ledger is not None:
+                _, tokens_added, _ = transition
+                self.ledger.transition(last_tokens, equal_ranges,
+                                       tokens_added, revision)
 
         # Record persistence
-        persist_revision_once(current_version.tokens, revision)
+        if self.ledger is None:
+            persist_revision_once(current_version.tokens, revision)
 
         # Update last version
         self.last = current_version
@@ -215,6 +378,118 @@ class DiffState:
         # Return the tranisitoned state
         return transition
 
+    def _sequence_class(self, operations, last_tokens):
+        # Structural sharing costs a little for every operation, so a diff
+        # that is fragmented for the size of the page is cheaper to apply by
+        # copying into a plain list
+        if self.sequence_class is not list and \
+           operations * TOKENS_PER_OPERATION > len(last_tokens):
+            return list
+        else:
+            return self.sequence_class
+
+    def _authorship(self, ranges, origin):
+        last_authorship = self.last.authorship or Authorship()
+        return last_authorship.transition(ranges, origin)
+
+    def settle(self, tokens):
+        """
+        Brings the persistence of a set of tokens up to date.  This is only
+        necessary when persistence is settled lazily.
+
+        :Parameters:
+            tokens : `iterable` ( :class:`~mwpersistence.Token` )
+                Tokens that will be read
+        """
+        if self.ledger is not None:
+            self.ledger.settle(tokens)
+
+    def dump(self, fp, sequences=()):
+        """
+        Writes a compact binary snapshot of the state (see
+        :mod:`mwpersistence.snapshot`) to a file.  Snapshots are much smaller
+        than pickles and faster to read, and loading them doesn't run code.
+        The diff engine and interner are not included.  Revision metadata
+        must be made of `None`, `bool`, `int`, `float`, `str`, `list`, `tuple`
+        and `dict`.
+
+        :Parameters:
+            fp : `file`
+                A file opened for writing bytes
+            sequences : `iterable` ( `iterable` ( :class:`~mwpersistence.Token` ) )
+                Other sequences of the state's tokens (e.g. tokens added by
+                the revisions in a window) to write along with it
+        """  # noqa
+        dump_state(self, fp, sequences=sequences)
+
+    @classmethod
+    def load(cls, fp, diff_engine=None, interner=None, sequences=False):
+        """
+        Reads a state from a snapshot written by
+        :func:`~mwpersistence.DiffState.dump`.
+
+        :Parameters:
+            fp : `file`
+                A file opened for reading bytes
+            diff_engine : :class:`deltas.DiffEngine`
+                The diff engine to process raw text with
+            interner : :class:`~mwpersistence.interning.Interner`
+                The interner to use for the texts of new tokens
+            sequences : `bool`
+                Also return the sequences that were written with the state
+
+        :Returns:
+            A :class:`~mwpersistence.DiffState` or, if `sequences` is set, a
+            pair of the state and a `list` of the sequences
+        """
+        return load_state(cls, fp, diff_engine=diff_engine,
+                          interner=interner, sequences=sequences)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['revert_detector'] = detector_state(self.revert_detector)
+        return state
+
+    def __setstate__(self, state):
+        state['revert_detector'] = restore_detector(*state['revert_detector'])
+        state.setdefault('track_authorship', False)
+        self.__dict__.update(state)
+
+
+class Updates:
+    """
+    The outputs of :func:`~mwpersistence.DiffState.update_opdocs_many`.
+    Outputs that weren't requested are `None`.
+
+    :Attributes:
+        revisions : `int`
+            The number of changes that were applied
+        current_tokens : `list`
+            The token sequence of each revision
+        tokens_added : `list`
+            The tokens that each revision added
+        tokens_removed : `list`
+            The tokens that each revision removed
+        reverts : `list` ( `int` )
+            The positions of the revisions that were reverts
+    """
+    __slots__ = ('revisions', 'current_tokens', 'tokens_added',
+                 'tokens_removed', 'reverts')
+
+    def __init__(self, outputs):
+        self.revisions = 0
+        self.current_tokens = [] if "current_tokens" in outputs else None
+        self.tokens_added = [] if "tokens_added" in outputs else None
+        self.tokens_removed = [] if "tokens_removed" in outputs else None
+        self.reverts = []
+
+    def __len__(self):
+        return self.revisions
+
+    def __repr__(self):
+        return "{0}(revisions={1}, reverts={2})".format(
+            self.__class__.__name__, self.revisions, self.reverts)
+
 
 def persist_revision_once(tokens, revision):
     """
@@ -229,8 +504,8 @@ def persist_revision_once(tokens, revision):
         token.persist(revision)
 
 
-def apply_operations(operations, a, b):
-    tokens = []
+def apply_operations(operations, a, b, sequence_class=list):
+    tokens = sequence_class()
     tokens_added = []
     tokens_removed = []
 
@@ -251,8 +526,9 @@ def apply_operations(operations, a, b):
     return (tokens, tokens_added, tokens_removed)
 
 
-def apply_opdocs(op_docs, a, token_class=Token):
-    tokens = []
+def apply_opdocs(op_docs, a, token_class=Token, sequence_class=list,
+                 interner=None, removed=True):
+    tokens = sequence_class()
     tokens_added = []
     tokens_removed = []
 
@@ -260,12 +536,17 @@ def apply_opdocs(op_docs, a, token_class=Token):
 
         if op_doc['name'] in ("replace", "insert"):
 
+            if interner is not None:
+                # Replaced in place so that the diff documents share texts too
+                op_doc['tokens'] = [interner.intern(s)
+                                    for s in op_doc['tokens']]
             new_tokens = [token_class(s) for s in op_doc['tokens']]
             tokens.extend(new_tokens)
             tokens_added.extend(new_tokens)
 
         if op_doc['name'] in ("replace", "delete"):
-            tokens_removed.extend(a[op_doc['a1']:op_doc['a2']])
+            if removed:
+                tokens_removed.extend(a[op_doc['a1']:op_doc['a2']])
 
         elif op_doc['name'] == "equal":
             tokens.extend(a[op_doc['a1']:op_doc['a2']])
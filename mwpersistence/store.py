@@ -0,0 +1,153 @@
+"""
+An on-disk store of page states for incremental processing.
+
+:func:`~mwpersistence.utilities.diffs2persistence` can save the state of each
+page (the :class:`~mwpersistence.DiffState`, the revisions still in the
+processing window and the page's last revision) at the end of a run.  A later
+run over a newer dump loads that state and only processes the revisions that
+are newer than the last one that was saved.  Revisions that were still in the
+window at the end of the last run are emitted again with updated statistics.
+
+States are pickled, compressed with :mod:`zlib` and stored in a :mod:`sqlite3`
+database keyed by page id.
+
+.. autoclass:: mwpersistence.store.StateStore
+    :members:
+
+.. autofunction:: mwpersistence.store.skip_saved
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import zlib
+from itertools import groupby
+
+from mwtypes import Timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Constructs a store of page states backed by a :mod:`sqlite3` database.
+    The database is created if it does not exist.  Connections are opened
+    lazily (and re-opened in forked processes), so a store can be shared with
+    page workers.
+
+    :Parameters:
+        path : `str`
+            The path to the database file
+        compression : `int`
+            The :mod:`zlib` compression level to apply to states
+    """
+
+    def __init__(self, path, compression=6):
+        self.path = str(path)
+        self.compression = int(compression)
+        self._connection = None
+        self._pid = None
+
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS page_state (" +
+                "page_id INTEGER PRIMARY KEY, rev_id INTEGER, " +
+                "timestamp INTEGER, state BLOB)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def save(self, page_id, rev_id, timestamp, state):
+        """
+        Saves the state of a page.
+
+        :Parameters:
+            page_id : `int`
+                The id of the page
+            rev_id : `int`
+                The id of the last revision that `state` includes
+            timestamp : `int`
+                The timestamp of that revision (in unix seconds)
+            state : `mixed`
+                A picklable state
+        """
+        blob = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL),
+                             self.compression)
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO page_state VALUES (?, ?, ?, ?)",
+                (int(page_id), int(rev_id), int(timestamp), blob))
+
+    def load(self, page_id):
+        """
+        Loads the state of a page.
+
+        :Returns:
+            The saved state or `None` if no state has been saved
+        """
+        row = self.connection().execute(
+            "SELECT state FROM page_state WHERE page_id = ?",
+            (int(page_id),)).fetchone()
+        if row is None:
+            return None
+        else:
+            return pickle.loads(zlib.decompress(row[0]))
+
+    def last_revision(self, page_id):
+        """
+        Looks up the last revision saved for a page without loading its
+        state.
+
+        :Returns:
+            A ``(rev_id, timestamp)`` pair or `None` if no state has been
+            saved
+        """
+        row = self.connection().execute(
+            "SELECT rev_id, timestamp FROM page_state WHERE page_id = ?",
+            (int(page_id),)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def __contains__(self, page_id):
+        return self.last_revision(page_id) is not None
+
+    def __len__(self):
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM page_state").fetchone()[0]
+
+    def __getstate__(self):
+        return self.path, self.compression
+
+    def __setstate__(self, state):
+        self.path, self.compression = state
+        self._connection, self._pid = None, None
+
+
+def skip_saved(rev_docs, state_store):
+    """
+    Drops the revisions of a page-partitioned sequence of revision documents
+    that come before the last revision saved in `state_store`.  The last
+    saved revision itself is kept so that the next revision can be diffed
+    against it.
+
+    :Parameters:
+        rev_docs : `iterable` ( `dict` )
+            Page-partitioned revision documents
+        state_store : :class:`~mwpersistence.store.StateStore`
+            A store of page states
+
+    :Returns:
+        A generator of revision documents
+    """
+    for page_id, page_docs in groupby(rev_docs, key=lambda d: d['page']['id']):
+        last = state_store.last_revision(page_id)
+        if last is None:
+            yield from page_docs
+        else:
+            rev_id, timestamp = last
+            for rev_doc in page_docs:
+                if (int(Timestamp(rev_doc['timestamp'])), rev_doc['id']) >= \
+                   (timestamp, rev_id):
+                    yield rev_doc
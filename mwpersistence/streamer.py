@@ -0,0 +1,346 @@
+"""
+A :class:`mwcli.Streamer` that can checkpoint and resume long runs.
+
+When checkpointing is enabled, a checkpoint file is written next to each
+output file after every `<pages>` completed pages.  It records the id of the
+last page whose output has been completely written and the size of the output
+file at that point.  Running the same command again truncates the output file
+to that size and skips the input up to and including the recorded page, so
+the diff and persistence work for finished pages isn't repeated.  Compressed
+output files are closed and re-opened at every checkpoint, so the recorded
+size always falls on a boundary between compressed streams.  Interleaved
+input (``--interleaved``) isn't page-partitioned, so it can't be
+checkpointed.
+
+Input files are scheduled between processes by
+:func:`~mwpersistence.schedule.schedule`.
+
+.. autoclass:: mwpersistence.streamer.Streamer
+    :members:
+
+.. autofunction:: mwpersistence.streamer.skip_pages
+"""
+import bz2
+import gzip
+import json
+import logging
+import os
+import sys
+from functools import partial
+
+import docopt
+import mwcli
+import para
+from mwcli import files
+
+from .columnar_format import ColumnarReader, ColumnarWriter
+from .json_codecs import get_codec
+from .metrics import Metrics, json_dumper
+from .schedule import schedule
+
+logger = logging.getLogger(__name__)
+
+FILE_APPENDERS = {
+    'gz': lambda fn: gzip.open(fn, 'at', encoding='utf-8', errors='replace'),
+    'bz2': lambda fn: bz2.open(fn, 'at', encoding='utf-8', errors='replace'),
+    'plaintext': lambda fn: open(fn, 'at', encoding='utf-8',
+                                 errors='replace'),
+    'json': lambda fn: open(fn, 'at', encoding='utf-8', errors='replace')
+}
+"""
+Maps compression types to the strategy for opening a file to be appended to
+"""
+
+
+def skip_pages(items, page_id, key):
+    """
+    Skips items up to and including those that belong to a page.
+
+    :Parameters:
+        items : `iterable`
+            Page-partitioned items (e.g. revision documents or
+            :class:`mwxml.Page`)
+        page_id : `int`
+            The id of the last page to skip
+        key : `func`
+            A function that returns the page id of an item
+
+    :Returns:
+        A generator of the items that follow the page
+    """
+    items = iter(items)
+    found = False
+    for item in items:
+        if key(item) == page_id:
+            found = True
+        elif found:
+            yield item
+            break
+
+    if not found:
+        logger.warning("Page {0} was never found in the input."
+                       .format(page_id))
+
+    yield from items
+
+
+def read_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    else:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _sync(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+    return os.path.getsize(path)
+
+
+class Streamer(mwcli.Streamer):
+    """
+    Constructs a :class:`mwcli.Streamer` that reads a `--checkpoint=<pages>`
+    option (see :mod:`mwpersistence.streamer`), a `--json-codec=<name>`
+    option (see :mod:`mwpersistence.json_codecs`), a `--metrics=<path>`
+    option (see :mod:`mwpersistence.metrics`) and `--prescan` and
+    `--split=<MB>` options (see :mod:`mwpersistence.schedule`).  The JSON
+    codec is used to
+    write output and to read input unless a `file_reader` is provided.  If
+    the utility has an `--input-format=<type>` or `--output-format=<type>`
+    option, "columnar" reads or writes
+    :mod:`~mwpersistence.columnar_format` directories.
+
+    When metrics are enabled, `a2b` is passed a `metrics` argument.  If
+    there are several input tasks, each one's metrics are written to
+    `<path>.<input file name>`.
+
+    :Parameters:
+        input_page_id : `func`
+            A function that returns the page id of an item read by
+            `file_reader`.  Defaults to reading the id of a JSON revision
+            document's page.
+        output_page_id : `func`
+            A function that returns the page id of an output document.
+            Defaults to reading the id of a JSON revision document's page.
+        <others>
+            See :class:`mwcli.Streamer`
+    """
+
+    @staticmethod
+    def doc_page_id(doc):
+        return doc['page']['id']
+
+    def __init__(self, doc, name, a2b, process_args=None, file_reader=None,
+                 line_writer=None, input_page_id=None, output_page_id=None):
+        super().__init__(doc, name, a2b, process_args=process_args,
+                         file_reader=file_reader, line_writer=line_writer)
+        self.reads_json = file_reader is None
+        self.writes_json = line_writer is None
+        self.input_page_id = input_page_id or Streamer.doc_page_id
+        self.output_page_id = output_page_id or Streamer.doc_page_id
+        self.checkpoint = None
+        self.columnar_output = None
+        self.metrics_path = None
+        self.metrics_interval = 60
+        self.times_input = self.reads_json
+        self.prescan = False
+        self.split_bytes = None
+
+    def main(self, argv=None):
+        args = docopt.docopt(self.doc, argv=argv)
+        if args['--checkpoint'] == "<none>":
+            self.checkpoint = None
+        elif args['--output'] == "<stdout>":
+            self.logger.warning("Writing output to stdout.  Ignoring " +
+                                "'checkpoint' setting.")
+            self.checkpoint = None
+        else:
+            self.checkpoint = int(args['--checkpoint'])
+
+        if self.checkpoint is not None and args.get('--interleaved', False):
+            # Interleaved output isn't partitioned by page, so no page marks
+            # the point before which all of the output has been written
+            self.logger.warning("Processing interleaved revisions.  " +
+                                "Ignoring 'checkpoint' setting.")
+            self.checkpoint = None
+
+        codec = get_codec(args['--json-codec'])
+        if self.reads_json:
+            self.file_reader = codec.read
+        if self.writes_json:
+            self.line_writer = codec.write
+
+        if args.get('--input-format', "json") == "columnar":
+            self.file_reader = partial(ColumnarReader.from_file,
+                                       loads=codec.loads)
+            # Columns are read by persistence2stats
+            self.times_input = False
+        if args.get('--output-format', "json") == "columnar":
+            if args['--output'] == "<stdout>":
+                raise RuntimeError("Columnar output requires --output.")
+            if self.checkpoint is not None:
+                self.logger.warning("Writing columnar output.  Ignoring " +
+                                    "'checkpoint' setting.")
+                self.checkpoint = None
+            self.columnar_output = partial(ColumnarWriter,
+                                           dumps=codec.dumps)
+
+        if args.get('--metrics', "<none>") == "<none>":
+            self.metrics_path = None
+        else:
+            self.metrics_path = args['--metrics']
+
+        self.prescan = args.get('--prescan', False)
+        if args.get('--split', "<none>") == "<none>":
+            self.split_bytes = None
+        else:
+            self.split_bytes = int(float(args['--split']) * 2 ** 20)
+
+        super().main(argv=argv)
+
+    def run(self, paths, threads, kwargs, output_dir, compression, verbose):
+
+        # Line-per-revision input unless it's XML
+        marker = None if self.reads_json else "<revision>"
+        tasks = schedule(paths, split_bytes=self.split_bytes,
+                         prescan=self.prescan, marker=marker, threads=threads)
+        if len(tasks) > 1:
+            self.logger.info("Scheduled {0} tasks: {1}"
+                             .format(len(tasks), tasks))
+
+        def process_task(task):
+            if self.metrics_path is None:
+                a2b = self.a2b
+            else:
+                a2b = self.metered(task.name, several=len(tasks) > 1)
+
+            if self.columnar_output is not None:
+                new_path = files.output_dir_path(task.name, output_dir,
+                                                 "columnar")
+                input = self.file_reader(task.open())
+                with self.columnar_output(new_path) as writer:
+                    for output in a2b(input, verbose=verbose, **kwargs):
+                        writer.write(output)
+            elif self.checkpoint is not None and output_dir is not None:
+                new_path = files.output_dir_path(task.name, output_dir,
+                                                 compression)
+                self.checkpointed(task, new_path, compression, kwargs,
+                                  verbose, a2b=a2b)
+            else:
+                input = self.file_reader(task.open())
+                outputs = a2b(input, verbose=verbose, **kwargs)
+                if output_dir is None:
+                    yield from outputs
+                else:
+                    new_path = files.output_dir_path(task.name, output_dir,
+                                                     compression)
+                    writer = files.writer(new_path)
+                    for output in outputs:
+                        self.line_writer(output, writer)
+                    writer.close()
+
+        for output in para.map(process_task, tasks, mappers=threads):
+            self.line_writer(output, sys.stdout)
+
+    def metered(self, path, several=False):
+        """
+        Returns a version of `a2b` that records
+        :class:`~mwpersistence.metrics.Metrics` for the input at `path` and
+        dumps them to `self.metrics_path`.
+        """
+        if several:
+            metrics_path = "{0}.{1}".format(self.metrics_path,
+                                            os.path.basename(path))
+        else:
+            metrics_path = self.metrics_path
+
+        def a2b(input, verbose=False, **kwargs):
+            metrics = Metrics(callbacks=[json_dumper(metrics_path)],
+                              interval=self.metrics_interval)
+            if self.times_input:
+                input = metrics.timed('read', input)
+            outputs = self.a2b(input, verbose=verbose, metrics=metrics,
+                               **kwargs)
+            yield from metrics.pages(outputs, self.output_page_id)
+            metrics.report()
+
+        return a2b
+
+    def checkpointed(self, task, new_path, compression, kwargs, verbose,
+                     a2b=None):
+        """
+        Processes the input of a :class:`~mwpersistence.schedule.Task` (or
+        the file at a path) and writes output to `new_path`,
+        recording a checkpoint every `self.checkpoint` pages and resuming
+        from an existing checkpoint.
+        """
+        a2b = a2b or self.a2b
+        if compression not in FILE_APPENDERS:
+            raise RuntimeError("Output compression {0} not supported.  "
+                               "Type {1}".format(compression,
+                                                 tuple(FILE_APPENDERS.keys())))
+        appender = FILE_APPENDERS[compression]
+        checkpoint_path = new_path + ".checkpoint"
+
+        checkpoint = read_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            checkpoint = {'page_id': None, 'pages': 0, 'offset': 0,
+                          'complete': False}
+        elif checkpoint['complete']:
+            self.logger.info("{0} is complete.  Skipping.".format(new_path))
+            return
+        else:
+            self.logger.info("Resuming {0} after page {1} ({2} pages done)"
+                             .format(new_path, checkpoint['page_id'],
+                                     checkpoint['pages']))
+
+        # Drop any output written after the checkpoint
+        with open(new_path, 'ab') as f:
+            if f.tell() < checkpoint['offset']:
+                raise RuntimeError("{0} is shorter than its checkpoint."
+                                   .format(new_path))
+            f.truncate(checkpoint['offset'])
+
+        if isinstance(task, str):
+            input = self.file_reader(files.reader(task))
+        else:
+            input = self.file_reader(task.open())
+        if checkpoint['page_id'] is not None:
+            input = skip_pages(input, checkpoint['page_id'],
+                               self.input_page_id)
+        outputs = a2b(input, verbose=verbose, **kwargs)
+
+        writer = appender(new_path)
+        page_id = None
+        for output in outputs:
+            output_page_id = self.output_page_id(output)
+            if page_id is not None and output_page_id != page_id:
+                # All of the output for `page_id` has been written
+                checkpoint['page_id'] = page_id
+                checkpoint['pages'] += 1
+                if checkpoint['pages'] % self.checkpoint == 0:
+                    writer.close()
+                    checkpoint['offset'] = _sync(new_path)
+                    write_checkpoint(checkpoint_path, checkpoint)
+                    writer = appender(new_path)
+
+            page_id = output_page_id
+            self.line_writer(output, writer)
+
+        writer.close()
+        if page_id is not None:
+            checkpoint['page_id'] = page_id
+            checkpoint['pages'] += 1
+        checkpoint['offset'] = _sync(new_path)
+        checkpoint['complete'] = True
+        write_checkpoint(checkpoint_path, checkpoint)
@@ -0,0 +1,38 @@
+from nose.tools import eq_, raises
+
+from ..authorship import Authorship
+
+
+def test_authorship():
+    authorship = Authorship().transition(
+        [(None, None, ["Apples", " ", "are", " ", "red", "."])], 1)
+    eq_(authorship.runs, 1)
+    eq_(len(authorship), 6)
+
+    # Copied runs that are contiguous in the insertion are merged
+    authorship = authorship.transition(
+        [(0, 4, None), (None, None, ["blué"]), (4, 4, None), (5, 6, None)],
+        2)
+    eq_(authorship.to_json(), [[4, 1], [1, 2], [1, 1]])
+    eq_(authorship.runs, 3)
+    eq_(authorship.origin(4), 2)
+    eq_(authorship.origin(-1), 1)
+    eq_(list(authorship.spans(2, 5)), [(2, 4, 1), (4, 5, 2)])
+    eq_(authorship.tokens_owned(), {1: 5, 2: 1})
+    eq_(authorship.bytes_owned(), {1: 12, 2: 5})
+    eq_(authorship.nbytes, 17)
+
+    users = {1: "Alice", 2: "Alice"}
+    eq_(authorship.to_json(key=users.get), [[6, "Alice"]])
+    eq_(authorship.tokens_owned(key=users.get), {"Alice": 6})
+
+    # Runs that aren't contiguous in the insertion are merged when reported
+    authorship = authorship.transition([(0, 4, None), (5, 6, None)], 3)
+    eq_(authorship.runs, 2)
+    eq_(authorship.to_json(), [[5, 1]])
+    eq_(authorship.bytes_owned(), {1: 12})
+
+
+@raises(IndexError)
+def test_authorship_origin_out_of_range():
+    Authorship().transition([(None, None, ["foo"])], 1).origin(1)
@@ -0,0 +1,108 @@
+import random
+
+import deltas
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_
+
+from ..columnar import ColumnarDiffState, np
+from ..state import DiffState
+from ..token import AggregateToken
+from .test_ledger import random_opdocs
+
+
+def test_columnar_diff_state():
+    if np is None:
+        raise SkipTest("numpy is not installed")
+
+    state = ColumnarDiffState(deltas.SegmentMatcher(), revert_radius=15)
+
+    tokens, added, removed = state.update("Apples are red.", ("a", 1))
+    eq_(tokens, ["Apples", " ", "are", " ", "red", "."])
+    eq_(added, ["Apples", " ", "are", " ", "red", "."])
+    eq_(removed, [])
+    first_added = added
+
+    tokens, added, removed = state.update("Apples are blue.", ("b", 2))
+    eq_(added, ["blue"])
+    eq_(removed, ["red"])
+
+    tokens, added, removed = state.update("Apples are red.", ("a", 3))
+    eq_(tokens, ["Apples", " ", "are", " ", "red", "."])
+    eq_(added, [])
+
+    eq_(list(first_added.token_docs())[4],
+        {'text': "red", 'persisted': 1, 'non_self_persisted': 0,
+         'seconds_visible': 4})
+
+
+def test_columnar_matches_diff_state():
+    if np is None:
+        raise SkipTest("numpy is not installed")
+
+    rand = random.Random(1)
+    state = DiffState(revert_radius=3, token_class=AggregateToken)
+    columnar_state = ColumnarDiffState(revert_radius=3, capacity=4)
+
+    added, columnar_added = [], []
+    checksums = []
+    for i in range(200):
+        if len(checksums) > 2 and rand.random() < 0.1:
+            checksum = checksums[-rand.randint(2, 3)]
+            opdocs = []
+        else:
+            checksum = str(i)
+            opdocs = random_opdocs(len(state.last.tokens or []), rand)
+        checksums.append(checksum)
+        revision = (rand.choice(["a", "b", "c"]), rand.randint(0, 100))
+
+        tokens, tokens_added, _ = \
+            state.update_opdocs(checksum, opdocs, revision)
+        added.extend(tokens_added)
+        columnar_tokens, columnar_tokens_added, _ = \
+            columnar_state.update_opdocs(checksum, opdocs, revision)
+        columnar_added.append(columnar_tokens_added)
+        eq_(columnar_tokens, tokens)
+
+    columnar_docs = [doc for tokens_added in columnar_added
+                     for doc in tokens_added.token_docs()]
+
+    eq_([(str(t), t.persisted, t.non_self_persisted, t.seconds_visible)
+         for t in added],
+        [(d['text'], d['persisted'], d['non_self_persisted'],
+          d['seconds_visible']) for d in columnar_docs])
+
+
+def test_columnar_reclaims_rows():
+    if np is None:
+        raise SkipTest("numpy is not installed")
+
+    rand = random.Random(2)
+    state = DiffState(revert_radius=3, token_class=AggregateToken)
+    columnar_state = ColumnarDiffState(revert_radius=3)
+
+    window, total_added = [], 0
+    for i in range(3000):
+        opdocs = random_opdocs(len(state.last.tokens or []), rand)
+        # Replace the page every so often so that most tokens die
+        if i % 50 == 0:
+            opdocs = [{'name': "insert", 'a1': 0, 'a2': 0,
+                       'tokens': ["x"] * 60}]
+        revision = (rand.choice(["a", "b", "c"]), rand.randint(0, 100))
+
+        _, tokens_added, _ = state.update_opdocs(str(i), opdocs, revision)
+        _, columnar_tokens_added, _ = \
+            columnar_state.update_opdocs(str(i), opdocs, revision)
+        total_added += len(tokens_added)
+        window.append((tokens_added, columnar_tokens_added))
+
+        if len(window) > 5:
+            tokens_added, columnar_tokens_added = window.pop(0)
+            columnar_state.settle(columnar_tokens_added)
+            eq_([(str(t), t.persisted, t.non_self_persisted,
+                  t.seconds_visible) for t in tokens_added],
+                [(d['text'], d['persisted'], d['non_self_persisted'],
+                  d['seconds_visible'])
+                 for d in columnar_tokens_added.token_docs()])
+
+    assert columnar_state.size < total_added / 4, \
+        (columnar_state.size, total_added)
@@ -0,0 +1,34 @@
+from nose.tools import eq_
+
+from ..interning import Interner
+from ..state import apply_opdocs
+from ..token import Token
+
+
+def test_interner():
+    shared = Interner(maxsize=2)
+    interner = Interner(shared=shared)
+
+    foo = interner.intern("".join(["f", "oo"]))
+    assert interner.intern("".join(["fo", "o"])) is foo
+    assert shared.intern("foo") is foo
+
+    token = interner.intern(Token("bar"))
+    eq_(token.__class__, str)
+    assert interner.intern("bar") is token
+
+    interner.intern("baz")
+    eq_(len(interner), 3)
+    eq_(len(shared), 2)
+    assert "baz" not in shared
+
+
+def test_apply_opdocs_interning():
+    interner = Interner()
+    op_docs = [{'name': "insert", 'a1': 0, 'a2': 0, 'b1': 0, 'b2': 3,
+                'tokens': ["".join(["fo", "o"]), " ", "".join(["f", "oo"])]}]
+
+    tokens, added, removed = apply_opdocs(op_docs, [], interner=interner)
+    eq_(tokens, ["foo", " ", "foo"])
+    assert op_docs[0]['tokens'][0] is op_docs[0]['tokens'][2]
+    assert tokens[0] is not tokens[2]
@@ -0,0 +1,45 @@
+import io
+import json
+
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_, raises
+
+from ..json_codecs import get_codec
+
+DOCS = [{'id': 1, 'text': "Foo/bär", 'tokens': ["a", " "]},
+        {'id': 2, 'user': None, 'seconds': 2.5}]
+
+
+def check_codec(codec):
+    f = io.StringIO()
+    for doc in DOCS:
+        codec.write(doc, f)
+    lines = f.getvalue().splitlines()
+
+    eq_([json.loads(line) for line in lines], DOCS)
+    eq_(list(codec.read(io.StringIO(f.getvalue()))), DOCS)
+
+
+def test_json():
+    codec = get_codec("json")
+    eq_(codec.name, "json")
+    check_codec(codec)
+
+
+def test_orjson():
+    codec = get_codec("orjson")
+    if codec.name != "orjson":
+        raise SkipTest("orjson is not installed")
+    check_codec(codec)
+
+
+def test_ujson():
+    codec = get_codec("ujson")
+    if codec.name != "ujson":
+        raise SkipTest("ujson is not installed")
+    check_codec(codec)
+
+
+@raises(ValueError)
+def test_unknown_codec():
+    get_codec("yaml")
@@ -0,0 +1,97 @@
+import random
+
+import deltas
+from nose.tools import eq_
+
+from ..sequence import TokenSequence
+from ..state import DiffState
+from ..token import AggregateToken
+
+
+def random_opdocs(length, rand):
+    """
+    Generates a random diff that includes copies of earlier tokens.
+    """
+    opdocs = []
+    a1, b1 = 0, 0
+    while a1 < length:
+        a2 = min(length, a1 + rand.randint(1, 5))
+        name = rand.choice(["equal"] * 12 + ["delete", "insert", "copy"])
+        if name != "equal" and length > 100:
+            name = "delete"
+        if name == "equal":
+            opdocs.append({'name': "equal", 'a1': a1, 'a2': a2,
+                           'b1': b1, 'b2': b1 + a2 - a1})
+            b1 += a2 - a1
+            a1 = a2
+        elif name == "delete":
+            opdocs.append({'name': "delete", 'a1': a1, 'a2': a2,
+                           'b1': b1, 'b2': b1})
+            a1 = a2
+        elif name == "copy":
+            c1 = rand.randint(0, a1)
+            c2 = min(length, c1 + 3)
+            opdocs.append({'name': "equal", 'a1': c1, 'a2': c2,
+                           'b1': b1, 'b2': b1 + c2 - c1})
+            b1 += c2 - c1
+        else:
+            tokens = [rand.choice("abc ") for _ in range(rand.randint(1, 4))]
+            opdocs.append({'name': "insert", 'a1': a1, 'a2': a1,
+                           'b1': b1, 'b2': b1 + len(tokens),
+                           'tokens': tokens})
+            b1 += len(tokens)
+    if b1 == 0:
+        opdocs.append({'name': "insert", 'a1': length, 'a2': length,
+                       'b1': 0, 'b2': 1, 'tokens': ["a"]})
+    return opdocs
+
+
+def test_lazy_diff_state():
+    rand = random.Random(0)
+    eager = DiffState(revert_radius=3)
+    lazy = DiffState(revert_radius=3, sequence_class=TokenSequence, lazy=True)
+    eager_aggregate = DiffState(revert_radius=3, token_class=AggregateToken)
+    lazy_aggregate = DiffState(revert_radius=3, token_class=AggregateToken,
+                               lazy=True)
+
+    states = [eager, lazy, eager_aggregate, lazy_aggregate]
+    added = [[] for state in states]
+    checksums = []
+    for i in range(200):
+        if len(checksums) > 2 and rand.random() < 0.1:
+            checksum = checksums[-rand.randint(2, 3)]
+            opdocs = None
+        else:
+            checksum = str(i)
+            opdocs = random_opdocs(len(eager.last.tokens or []), rand)
+        checksums.append(checksum)
+        revision = (rand.choice(["a", "b", "c"]), rand.randint(0, 100))
+
+        for state, state_added in zip(states, added):
+            _, tokens_added, _ = \
+                state.update_opdocs(checksum, opdocs or [], revision)
+            state_added.extend(tokens_added)
+
+    for state, state_added in zip(states, added):
+        state.settle(state_added)
+        eq_(len(state_added), len(added[0]))
+
+    eq_([t.revisions for t in added[1]], [t.revisions for t in added[0]])
+    for eager_token, lazy_token in zip(added[2], added[3]):
+        eq_((eager_token.persisted, eager_token.non_self_persisted,
+             eager_token.seconds_visible),
+            (lazy_token.persisted, lazy_token.non_self_persisted,
+             lazy_token.seconds_visible))
+
+
+def test_lazy_diff_copy_revisions():
+    state = DiffState(deltas.SegmentMatcher(), revert_radius=15, lazy=True)
+
+    tokens, added, removed = state.update("Apples are red.", revision=0)
+    tokens, added, removed = state.update("Apples are red. Apples are red.",
+                                          revision=1)
+    tokens, added, removed = state.update("Apples are red.", revision=2)
+
+    state.settle(tokens)
+    eq_(tokens[0], "Apples")
+    eq_(tokens[0].revisions, [0, 1, 2])
@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import time
+
+from nose.tools import eq_
+
+from ..metrics import Metrics, json_dumper
+from ..utilities.diffs2persistence import diffs2persistence
+from ..utilities.tests.test_diffs2persistence import test_diff_docs
+
+
+def test_exclusive_stages():
+    metrics = Metrics()
+
+    def slow(items, seconds):
+        for item in items:
+            time.sleep(seconds)
+            yield item
+
+    inner = metrics.timed('inner', slow(range(3), 0.01))
+    outer = metrics.timed('outer', slow(inner, 0.02))
+    eq_(list(outer), [0, 1, 2])
+
+    inner_seconds, inner_items = metrics.stages['inner']
+    outer_seconds, outer_items = metrics.stages['outer']
+    eq_((inner_items, outer_items), (3, 3))
+    assert 0.03 <= inner_seconds < 0.06, inner_seconds
+    assert 0.06 <= outer_seconds < 0.09, outer_seconds
+
+
+def test_pages():
+    snapshots = []
+    metrics = Metrics(callbacks=[snapshots.append], slowest=1)
+    docs = [{'page': {'id': page_id}} for page_id in [1, 1, 2, 3, 3, 3]]
+    eq_(list(metrics.pages(docs, lambda d: d['page']['id'])), docs)
+    metrics.report()
+
+    eq_(len(snapshots), 1)
+    eq_(snapshots[0]['counters'], {'pages': 3, 'revisions': 6})
+    eq_(len(snapshots[0]['slowest_pages']), 1)
+    eq_(snapshots[0]['stages']['write']['items'], 6)
+
+
+def test_diffs2persistence_metrics():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "metrics.json")
+        metrics = Metrics(callbacks=[json_dumper(path)])
+        list(diffs2persistence(json.loads(json.dumps(test_diff_docs)),
+                               metrics=metrics))
+        metrics.report()
+        with open(path) as f:
+            snapshot = json.load(f)
+
+    eq_(snapshot['counters'], {'opdocs': 8, 'tokens': 16, 'reverts': 1,
+                               'window_flushes': 4})
+    eq_(set(snapshot['stages']), {'persistence', 'state', 'window'})
+    eq_(snapshot['stages']['state']['items'], 4)
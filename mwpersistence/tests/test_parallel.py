@@ -0,0 +1,71 @@
+import os
+
+import para
+from nose.tools import eq_, raises
+
+from ..parallel import map_pages, run_pipeline
+
+
+def count_revisions(rev_docs, weight):
+    for rev_doc in rev_docs:
+        yield (rev_doc['page']['title'], weight(len(rev_docs)))
+
+
+def test_map_pages():
+    rev_docs = [{'page': {'title': str(i // 3)}} for i in range(30)]
+
+    # Lambdas can be passed since they are inherited by the workers
+    eq_(list(map_pages(count_revisions, rev_docs, 3, buffer_size=2,
+                       weight=lambda n: n * 10)),
+        [(str(i // 3), 30) for i in range(30)])
+
+
+def map_titles(title):
+    rev_docs = [{'page': {'title': title}} for i in range(3)]
+    yield from map_pages(count_revisions, rev_docs, 2, weight=lambda n: n)
+
+
+def test_map_pages_daemonic():
+    # para.map() processes several items in daemonic processes
+    eq_(sorted(para.map(map_titles, ["a", "b"], mappers=2)),
+        [("a", 3)] * 3 + [("b", 3)] * 3)
+
+
+def test_run_pipeline():
+    docs = ({'id': i} for i in range(100))
+    stages = [lambda docs: (dict(d, square=d['id'] ** 2) for d in docs),
+              lambda docs: (d for d in docs if d['id'] % 2 == 0)]
+
+    eq_(list(run_pipeline(docs, stages, queue_size=2, chunk_size=7)),
+        [{'id': i, 'square': i ** 2} for i in range(0, 100, 2)])
+    eq_(list(run_pipeline([1, 2], [])), [1, 2])
+
+
+def fail(docs):
+    for doc in docs:
+        if doc == 3:
+            raise ValueError(doc)
+        yield doc
+
+
+@raises(ValueError)
+def test_run_pipeline_error():
+    list(run_pipeline(range(10), [fail, list]))
+
+
+def die(docs):
+    os._exit(1)
+
+
+@raises(RuntimeError)
+def test_run_pipeline_dead_stage():
+    list(run_pipeline(range(10), [list, die]))
+
+
+def pipeline_items(n):
+    yield from run_pipeline(range(n), [lambda docs: (d * 2 for d in docs)])
+
+
+def test_run_pipeline_daemonic():
+    eq_(sorted(para.map(pipeline_items, [2, 3], mappers=2)),
+        [0, 0, 2, 2, 4])
@@ -0,0 +1,72 @@
+import json
+
+from nose.tools import eq_
+
+from ..pool import StatePool
+from ..spill import Spilled
+
+
+def test_state_pool():
+    pool = StatePool(max_pages=2)
+    for page_id in [1, 2, 3]:
+        pool.put(page_id, {'revisions': [page_id]})
+    eq_(pool.evictions, 1)
+    eq_(list(pool.evicted.keys()), [1])
+    eq_(len(pool), 3)
+    eq_(2 in pool, True)
+    eq_(4 in pool, False)
+
+    # Restoring a state evicts the least recently used one
+    eq_(pool.get(1), {'revisions': [1]})
+    eq_(pool.restores, 1)
+    eq_(list(pool.evicted.keys()), [2])
+    eq_(pool.get(4, "default"), "default")
+
+    eq_(list(pool.drain()), [(2, {'revisions': [2]}),
+                             (3, {'revisions': [3]}),
+                             (1, {'revisions': [1]})])
+    eq_(len(pool), 0)
+
+
+def test_state_pool_max_bytes():
+    pool = StatePool(max_pages=10, max_bytes=10, sizeof=len)
+    pool.put(1, "a" * 6)
+    pool.put(2, "b" * 6)
+    eq_(pool.evictions, 1)
+    eq_(pool.nbytes, 6)
+    eq_(pool.evicted_bytes() > 0, True)
+
+    # The state that was just kept is never evicted
+    pool.put(3, "c" * 20)
+    eq_(list(pool.states.keys()), [3])
+    eq_(pool.pop(1), "a" * 6)
+    eq_(pool.pop(3), "c" * 20)
+    eq_(pool.nbytes, 0)
+
+
+def test_state_pool_bounded():
+    dumped = []
+
+    def dump(state, f):
+        dumped.append(state)
+        f.write(json.dumps(state).encode('utf-8'))
+
+    def load(f):
+        return json.loads(f.read().decode('utf-8'))
+
+    pool = StatePool(max_pages=100, max_bytes=50, sizeof=len, dump=dump,
+                     load=load)
+    for page_id in range(100):
+        pool.put(page_id, [page_id] * 10)
+        eq_(pool.nbytes <= 50, True)
+
+    # Evicted states are on disk.  Only references to them are in memory.
+    eq_(len(pool.states), 5)
+    eq_(len(pool.evicted), 95)
+    eq_(all(isinstance(ref, Spilled) for ref in pool.evicted.values()),
+        True)
+    eq_(len(dumped), 95)
+
+    eq_(pool.get(0), [0] * 10)
+    eq_(sorted(page_id for page_id, _ in pool.drain()), list(range(100)))
+    pool.close()
@@ -0,0 +1,93 @@
+import bz2
+import json
+import os
+import tempfile
+
+import mwxml
+from nose.tools import eq_
+
+from ..schedule import schedule, split_multistream
+
+HEADER = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/"
+           version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+    </namespaces>
+  </siteinfo>
+"""
+
+PAGE = """  <page>
+    <title>Page {0}</title>
+    <ns>0</ns>
+    <id>{0}</id>
+    <revision>
+      <id>{1}</id>
+      <timestamp>2004-08-09T09:04:08Z</timestamp>
+      <sha1>{1}</sha1>
+      <text xml:space="preserve">{2}</text>
+    </revision>
+    <revision>
+      <id>{3}</id>
+      <timestamp>2004-08-10T09:04:08Z</timestamp>
+      <sha1>{3}</sha1>
+      <text xml:space="preserve">{2} more</text>
+    </revision>
+  </page>
+"""
+
+
+def write_multistream(path, pages, pages_per_stream):
+    with open(path, 'wb') as f:
+        f.write(bz2.compress(HEADER.encode('utf-8')))
+        for start in range(1, pages + 1, pages_per_stream):
+            xml = "".join(PAGE.format(page_id, page_id * 2, os.urandom(200)
+                                      .hex(), page_id * 2 + 1)
+                          for page_id in range(start, min(start +
+                                               pages_per_stream, pages + 1)))
+            f.write(bz2.compress(xml.encode('utf-8')))
+        f.write(bz2.compress(b"</mediawiki>\n"))
+
+
+def page_ids(task):
+    with task.open() as f:
+        return [page.id for page in mwxml.Dump.from_file(f)]
+
+
+def test_split_multistream():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dump-multistream.xml.bz2")
+        write_multistream(path, 50, 5)
+
+        tasks = split_multistream(path, os.path.getsize(path) // 4)
+        eq_(len(tasks), 4)
+        eq_(tasks[1].name, "dump-multistream.xml.part-0001.bz2")
+        eq_(sum((page_ids(task) for task in tasks), []), list(range(1, 51)))
+
+        whole, = split_multistream(path, os.path.getsize(path))
+        eq_(whole.part, None)
+        eq_(page_ids(whole), list(range(1, 51)))
+
+        # A single-stream file can't be split
+        single_path = os.path.join(directory, "dump.xml.bz2")
+        with bz2.open(single_path, 'wb') as f, bz2.open(path, 'rb') as g:
+            f.write(g.read())
+        eq_([task.part for task in split_multistream(single_path, 100)],
+            [None])
+
+
+def test_schedule():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, revisions in enumerate([3, 10, 1]):
+            path = os.path.join(directory, "{0}.json".format(i))
+            with open(path, 'w') as f:
+                for _ in range(revisions):
+                    f.write(json.dumps({'id': 1}) + "\n")
+            paths.append(path)
+
+        eq_([task.name for task in schedule(paths)],
+            ["1.json", "0.json", "2.json"])
+        tasks = schedule(paths, prescan=True, threads=1)
+        eq_([task.revisions for task in tasks], [10, 3, 1])
@@ -0,0 +1,69 @@
+import random
+
+import deltas
+from nose.tools import eq_
+
+from .. import state as state_module
+from ..sequence import TokenSequence
+from ..state import DiffState
+
+
+def test_token_sequence():
+    tokens = list(range(1000))
+    sequence = TokenSequence(tokens)
+    eq_(len(sequence), 1000)
+    eq_(sequence, tokens)
+    eq_(sequence[10], 10)
+    eq_(sequence[-1], 999)
+    eq_(sequence[10:500], tokens[10:500])
+    eq_(sequence[990:2000], tokens[990:2000])
+    eq_(sequence[500:10], [])
+    eq_(sequence[::2], tokens[::2])
+
+
+def test_token_sequence_edits():
+    random.seed(0)
+    tokens = list(range(500))
+    sequence = TokenSequence(tokens)
+
+    for i in range(200):
+        a1 = random.randint(0, len(tokens))
+        a2 = random.randint(a1, len(tokens))
+        new_tokens = [-i] * random.randint(0, 10)
+
+        tokens = tokens[:a1] + new_tokens + tokens[a2:]
+        edited = TokenSequence()
+        edited.extend(sequence[:a1])
+        edited.extend(new_tokens)
+        edited.extend(sequence[a2:])
+        sequence = edited
+
+        eq_(len(sequence), len(tokens))
+    eq_(sequence, tokens)
+
+
+def test_diff_state_with_token_sequence():
+    texts = ["Apples are red.", "Apples are blue.", "Apples are red.",
+             "Apples are tasty and red.", "Apples are tasty and blue."]
+
+    state = DiffState(deltas.SegmentMatcher(), revert_radius=15)
+    sequence_state = DiffState(deltas.SegmentMatcher(), revert_radius=15,
+                               sequence_class=TokenSequence)
+
+    # Diffs of such short texts are fragmented, so they would be applied to
+    # lists
+    tokens_per_operation = state_module.TOKENS_PER_OPERATION
+    state_module.TOKENS_PER_OPERATION = 0
+    try:
+        for revision, text in enumerate(texts):
+            tokens, added, removed = state.update(text, revision)
+            s_tokens, s_added, s_removed = \
+                sequence_state.update(text, revision)
+            assert isinstance(s_tokens, TokenSequence)
+            eq_(s_tokens, tokens)
+            eq_(s_added, added)
+            eq_(s_removed, removed)
+            eq_([t.revisions for t in s_tokens],
+                [t.revisions for t in tokens])
+    finally:
+        state_module.TOKENS_PER_OPERATION = tokens_per_operation
@@ -0,0 +1,101 @@
+import io
+
+import deltas
+from nose.tools import eq_, raises
+
+from ..sequence import TokenSequence
+from ..state import DiffState
+from ..token import AggregateToken
+
+TEXTS = ["Apples are red.", "Apples are blue.", "Apples are red.",
+         "Apples are tasty and red.", "Apples are tasty and blue."]
+
+
+def round_trip(state, **kwargs):
+    f = io.BytesIO()
+    state.dump(f)
+    f.seek(0)
+    return DiffState.load(f, **kwargs)
+
+
+def process(state, texts, start):
+    docs = []
+    for i, text in enumerate(texts, start):
+        current, _, _ = state.update(text, revision=("user" + str(i % 2), i))
+        state.settle(current)
+        docs.append([(str(token), list(token.revisions)) for token in current])
+    return docs
+
+
+def test_snapshot():
+    state = DiffState(deltas.SegmentMatcher(), revert_radius=15)
+    docs = process(state, TEXTS, 0)
+
+    state = DiffState(deltas.SegmentMatcher(), revert_radius=15)
+    resumed_docs = process(state, TEXTS[:2], 0)
+    state = round_trip(state, diff_engine=deltas.SegmentMatcher())
+    eq_(len(state.revert_detector.history), 2)
+    eq_(state.last.tokens[0].revisions, [("user0", 0), ("user1", 1)])
+    # The revert to the first version is still detected
+    resumed_docs.extend(process(state, TEXTS[2:], 2))
+    eq_(state.reverts, 1)
+
+    eq_(resumed_docs, docs)
+
+
+def test_snapshot_aggregate():
+    kwargs = {'revert_radius': 15, 'token_class': AggregateToken,
+              'sequence_class': TokenSequence, 'lazy': True,
+              'authorship': True}
+    state = DiffState(deltas.SegmentMatcher(), **kwargs)
+    for i, text in enumerate(TEXTS[:4]):
+        state.update(text, revision=("user" + str(i % 2), i))
+    authorship = state.authorship.to_json()
+
+    loaded = round_trip(state, diff_engine=deltas.SegmentMatcher())
+    eq_(loaded.sequence_class, TokenSequence)
+    eq_(loaded.authorship.to_json(), authorship)
+    eq_(len(loaded.ledger.revisions), 4)
+
+    for s in (state, loaded):
+        current, _, _ = s.update(TEXTS[4], revision=("user0", 4))
+        s.settle(current)
+    eq_([(str(t), t.user, t.persisted, t.non_self_persisted,
+          t.seconds_visible) for t in loaded.last.tokens],
+        [(str(t), t.user, t.persisted, t.non_self_persisted,
+          t.seconds_visible) for t in state.last.tokens])
+
+
+@raises(ValueError)
+def test_snapshot_bad_magic():
+    DiffState.load(io.BytesIO(b"NOTASNAPSHOT" * 4))
+
+
+def test_snapshot_shares_runs():
+    state = DiffState(revert_radius=15, sequence_class=TokenSequence)
+    tokens = ["word" + str(i) for i in range(200)]
+    state.update_opdocs("a", [{'name': "insert", 'a1': 0, 'a2': 0,
+                               'b1': 0, 'b2': 200, 'tokens': tokens}],
+                        revision=1)
+    state.update_opdocs("b", [{'name': "equal", 'a1': 0, 'a2': 199,
+                               'b1': 0, 'b2': 199},
+                              {'name': "delete", 'a1': 199, 'a2': 200,
+                               'b1': 199, 'b2': 199, 'tokens': ["word199"]}],
+                        revision=2)
+
+    loaded = round_trip(state)
+    first, second = [version.tokens for _, version in
+                     loaded.revert_detector.history]
+    eq_(list(map(str, second)), tokens[:199])
+    eq_(len(set(map(id, first.runs())) & set(map(id, second.runs()))), 3)
+
+
+@raises(ValueError)
+def test_snapshot_unknown_class():
+    state = DiffState(deltas.SegmentMatcher(), revert_radius=15)
+    process(state, TEXTS[:2], 0)
+    f = io.BytesIO()
+    state.dump(f)
+    snapshot = f.getvalue().replace(b'"token_class":"Token"',
+                                    b'"token_class":"Tokex"')
+    DiffState.load(io.BytesIO(snapshot))
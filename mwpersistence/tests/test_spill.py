@@ -0,0 +1,35 @@
+from nose.tools import eq_
+
+from ..spill import SpillFile
+
+
+def test_spill_file():
+    spill = SpillFile(segment_bytes=100)
+    docs = [{'id': i, 'text': "x" * 40} for i in range(5)]
+    refs = [spill.dump(doc) for doc in docs]
+    eq_(spill.spilled, 5)
+    eq_(spill.read(refs[0]), docs[0])
+
+    first_segment = refs[0].segment
+    eq_([spill.load(ref) for ref in refs[:3]], docs[:3])
+    eq_(first_segment.f.closed, True)
+
+    eq_([spill.load(ref) for ref in refs[3:]], docs[3:])
+    eq_(spill.segment.size, 0)
+
+    ref = spill.dump(docs[0])
+    eq_(ref.offset, 0)
+    eq_(spill.load(ref), docs[0])
+    spill.close()
+
+
+def test_spill_file_close():
+    spill = SpillFile(segment_bytes=100)
+    refs = [spill.dump({'id': i, 'text': "x" * 40}) for i in range(5)]
+    segments = {ref.segment for ref in refs}
+    eq_(len(segments), 3)
+
+    # Segments that still hold documents are closed too
+    spill.close()
+    eq_([segment.f.closed for segment in segments], [True] * 3)
+    eq_(spill.segments, set())
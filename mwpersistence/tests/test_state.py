@@ -1,6 +1,7 @@
 import deltas
-from nose.tools import eq_
+from nose.tools import eq_, raises
 
+from ..sequence import TokenSequence
 from ..state import DiffState
 
 
@@ -78,3 +79,105 @@ def test_diff_copy_revisions():
     eq_(len(added), 1)
     eq_(tokens[0], "Apples")
     eq_(tokens[0].revisions, [0, 1])
+
+
+OPDOCS = [
+    ("aaa", [{'name': "insert", 'a1': 0, 'a2': 0, 'b1': 0, 'b2': 3,
+              'tokens': ["Apples", " ", "red"]}]),
+    ("bbb", [{'name': "equal", 'a1': 0, 'a2': 2, 'b1': 0, 'b2': 2},
+             {'name': "replace", 'a1': 2, 'a2': 3, 'b1': 2, 'b2': 3,
+              'tokens': ["blue"]}]),
+    ("aaa", [{'name': "equal", 'a1': 0, 'a2': 2, 'b1': 0, 'b2': 2},
+             {'name': "replace", 'a1': 2, 'a2': 3, 'b1': 2, 'b2': 3,
+              'tokens': ["red"]}])
+]
+
+
+def test_update_opdocs_many():
+    for lazy in (False, True):
+        sequence_class = TokenSequence if lazy else list
+        state = DiffState(revert_radius=15, lazy=lazy,
+                          sequence_class=sequence_class)
+        expected = [state.update_opdocs(checksum, opdocs, revision=i)
+                    for i, (checksum, opdocs) in enumerate(OPDOCS)]
+        state.settle(expected[0][1])
+
+        state = DiffState(revert_radius=15, lazy=lazy,
+                          sequence_class=sequence_class)
+        updates = state.update_opdocs_many(
+            (checksum, opdocs, i)
+            for i, (checksum, opdocs) in enumerate(OPDOCS))
+        state.settle(updates.tokens_added[0])
+
+        eq_(len(updates), 3)
+        eq_(updates.reverts, [2])
+        eq_(state.reverts, 1)
+        eq_(updates.current_tokens, None)
+        eq_(updates.tokens_removed, None)
+        eq_(updates.tokens_added, [added for _, added, _ in expected])
+        eq_([t.revisions for t in updates.tokens_added[0]],
+            [t.revisions for t in expected[0][1]])
+
+    state = DiffState(revert_radius=15)
+    updates = state.update_opdocs_many(
+        [(checksum, opdocs, i) for i, (checksum, opdocs) in
+         enumerate(OPDOCS[:2])],
+        outputs=("current_tokens", "tokens_removed"))
+    eq_(updates.current_tokens, [["Apples", " ", "red"],
+                                 ["Apples", " ", "blue"]])
+    eq_(updates.tokens_removed, [[], ["red"]])
+
+
+def test_diff_state_fragmented():
+    state = DiffState(revert_radius=15, sequence_class=TokenSequence,
+                      lazy=True)
+    tokens = ["a", " "] * 1024
+    current, _, _ = state.update_opdocs("aaa", [
+        {'name': "insert", 'a1': 0, 'a2': 0, 'b1': 0, 'b2': len(tokens),
+         'tokens': tokens}])
+    eq_(type(current), list)
+
+    # A small edit shares the structure of the previous revision
+    current, _, _ = state.update_opdocs("bbb", [
+        {'name': "equal", 'a1': 0, 'a2': 2047, 'b1': 0, 'b2': 2047},
+        {'name': "replace", 'a1': 2047, 'a2': 2048, 'b1': 2047, 'b2': 2048,
+         'tokens': ["."]}])
+    eq_(type(current), TokenSequence)
+
+    # A fragmented diff is applied to a list
+    expected = list(current)
+    opdocs = []
+    for i in range(0, 2048, 512):
+        opdocs.append({'name': "equal", 'a1': i, 'a2': i + 511,
+                       'b1': i, 'b2': i + 511})
+        opdocs.append({'name': "replace", 'a1': i + 511, 'a2': i + 512,
+                       'b1': i + 511, 'b2': i + 512, 'tokens': ["!"]})
+        expected[i + 511] = "!"
+    current, _, _ = state.update_opdocs("ccc", opdocs)
+    eq_(type(current), list)
+    eq_(current, expected)
+
+
+@raises(ValueError)
+def test_update_opdocs_many_outputs():
+    DiffState(revert_radius=15).update_opdocs_many([], outputs=["tokens"])
+
+
+def test_diff_state_authorship():
+    state = DiffState(deltas.SegmentMatcher(), revert_radius=15,
+                      authorship=True)
+    eq_(state.authorship.to_json(), [])
+
+    state.update("Apples are red.", revision=(1, "Alice"), origin=1)
+    state.update("Apples are blue.", revision=(2, "Bob"), origin=2)
+    eq_(state.authorship.to_json(), [[4, 1], [1, 2], [1, 1]])
+
+    # A revert restores the authorship of the reverted-to version
+    state.update("Apples are red.", revision=(3, "Alice"), origin=3)
+    eq_(state.authorship.to_json(), [[6, 1]])
+
+    # The origin defaults to the revision
+    state.update("Apples are tasty and red.", revision=4)
+    eq_(state.authorship.to_json(), [[4, 1], [4, 4], [2, 1]])
+
+    eq_(DiffState(revert_radius=15).authorship, None)
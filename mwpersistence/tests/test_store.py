@@ -0,0 +1,45 @@
+import os
+import pickle
+import tempfile
+
+from nose.tools import eq_
+
+from ..state import DiffState
+from ..store import StateStore, skip_saved
+
+
+def test_state_store():
+    with tempfile.TemporaryDirectory() as directory:
+        state_store = StateStore(os.path.join(directory, "states.db"))
+        eq_(state_store.load(1), None)
+        eq_(1 in state_store, False)
+
+        state = DiffState(revert_radius=3)
+        state.update_opdocs("aaa", [{'name': "insert", 'a1': 0, 'a2': 0,
+                                     'b1': 0, 'b2': 2, 'tokens': ["a", "b"]}],
+                            revision=1)
+        state_store.save(1, 10, 100, state)
+        eq_(state_store.last_revision(1), (10, 100))
+
+        # The store re-opens its connection after being pickled
+        state_store = pickle.loads(pickle.dumps(state_store))
+        loaded = state_store.load(1)
+        eq_(list(loaded.last.tokens), ["a", "b"])
+        eq_(loaded.last.tokens[0].revisions, [1])
+
+        _, _, _ = loaded.update_opdocs(
+            "bbb", [{'name': "delete", 'a1': 0, 'a2': 2, 'b1': 0, 'b2': 0}],
+            revision=2)
+        tokens, added, removed = loaded.update_opdocs("aaa", [], revision=3)
+        eq_(list(tokens), ["a", "b"])
+        eq_(len(added), 0)
+
+        rev_docs = [{'id': rev_id, 'timestamp': timestamp,
+                     'page': {'id': page_id}}
+                    for page_id, rev_id, timestamp in [
+                        (1, 9, "1970-01-01T00:01:00Z"),
+                        (1, 10, "1970-01-01T00:01:40Z"),
+                        (1, 11, "1970-01-01T00:02:00Z"),
+                        (2, 12, "1970-01-01T00:00:00Z")]]
+        eq_([d['id'] for d in skip_saved(rev_docs, state_store)],
+            [10, 11, 12])
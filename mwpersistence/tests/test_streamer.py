@@ -0,0 +1,62 @@
+import bz2
+import json
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from ..streamer import Streamer, skip_pages
+
+DOCS = [{'page': {'id': page_id}, 'id': rev_id}
+        for page_id, rev_id in [(1, 1), (1, 2), (2, 3), (3, 4), (3, 5),
+                                (4, 6), (5, 7)]]
+
+
+def test_skip_pages():
+    eq_([d['id'] for d in skip_pages(DOCS, 3, Streamer.doc_page_id)],
+        [6, 7])
+    eq_(list(skip_pages(DOCS, 5, Streamer.doc_page_id)), [])
+
+
+def test_checkpoint_resume():
+    processed = []
+
+    def crash_at_page_4(docs, verbose=False):
+        for doc in docs:
+            if doc['page']['id'] == 4:
+                raise RuntimeError("Crash!")
+            yield doc
+
+    def record(docs, verbose=False):
+        for doc in docs:
+            processed.append(doc['id'])
+            yield doc
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "input.json")
+        with open(path, 'w') as f:
+            for doc in DOCS:
+                f.write(json.dumps(doc) + "\n")
+        output_dir = os.path.join(directory, "output")
+        os.mkdir(output_dir)
+        output_path = os.path.join(output_dir, "input.bz2")
+
+        streamer = Streamer(None, __name__, crash_at_page_4)
+        streamer.checkpoint = 2
+        try:
+            streamer.run([path], 1, {}, output_dir, "bz2", False)
+        except RuntimeError:
+            pass
+        with open(output_path + ".checkpoint") as f:
+            eq_(json.load(f)['page_id'], 2)
+
+        streamer = Streamer(None, __name__, record)
+        streamer.checkpoint = 2
+        streamer.run([path], 1, {}, output_dir, "bz2", False)
+        eq_(processed, [4, 5, 6, 7])
+        with bz2.open(output_path, 'rt') as f:
+            eq_([json.loads(line) for line in f], DOCS)
+
+        # A complete output is skipped
+        streamer.run([path], 1, {}, output_dir, "bz2", False)
+        eq_(processed, [4, 5, 6, 7])
@@ -1,6 +1,6 @@
 from nose.tools import eq_
 
-from ..token import Token
+from ..token import AggregateToken, Token
 
 
 def test_token():
@@ -10,3 +10,16 @@ def test_token():
     t.persist(1)
     t.persist(2)
     eq_(t.revisions, [1, 2])
+
+
+def test_aggregate_token():
+    t = AggregateToken("foo")
+    eq_(t.persisted, -1)
+
+    t.persist(("EpochFail", 10))
+    t.persist(("127.0.0.1", 5))
+    t.persist(("EpochFail", 1))
+    eq_(t.user, "EpochFail")
+    eq_(t.persisted, 2)
+    eq_(t.non_self_persisted, 1)
+    eq_(t.seconds_visible, 16)
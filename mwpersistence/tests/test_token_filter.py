@@ -0,0 +1,32 @@
+import pickle
+import re
+
+from nose.tools import eq_
+
+from ..token_filter import TokenFilter
+
+
+def test_token_filter():
+    token_filter = TokenFilter(include=re.compile(r"[a-z]", re.I),
+                               exclude=lambda t: t == "the")
+    eq_([token_filter(t) for t in ["Foo", " ", "the", "Foo", "bar", " "]],
+        [True, False, False, True, True, False])
+    eq_(token_filter.hits, 2)
+    eq_(token_filter.misses, 4)
+    eq_(token_filter.hit_rate, 2 / 6)
+
+    eq_(TokenFilter().filters, False)
+    eq_(TokenFilter(exclude=r"\s+")(" "), False)
+
+
+def test_token_filter_maxsize():
+    token_filter = TokenFilter(exclude=r"\s+", maxsize=1)
+    eq_([token_filter(t) for t in ["foo", " ", " "]], [True, False, False])
+    eq_(len(token_filter.decisions), 1)
+    eq_(token_filter.hits, 0)
+
+
+def test_token_filter_pickle():
+    token_filter = pickle.loads(pickle.dumps(TokenFilter(include=r"foo")))
+    eq_(token_filter("foo"), True)
+    eq_(token_filter("bar"), False)
@@ -0,0 +1,75 @@
+import pickle
+
+from nose.tools import eq_
+
+from ..spill import SpillFile, Spilled
+from ..window import Window
+
+
+def test_window():
+    window = Window(3)
+    alice, bob = {'id': 1, 'text': "Alice"}, {'id': 2, 'text': "Bob"}
+
+    window.append(({'user': alice}, 0, []))
+    window.append(({'user': bob}, 1, []))
+    eq_(window.full(), False)
+    eq_(window.non_self(alice), 1)
+
+    window.append(({'user': dict(alice)}, 2, []))
+    window.append(({'user': bob}, 3, []))
+    eq_(window.full(), True)
+    eq_(len(window), 3)
+    eq_(window[0], ({'user': bob}, 1, []))
+    eq_(window.non_self(alice), 2)
+    eq_(window.non_self(bob), 1)
+    eq_(window.non_self({'text': "127.0.0.1"}), 3)
+
+    eq_(window.popleft(), ({'user': bob}, 1, []))
+    eq_(window.non_self(bob), 1)
+    eq_([timestamp for _, timestamp, _ in window], [2, 3])
+
+
+def test_window_bounds():
+    alice = {'id': 1, 'text': "Alice"}
+
+    window = Window(10, max_seconds=5)
+    window.push(({'user': alice}, 0, [1, 2]))
+    eq_(window.ending(), None)
+    window.push(({'user': alice}, 4, []))
+    eq_(window.ending(), None)
+    window.push(({'user': alice}, 5, [3]))
+    eq_(window.ending(), "seconds")
+    eq_(window.adaptive, True)
+
+    window = Window(10, max_bytes=250, token_bytes=100)
+    window.push(({'user': alice}, 0, [1, 2]))
+    eq_(window.ending(), None)
+    eq_(window.nbytes(), 200)
+    window.push(({'user': alice}, 1, [3]))
+    eq_(window.ending(), "bytes")
+    window.popleft()
+    eq_(window.nbytes(), 100)
+    eq_(window.ending(), None)
+
+    window = Window(1)
+    eq_(window.adaptive, False)
+    window.push(({'user': alice}, 0, []))
+    window.push(({'user': alice}, 1, []))
+    eq_(window.ending(), "revisions")
+    window.append(({'user': alice}, 2, []))
+    eq_(len(window), 2)
+
+
+def test_window_spill():
+    alice, bob = {'id': 1, 'text': "Alice"}, {'id': 2, 'text': "Bob"}
+    window = Window(3, spill=SpillFile())
+    window.push(({'user': alice}, 0, []))
+    window.push(({'user': bob}, 1, [1]), spill=True)
+    eq_(window.non_self(alice), 1)
+    eq_(isinstance(window[1][0], Spilled), True)
+
+    restored = pickle.loads(pickle.dumps(window))
+    eq_(list(restored), [({'user': alice}, 0, []), ({'user': bob}, 1, [1])])
+
+    eq_(window.popleft(), ({'user': alice}, 0, []))
+    eq_(window.popleft(), ({'user': bob}, 1, [1]))
@@ -2,7 +2,7 @@ import deltas
 
 
 class Token(deltas.Token):
-    __slots__ = ('revisions',)
+    __slots__ = ('revisions', 'live_copies', 'live_since')
 
     def __init__(self, content, type=None, revisions=None):
         super().__init__(content, type=type)
@@ -11,10 +11,20 @@ class Token(deltas.Token):
         """
         The metadata for the revisions that the token has appeared within.
         """
+        self.live_copies = 0
+        self.live_since = None
 
     def persist(self, revision):
         self.revisions.append(revision)
 
+    def persist_span(self, ledger, start, end):
+        """
+        Persists the token through the revisions recorded in a
+        :class:`~mwpersistence.ledger.Ledger` between epochs `start` and
+        `end`.
+        """
+        self.revisions.extend(ledger.revisions[start:end])
+
     def __repr__(self):
         return "{0}({1})".format(
             self.__class__.__name__,
@@ -24,3 +34,78 @@ class Token(deltas.Token):
                 "revisions={0}".format(repr(self.revisions))
             ])
         )
+
+
+class AggregateToken(deltas.Token):
+    """
+    A token that keeps running counters rather than a list of the revisions
+    it has appeared within.  Revision metadata is expected to be a
+    ``(user, seconds_visible)`` pair.  The first revision a token persists
+    through is assumed to be the one that added it.
+    """
+    __slots__ = ('user', 'persisted', 'non_self_persisted', 'seconds_visible',
+                 'live_copies', 'live_since')
+
+    def __init__(self, content, type=None):
+        super().__init__(content, type=type)
+
+        self.user = None
+        """
+        The user who added the token.
+        """
+        self.persisted = -1
+        """
+        The number of revisions the token persisted through after it was
+        added.
+        """
+        self.non_self_persisted = 0
+        """
+        The number of revisions by other users that the token persisted
+        through.
+        """
+        self.seconds_visible = 0
+        """
+        The total number of seconds that the token was visible.
+        """
+        self.live_copies = 0
+        self.live_since = None
+
+    def persist(self, revision):
+        user, seconds_visible = revision
+        if self.persisted < 0:
+            self.user = user
+        elif user != self.user:
+            self.non_self_persisted += 1
+
+        self.persisted += 1
+        self.seconds_visible += seconds_visible
+
+    def persist_span(self, ledger, start, end):
+        """
+        Persists the token through the revisions recorded in a
+        :class:`~mwpersistence.ledger.Ledger` between epochs `start` and
+        `end`.
+        """
+        if start >= end:
+            return
+        elif self.persisted < 0:
+            self.user, _ = ledger.revisions[start]
+
+        revisions = end - start
+        self.persisted += revisions
+        self.non_self_persisted += \
+            revisions - ledger.user_revisions_between(self.user, start, end)
+        self.seconds_visible += ledger.seconds_between(start, end)
+
+    def __repr__(self):
+        return "{0}({1})".format(
+            self.__class__.__name__,
+            ", ".join([
+                repr(str(self)),
+                "type={0}".format(repr(self.type)),
+                "persisted={0}".format(repr(self.persisted)),
+                "non_self_persisted={0}".format(
+                    repr(self.non_self_persisted)),
+                "seconds_visible={0}".format(repr(self.seconds_visible))
+            ])
+        )
@@ -0,0 +1,104 @@
+"""
+Memoized classification of tokens for statistics.
+
+The `include` and `exclude` criteria of
+:func:`~mwpersistence.utilities.persistence2stats` are checked for every token
+document, but the number of distinct token texts is tiny compared with the
+number of token documents.  A :class:`~mwpersistence.token_filter.TokenFilter`
+caches the combined decision by text.
+
+.. autoclass:: mwpersistence.token_filter.TokenFilter
+    :members:
+"""
+import re
+
+
+class TokenFilter:
+    """
+    Constructs a memoized token classifier.  Calling a `TokenFilter` with a
+    token's text returns `True` if the token should be included in
+    statistical processing.
+
+    :Parameters:
+        include : `func` | `str` | `re.SRE_Pattern`
+            A function (or regular expression to match) that returns `True`
+            when a token should be included.  Defaults to including all
+            tokens.
+        exclude : `func` | `str` | `re.SRE_Pattern`
+            A function (or regular expression to match) that returns `True`
+            when a token should *not* be included.  Takes precedence over
+            `include`.
+        maxsize : `int`
+            The maximum number of decisions to cache.  Once the cache is full,
+            the decisions for new texts are computed every time.
+    """
+    __slots__ = ('include', 'exclude', 'maxsize', 'decisions', 'hits',
+                 'misses')
+
+    def __init__(self, include=None, exclude=None, maxsize=100000):
+        self.include = _compile(include)
+        self.exclude = _compile(exclude)
+        self.maxsize = int(maxsize)
+        self.decisions = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def filters(self):
+        """
+        `True` if any tokens could be excluded.
+        """
+        return self.include is not None or self.exclude is not None
+
+    @property
+    def hit_rate(self):
+        """
+        The proportion of classifications that were answered from the cache.
+        Only the classifications made in this process are counted -- copies
+        of the filter in worker processes keep counts of their own.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def __call__(self, text):
+        decision = self.decisions.get(text)
+        if decision is not None:
+            self.hits += 1
+            return decision
+
+        self.misses += 1
+        decision = _matches(self.include, text, True) and \
+            not _matches(self.exclude, text, False)
+        if len(self.decisions) < self.maxsize:
+            self.decisions[text] = decision
+        return decision
+
+    def __getstate__(self):
+        return self.include, self.exclude, self.maxsize
+
+    def __setstate__(self, state):
+        self.include, self.exclude, self.maxsize = state
+        self.decisions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "{0}(include={1}, exclude={2}, hit_rate={3:.3f})" \
+               .format(self.__class__.__name__, repr(self.include),
+                       repr(self.exclude), self.hit_rate)
+
+
+def _compile(criterion):
+    if isinstance(criterion, str):
+        return re.compile(criterion, re.UNICODE | re.I)
+    else:
+        return criterion
+
+
+def _matches(criterion, text, default):
+    if criterion is None:
+        return default
+    elif hasattr(criterion, 'match'):
+        return criterion.match(text) is not None
+    else:
+        return bool(criterion(text))
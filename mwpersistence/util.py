@@ -0,0 +1,32 @@
+import mwreverts
+
+
+def user_key(user):
+    """
+    Returns a hashable key for a user.  Users are often represented as
+    `dict`s (e.g. ``{"id": 10, "text": "EpochFail"}``) which are not hashable.
+    """
+    if isinstance(user, dict):
+        return tuple(sorted(user.items()))
+    else:
+        return user
+
+
+def detector_state(detector):
+    """
+    Returns a picklable representation of a :class:`mwreverts.Detector`.
+    Detectors are `jsonable`, so they can't pickle the revisions they hold
+    unless those are JSON serializable.
+    """
+    return detector.maxsize, list(detector.history)
+
+
+def restore_detector(maxsize, history):
+    """
+    Reconstructs a :class:`mwreverts.Detector` from the output of
+    :func:`~mwpersistence.util.detector_state`.
+    """
+    detector = mwreverts.Detector(maxsize - 1)
+    for checksum, revision in history:
+        detector.insert(checksum, revision)
+    return detector
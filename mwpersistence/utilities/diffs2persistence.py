@@ -6,11 +6,24 @@ r"""
     annotated with diff information (see `mwdiffs dump2diffs|revdocs2diffs`).
 
     This utility expects to be fed revision documents in as a page-partitioned
-    chronological sequence so that diffs can be computed upon in order.
+    chronological sequence so that diffs can be computed upon in order.  The
+    revisions of different pages can be mixed (e.g. a feed of recent changes)
+    with --interleaved as long as each page's revisions are in order.  The
+    states of the least recently edited pages are then evicted to temporary
+    files, and their revisions are held back and applied in batches.
 
     This utility uses a processing 'window' to limit memory usage.  New
     revisions enter the head of the window and old revisions fall off the tail.
-    Stats are generated at the tail of the window.
+    Stats are generated at the tail of the window.  A window can also be
+    bounded by the memory used by the tokens it tracks or by the time that it
+    spans, so that large articles get shorter windows.  The revisions in the
+    window of a very large page can be spilled to temporary files.
+
+    The tokens of each revision are kept in a rope that shares structure with
+    the previous revision, so a small edit to a large page costs O(edit)
+    rather than O(page).  The rope costs more than a list for every diff
+    operation though, so revisions with fragmented diffs (more than one
+    operation per 1024 tokens) are copied into a plain list instead.
 
     ::
                                window
@@ -26,8 +39,17 @@ r"""
         diffs2persistence (-h|--help)
         diffs2persistence [<input-file>...] --sunset=<date>
                           [--window=<revs>] [--revert-radius=<revs>]
-                          [--keep-diff] [--threads=<num>] [--output=<path>]
-                          [--compress=<type>] [--verbose] [--debug]
+                          [--window-memory=<MB>] [--window-span=<days>]
+                          [--spill-tokens=<num>] [--spill-dir=<path>]
+                          [--aggregate] [--columnar] [--shared-texts=<num>]
+                          [--page-states=<path>] [--blame]
+                          [--interleaved] [--pool-pages=<num>]
+                          [--pool-memory=<MB>] [--keep-diff] [--threads=<num>]
+                          [--page-workers=<num>] [--output=<path>]
+                          [--compress=<type>] [--output-format=<type>]
+                          [--checkpoint=<pages>] [--json-codec=<name>]
+                          [--metrics=<path>] [--prescan]
+                          [--verbose] [--debug]
 
     Options:
         -h|--help               Prints this documentation
@@ -41,42 +63,162 @@ r"""
         --window=<revs>         The size of the window of revisions from which
                                 persistence data will be generated.
                                 [default: 50]
+        --window-memory=<MB>    Also end a revision's window when the tokens
+                                that the window tracks are estimated to use
+                                more than this many megabytes.
+                                [default: <none>]
+        --window-span=<days>    Also end a revision's window once it spans
+                                this many days.  [default: <none>]
+        --spill-tokens=<num>    Write the revisions of a page to temporary
+                                files while they are in the window once the
+                                page has more than this many tokens.
+                                [default: <none>]
+        --spill-dir=<path>      The directory to write spilled revisions to.
+                                [default: <tmp>]
         --revert-radius=<revs>  The number of revisions back that a revert can
                                 reference. [default: 15]
+        --aggregate             Keep only running counters for each token
+                                rather than a record of every revision it
+                                persisted through.  Saves a lot of memory.
+        --columnar              Store token state in numpy arrays rather than
+                                in Token objects.  Requires numpy.
+        --shared-texts=<num>    The maximum number of distinct token texts to
+                                intern across pages.  Token texts are always
+                                interned within a page.  [default: 0]
+        --page-states=<path>    The path to a database of saved page states.
+                                Pages with a saved state only process the
+                                revisions that are newer than it, and the
+                                state of every page is saved.  Revisions
+                                that were still in a page's window when its
+                                state was saved are output again with
+                                updated statistics, so output appended to a
+                                previous run's repeats their ids.  Keep the
+                                last copy of each.  [default: <none>]
+        --interleaved           Expect the revisions of different pages to be
+                                interleaved rather than page-partitioned.
+                                Output is roughly in the order that each
+                                revision's window ends.
+        --pool-pages=<num>      With --interleaved, the maximum number of page
+                                states to keep in memory.  Up to 64 times as
+                                many revisions of evicted pages are held back
+                                in memory.  [default: 10000]
+        --pool-memory=<MB>      With --interleaved, also evict page states
+                                while the states in memory are estimated to
+                                use more than this many megabytes.
+                                [default: <none>]
+        --blame                 Add a 'blame' field to each revision that
+                                records the revision that added each of its
+                                tokens as [<tokens>, <rev_id>] runs.
         --keep-diff             Do not drop 'diff' field data from the json
                                 blobs.
         --threads=<num>         If a collection of files are provided, how many
                                 processor threads should be prepare?
                                 [default: <cpu_count>]
+        --page-workers=<num>    How many processes should the pages of each
+                                input be split between?  Output order is
+                                preserved. [default: 1]
         --output=<path>         Write output to a directory with one output
                                 file per input path.  [default: <stdout>]
         --compress=<type>       If set, output written to the output-dir will
                                 be compressed in this format. [default: bz2]
+        --output-format=<type>  "json" or "columnar".  Columnar output writes a
+                                directory of token columns per input path
+                                (see mwpersistence.columnar_format) and
+                                requires --output and numpy.  [default: json]
+        --checkpoint=<pages>    Record a checkpoint next to each output file
+                                after every <pages> pages.  Re-running an
+                                interrupted command resumes from the
+                                checkpoints.  Requires --output.  Ignored
+                                with --interleaved. [default: <none>]
+        --json-codec=<name>     The JSON library to read and write documents
+                                with: json, orjson or ujson.  Falls back to
+                                json if the library is not installed.
+                                [default: json]
+        --metrics=<path>        Periodically write timings and counters for
+                                each processing stage to a JSON file (see
+                                mwpersistence.metrics).  [default: <none>]
+        --prescan               Read the input files once before processing
+                                to estimate how long each will take.  The
+                                longest are started first.
         --verbose               Print dots and stuff to stderr
         --debug                 Print debug logging to stderr.
 """
 import logging
+import pickle
 import sys
 import time
-from collections import deque
+from collections import OrderedDict, deque
+from copy import copy
 from itertools import groupby
 
-import mwcli
 import mwxml.utilities
 from more_itertools import peekable
 from mwtypes import Timestamp
 
+from ..columnar import ColumnarDiffState, TokenColumns
+from ..interning import Interner
+from ..metrics import NO_METRICS
+from ..parallel import map_pages
+from ..pool import StatePool
+from ..sequence import TokenSequence
+from ..spill import SpillFile
 from ..state import DiffState
+from ..store import StateStore
+from ..streamer import Streamer
+from ..token import AggregateToken, Token
+from ..window import (AGGREGATE_TOKEN_BYTES, COLUMNAR_TOKEN_BYTES,
+                      TOKEN_BYTES, Window)
 
 logger = logging.getLogger(__name__)
 
+DEFERRED_REVISIONS = 64
+"""
+With `interleaved`, the number of revisions of an evicted page that are held
+back so that its state is restored once for all of them
+"""
+
 
 def process_args(args):
+    kwargs = persistence_args(args)
+    kwargs['interleaved'] = bool(args['--interleaved'])
+    kwargs['pool_pages'] = int(args['--pool-pages'])
+    if args['--pool-memory'] != "<none>":
+        kwargs['pool_bytes'] = int(float(args['--pool-memory']) * 2 ** 20)
+    else:
+        kwargs['pool_bytes'] = None
+    return kwargs
+
+
+def persistence_args(args):
+    """
+    Reads the options that revdocs2stats and dump2stats share with
+    diffs2persistence.
+    """
     return {'window_size': int(args['--window']),
             'revert_radius': int(args['--revert-radius']),
+            'window_bytes': int(float(args['--window-memory']) * 2 ** 20)
+                            if args['--window-memory'] != "<none>"
+                            else None,
+            'window_seconds': float(args['--window-span']) * 24 * 60 * 60
+                              if args['--window-span'] != "<none>"
+                              else None,
+            'spill_tokens': int(args['--spill-tokens'])
+                            if args['--spill-tokens'] != "<none>"
+                            else None,
+            'spill_dir': args['--spill-dir']
+                         if args['--spill-dir'] != "<tmp>"
+                         else None,
             'sunset': Timestamp(args['--sunset'])
                       if args['--sunset'] != "<now>"
                       else Timestamp(time.time()),
+            'aggregate': bool(args['--aggregate']),
+            'columnar': bool(args['--columnar']),
+            'shared_texts': int(args['--shared-texts']),
+            'page_workers': int(args['--page-workers']),
+            'state_store': StateStore(args['--page-states'])
+                           if args['--page-states'] != "<none>"
+                           else None,
+            'blame': bool(args['--blame']),
             'keep_diff': bool(args['--keep-diff'])}
 
 
@@ -98,7 +240,12 @@ def drop_diff(rev_docs):
 
 
 def diffs2persistence(rev_docs, window_size=50, revert_radius=15, sunset=None,
-                      verbose=False):
+                      window_bytes=None, window_seconds=None,
+                      spill_tokens=None, spill_dir=None, aggregate=False,
+                      columnar=False, shared_texts=0, page_workers=1,
+                      state_store=None, interleaved=False, pool_pages=10000,
+                      pool_bytes=None, blame=False, token_stats=None,
+                      metrics=None, verbose=False):
     """
     Processes a sorted and page-partitioned sequence of revision documents into
     and adds a 'persistence' field to them containing statistics about how each
@@ -118,6 +265,85 @@ def diffs2persistence(rev_docs, window_size=50, revert_radius=15, sunset=None,
             The date of the database dump we are generating from.  This is
             used to apply a 'time visible' statistic.  If not set, now() will
             be assumed.
+        window_bytes : `int`
+            If set, a revision's window also ends when the tokens tracked by
+            the window are estimated to use more than this many bytes (see
+            :class:`~mwpersistence.window.Window`).
+        window_seconds : `int`
+            If set, a revision's window also ends once it spans this many
+            seconds.  When either `window_bytes` or `window_seconds` is set,
+            the 'persistence' field has a 'window_bound' field that records
+            which bound ended the revision's window: "revisions", "bytes",
+            "seconds" or "end" (the end of the page's history).
+        spill_tokens : `int`
+            If set, the revision documents in the window are written to
+            temporary files (see :mod:`mwpersistence.spill`) while the page
+            has more than this many tokens.  This bounds the memory used by
+            very large pages.
+        spill_dir : `str`
+            The directory to write spilled revision documents to.  Defaults
+            to the system's temporary directory.
+        aggregate : `bool`
+            Keep only running counters for each token (see
+            :class:`~mwpersistence.AggregateToken`) rather than a record of
+            every revision it persisted through.  The output is identical.
+        columnar : `bool`
+            Store token state in `numpy` arrays (see
+            :class:`~mwpersistence.columnar.ColumnarDiffState`).  The output
+            is identical.
+        shared_texts : `int`
+            The maximum number of distinct token texts to intern across pages
+            (see :class:`~mwpersistence.interning.Interner`).  Token texts
+            are always interned within a page.
+        page_workers : `int`
+            The number of processes to split pages between (see
+            :func:`~mwpersistence.parallel.map_pages`).  Output order is
+            preserved.
+        state_store : :class:`~mwpersistence.store.StateStore`
+            If set, pages with a saved state are resumed from it (skipping
+            the revisions it already includes) and the state of every page is
+            saved at the end of its history.  The window size and token
+            storage of a resumed page are those it was saved with.  The
+            revisions that were still in a page's window when it was saved
+            are generated again, with statistics that include the newer
+            revisions.
+        interleaved : `bool`
+            Accept `rev_docs` in which the revisions of different pages are
+            interleaved.  Each page's revisions must still be in
+            chronological order.  The state of each page is held in a
+            :class:`~mwpersistence.pool.StatePool` and revisions are
+            generated in the order that their windows end, except that the
+            revisions of evicted pages are held back and applied in batches
+            of up to
+            :data:`~mwpersistence.utilities.diffs2persistence.DEFERRED_REVISIONS`.
+            Can't be used with `page_workers`, `state_store` or
+            `spill_tokens`.
+        pool_pages : `int`
+            With `interleaved`, the maximum number of page states to keep
+            in memory before the least recently used are evicted to
+            temporary files.  At most `pool_pages` x
+            :data:`~mwpersistence.utilities.diffs2persistence.DEFERRED_REVISIONS`
+            revisions are held back.
+        pool_bytes : `int`
+            With `interleaved`, also evict page states while the states in
+            memory are estimated to use more than this many bytes
+        blame : `bool`
+            Add a 'blame' field to each revision document that records the
+            revision that added each of the revision's tokens as a list of
+            ``[tokens, rev_id]`` runs (see
+            :func:`~mwpersistence.authorship.Authorship.to_json`).  Can't be
+            used with `columnar`.
+        token_stats : `func`
+            If set, the 'persistence' field has no 'tokens'.  Instead,
+            ``token_stats(persistence_doc, token_values)`` is called with
+            a ``(text, persisted, non_self_persisted, seconds_visible)``
+            tuple for each token so that statistics can be computed
+            straight from the token state (see
+            :func:`~mwpersistence.utilities.persistence2stats.add_stats`).
+        metrics : :class:`~mwpersistence.metrics.Metrics`
+            If set, records the time spent in the ``persistence``, ``state``
+            and ``window`` stages and counts tokens, opdocs, reverts, window
+            flushes and (with `interleaved`) evictions.
         keep_diff : `bool`
             Do not drop the `diff` field from the revision document after
             processing is complete.
@@ -128,11 +354,75 @@ def diffs2persistence(rev_docs, window_size=50, revert_radius=15, sunset=None,
         A generator of rev_docs with a 'persistence' field containing
         statistics about individual tokens.
     """
-    rev_docs = mwxml.utilities.normalize(rev_docs)
     window_size = int(window_size)
     revert_radius = int(revert_radius)
-    sunset = Timestamp(sunset) if sunset is not None \
-                               else Timestamp(time.time())
+    sunset = int(Timestamp(sunset)) if sunset is not None \
+                                    else int(time.time())
+    page_workers = int(page_workers)
+    metrics = metrics or NO_METRICS
+
+    if blame and columnar:
+        raise ValueError("blame can't be used with columnar token state.")
+
+    if interleaved:
+        if page_workers > 1:
+            raise ValueError("page_workers can't be used with interleaved "
+                             "revisions.")
+        if state_store is not None:
+            raise ValueError("state_store can't be used with interleaved "
+                             "revisions.")
+        if spill_tokens is not None:
+            logger.warning("Spilling is not supported with interleaved "
+                           "revisions.  Ignoring spill_tokens.")
+        yield from metrics.timed('persistence', process_interleaved(
+            rev_docs, window_size, revert_radius, sunset, window_bytes,
+            window_seconds, aggregate, columnar, shared_texts, pool_pages,
+            pool_bytes, blame, token_stats, metrics, verbose))
+        return
+
+    if page_workers > 1:
+        yield from metrics.timed('workers', map_pages(
+            diffs2persistence, rev_docs, page_workers,
+            window_size=window_size, revert_radius=revert_radius,
+            sunset=sunset, window_bytes=window_bytes,
+            window_seconds=window_seconds, spill_tokens=spill_tokens,
+            spill_dir=spill_dir, aggregate=aggregate, columnar=columnar,
+            shared_texts=shared_texts, state_store=state_store,
+            blame=blame, token_stats=token_stats, verbose=verbose))
+        return
+
+    yield from metrics.timed('persistence', process_pages(
+        rev_docs, window_size, revert_radius, sunset, window_bytes,
+        window_seconds, spill_tokens, spill_dir, aggregate, columnar,
+        shared_texts, state_store, blame, token_stats, metrics, verbose))
+
+
+def process_pages(rev_docs, window_size, revert_radius, sunset, window_bytes,
+                  window_seconds, spill_tokens, spill_dir, aggregate,
+                  columnar, shared_texts, state_store, blame, token_stats,
+                  metrics, verbose):
+    """
+    Processes the pages of `rev_docs` in this process.  See
+    :func:`~mwpersistence.utilities.diffs2persistence`.
+    """
+    spill = SpillFile(spill_dir) if spill_tokens is not None else None
+    try:
+        yield from _process_pages(
+            rev_docs, window_size, revert_radius, sunset, window_bytes,
+            window_seconds, spill_tokens, spill, aggregate, columnar,
+            shared_texts, state_store, blame, token_stats, metrics, verbose)
+    finally:
+        if spill is not None:
+            spill.close()
+
+
+def _process_pages(rev_docs, window_size, revert_radius, sunset, window_bytes,
+                   window_seconds, spill_tokens, spill, aggregate, columnar,
+                   shared_texts, state_store, blame, token_stats, metrics,
+                   verbose):
+    rev_docs = mwxml.utilities.normalize(rev_docs)
+    shared_texts = int(shared_texts)
+    shared_interner = Interner(shared_texts) if shared_texts > 0 else None
 
     # Group the docs by page
     page_docs = groupby(rev_docs, key=lambda d: d['page']['title'])
@@ -142,89 +432,451 @@ def diffs2persistence(rev_docs, window_size=50, revert_radius=15, sunset=None,
         if verbose:
             sys.stderr.write(page_title + ": ")
 
-        # We need a look-ahead to know how long this revision was visible
-        rev_docs = peekable(rev_docs)
+        # We need a look-ahead to know how long this revision was visible.
+        # Timestamps are parsed once and carried along as unix seconds.
+        rev_docs = peekable((rev_doc, int(Timestamp(rev_doc['timestamp'])))
+                            for rev_doc in rev_docs)
+
+        saved = None
+        if state_store is not None:
+            page_id = rev_docs.peek()[0]['page']['id']
+            saved = load_page_state(state_store, page_id, rev_docs)
+
+        if saved is not None:
+            state, window, interner, pending = saved
+            interner.shared = shared_interner
+            window.spill = spill
+            # The last revision is processed again now that we know how long
+            # it was visible.
+            rev_docs.prepend(pending)
+        else:
+            state, window, interner = new_page_state(
+                window_size, revert_radius, window_bytes, window_seconds,
+                spill, aggregate, columnar, shared_interner, blame)
+        reverts = state.reverts
+
+        if isinstance(state, DiffState) and state_store is None and \
+           not window.adaptive and not state.track_authorship:
+            # No window ends before the window is full, so the revisions
+            # that fill it can be applied in one batch.
+            batch = []
+            while rev_docs and len(batch) < window_size:
+                rev_doc, timestamp = next(rev_docs)
+                next_doc, next_timestamp = rev_docs.peek((None, None))
+                batch.append((rev_doc, timestamp, visible_seconds(
+                    timestamp, next_timestamp, sunset)))
+
+            with metrics.timer('state', items=len(batch)):
+                updates = state.update_opdocs_many(
+                    ((rev_doc['sha1'], rev_doc['diff']['ops'],
+                      (rev_doc['user'], seconds_visible))
+                     for rev_doc, _, seconds_visible in batch),
+                    outputs=("current_tokens", "tokens_added")
+                    if spill is not None else ("tokens_added",))
+
+            for i, (rev_doc, timestamp, _) in enumerate(batch):
+                tokens_added = updates.tokens_added[i]
+                metrics.count('opdocs', len(rev_doc['diff']['ops']))
+                metrics.count('tokens', len(tokens_added))
+                spilled = spill is not None and \
+                    len(updates.current_tokens[i]) > spill_tokens
+                window.push((rev_doc, timestamp, tokens_added),
+                            spill=spilled)
+                if spilled:
+                    metrics.count('spilled')
 
-        # The window allows us to manage memory
-        window = deque(maxlen=window_size)
+        while rev_docs:
+            rev_doc, timestamp = next(rev_docs)
+            next_doc, next_timestamp = rev_docs.peek((None, None))
 
-        # The state does the actual processing work
-        state = DiffState(revert_radius=revert_radius)
+            if next_doc is None and state_store is not None:
+                # Save the state before the last revision is applied
+                state_store.save(rev_doc['page']['id'], rev_doc['id'],
+                                 timestamp, (state, window, interner,
+                                             (rev_doc, timestamp)))
 
-        while rev_docs:
-            rev_doc = next(rev_docs)
-            next_doc = rev_docs.peek(None)
-
-            if next_doc is not None:
-                seconds_visible = Timestamp(next_doc['timestamp']) - \
-                                  Timestamp(rev_doc['timestamp'])
-            else:
-                seconds_visible = sunset - Timestamp(rev_doc['timestamp'])
-
-            if seconds_visible < 0:
-                logger.warn("Seconds visible {0} is less than zero."
-                            .format(seconds_visible))
-                seconds_visible = 0
-
-            _, tokens_added, _ = \
-                state.update_opdocs(rev_doc['sha1'], rev_doc['diff']['ops'],
-                                    (rev_doc['user'], seconds_visible))
-
-            if len(window) == window_size:
-                # Time to start writing some stats
-                old_doc, old_added = window[0]
-                window.append((rev_doc, tokens_added))
-                persistence = token_persistence(old_doc, old_added, window,
-                                                None)
-                old_doc['persistence'] = persistence
-                yield old_doc
-                if verbose:
-                    sys.stderr.write(".")
-                    sys.stderr.flush()
-            else:
-                window.append((rev_doc, tokens_added))
-
-        while len(window) > 0:
-            old_doc, old_added = window.popleft()
-            persistence = token_persistence(old_doc, old_added, window, sunset)
-            old_doc['persistence'] = persistence
-            yield old_doc
-            if verbose:
-                sys.stderr.write("_")
-                sys.stderr.flush()
+            seconds_visible = visible_seconds(timestamp, next_timestamp,
+                                              sunset)
+            yield from apply_revision(
+                state, window, interner, rev_doc, timestamp, seconds_visible,
+                spill_tokens, token_stats, metrics, verbose)
+
+        metrics.count('reverts', state.reverts - reverts)
+
+        yield from flush_window(state, window, interner, sunset, token_stats,
+                                metrics, verbose)
 
         if verbose:
             sys.stderr.write("\n")
 
 
-def token_persistence(rev_doc, tokens_added, window, sunset):
+def process_interleaved(rev_docs, window_size, revert_radius, sunset,
+                        window_bytes, window_seconds, aggregate, columnar,
+                        shared_texts, pool_pages, pool_bytes, blame,
+                        token_stats, metrics, verbose):
+    """
+    Processes a sequence of revision documents in which the revisions of
+    different pages are interleaved.  See
+    :func:`~mwpersistence.utilities.diffs2persistence`.
+    """
+    rev_docs = mwxml.utilities.normalize(rev_docs)
+    shared_texts = int(shared_texts)
+    shared_interner = Interner(shared_texts) if shared_texts > 0 else None
+
+    # Holds (state, window, interner, pending) for each page.  The pending
+    # revision is applied once we know how long it was visible.
+    pool = StatePool(pool_pages, max_bytes=pool_bytes,
+                     sizeof=page_state_size, dump=dump_page, load=load_page)
+
+    # Revisions of evicted pages are held back so that an evicted state is
+    # restored once for a batch of revisions rather than once for each.
+    # Pages are restored when their batch is full or, oldest batch first,
+    # when too many revisions are held back.
+    deferred = OrderedDict()
+    max_deferred = max(int(pool_pages), 1) * DEFERRED_REVISIONS
+    n_deferred = 0
+
+    def advance(page_id, revisions):
+        page = pool.get(page_id)
+        if page is None:
+            state, window, interner = new_page_state(
+                window_size, revert_radius, window_bytes, window_seconds,
+                None, aggregate, columnar, shared_interner, blame)
+            pending = None
+        else:
+            state, window, interner, pending = page
+            interner.shared = shared_interner
+
+        for rev_doc, timestamp in revisions:
+            if pending is not None:
+                pending_doc, pending_timestamp = pending
+                yield from apply_pending(
+                    state, window, interner, pending_doc, pending_timestamp,
+                    visible_seconds(pending_timestamp, timestamp, sunset),
+                    token_stats, metrics, verbose)
+            pending = (rev_doc, timestamp)
+
+        pool.put(page_id, (state, window, interner, pending))
+
+    try:
+        for rev_doc in rev_docs:
+            page_id = rev_doc['page']['id']
+            timestamp = int(Timestamp(rev_doc['timestamp']))
+
+            if page_id not in pool.evicted:
+                yield from advance(page_id, [(rev_doc, timestamp)])
+                continue
+
+            revisions = deferred.setdefault(page_id, [])
+            revisions.append((rev_doc, timestamp))
+            n_deferred += 1
+            if len(revisions) >= DEFERRED_REVISIONS:
+                del deferred[page_id]
+                n_deferred -= len(revisions)
+                yield from advance(page_id, revisions)
+            while n_deferred > max_deferred:
+                oldest_id, revisions = deferred.popitem(last=False)
+                n_deferred -= len(revisions)
+                yield from advance(oldest_id, revisions)
+
+        while len(deferred) > 0:
+            oldest_id, revisions = deferred.popitem(last=False)
+            yield from advance(oldest_id, revisions)
+
+        for page_id, page in pool.drain():
+            state, window, interner, (pending_doc, pending_timestamp) = page
+            interner.shared = shared_interner
+            yield from apply_pending(
+                state, window, interner, pending_doc, pending_timestamp,
+                visible_seconds(pending_timestamp, None, sunset),
+                token_stats, metrics, verbose)
+            yield from flush_window(state, window, interner, sunset,
+                                    token_stats, metrics, verbose)
+    finally:
+        pool.close()
+
+    metrics.count('evictions', pool.evictions)
+
+    if verbose:
+        sys.stderr.write("\n")
+
+
+def apply_pending(state, window, interner, rev_doc, timestamp,
+                  seconds_visible, token_stats, metrics, verbose):
+    reverts = state.reverts
+    yield from apply_revision(state, window, interner, rev_doc, timestamp,
+                              seconds_visible, None, token_stats, metrics,
+                              verbose)
+    metrics.count('reverts', state.reverts - reverts)
+
+
+def dump_page(page, fp):
+    """
+    Writes a page's ``(state, window, interner, pending)`` to a binary file.
+    A :class:`~mwpersistence.DiffState` is written as a snapshot (see
+    :func:`~mwpersistence.DiffState.dump`) along with the tokens added by the
+    revisions in the window, so that they still share tokens with the state
+    when they are loaded.  Other states are pickled with the rest of the page.
+    """
+    state, window, interner, pending = page
+    if isinstance(state, DiffState):
+        tokens_added = [entry[2] for entry, _, _ in window.entries]
+        stored_window = copy(window)
+        stored_window.entries = deque(
+            ((rev_doc, timestamp, None), key, size)
+            for (rev_doc, timestamp, _), key, size in window.entries)
+        pickle.dump((None, stored_window, interner, pending), fp,
+                    pickle.HIGHEST_PROTOCOL)
+        state.dump(fp, sequences=tokens_added)
+    else:
+        pickle.dump(page, fp, pickle.HIGHEST_PROTOCOL)
+
+
+def load_page(fp):
+    """
+    Reads a page written by :func:`~mwpersistence.utilities.diffs2persistence.dump_page`.
+    """  # noqa
+    state, window, interner, pending = pickle.load(fp)
+    if state is None:
+        state, tokens_added = DiffState.load(fp, interner=interner,
+                                             sequences=True)
+        window.entries = deque(
+            ((rev_doc, timestamp, added), key, size)
+            for ((rev_doc, timestamp, _), key, size), added in
+            zip(window.entries, tokens_added))
+    return state, window, interner, pending
+
+
+def page_state_size(page):
+    """
+    Estimates the size in bytes of a page's ``(state, window, interner,
+    pending)`` from the tokens that it tracks.
+    """
+    state, window, _, _ = page
+    current = getattr(state.last, 'rows', None)
+    if current is None:
+        current = state.last.tokens
+    current_tokens = len(current) if current is not None else 0
+    return (window.tokens + current_tokens) * window.token_bytes
+
+
+def new_page_state(window_size, revert_radius, window_bytes, window_seconds,
+                   spill, aggregate, columnar, shared_interner, blame=False):
+    """
+    Constructs the ``(state, window, interner)`` for processing a new page.
+    """
+    if columnar:
+        token_bytes = COLUMNAR_TOKEN_BYTES
+    elif aggregate:
+        token_bytes = AGGREGATE_TOKEN_BYTES
+    else:
+        token_bytes = TOKEN_BYTES
+
+    # The window allows us to manage memory
+    window = Window(window_size, max_bytes=window_bytes,
+                    max_seconds=window_seconds, token_bytes=token_bytes,
+                    spill=spill)
+
+    # Repeated token texts share a single string
+    interner = Interner(shared=shared_interner)
+
+    # The state does the actual processing work
+    if columnar:
+        state = ColumnarDiffState(revert_radius=revert_radius,
+                                  interner=interner)
+    else:
+        state = DiffState(revert_radius=revert_radius,
+                          token_class=AggregateToken if aggregate else Token,
+                          sequence_class=TokenSequence, lazy=True,
+                          interner=interner, authorship=blame)
+
+    return state, window, interner
+
+
+def apply_revision(state, window, interner, rev_doc, timestamp,
+                   seconds_visible, spill_tokens, token_stats, metrics,
+                   verbose):
+    """
+    Applies a revision to the state of a page, adds it to the page's window
+    and generates the revisions whose windows end.
+    """
+    blame = getattr(state, 'track_authorship', False)
+    with metrics.timer('state'):
+        if blame:
+            # Tokens are blamed on revision ids rather than on the metadata
+            # that persistence is recorded with
+            current, tokens_added, _ = state.update_opdocs(
+                rev_doc['sha1'], rev_doc['diff']['ops'],
+                (rev_doc['user'], seconds_visible), origin=rev_doc['id'])
+        else:
+            current, tokens_added, _ = state.update_opdocs(
+                rev_doc['sha1'], rev_doc['diff']['ops'],
+                (rev_doc['user'], seconds_visible))
+    if blame:
+        rev_doc['blame'] = state.authorship.to_json()
+    metrics.count('opdocs', len(rev_doc['diff']['ops']))
+    metrics.count('tokens', len(tokens_added))
+
+    spilled = window.spill is not None and len(current) > spill_tokens
+    window.push((rev_doc, timestamp, tokens_added), spill=spilled)
+    if spilled:
+        metrics.count('spilled')
+
+    bound = window.ending()
+    while bound is not None:
+        # Time to start writing some stats
+        old_doc, old_timestamp, old_added = window.popleft()
+        with metrics.timer('window'):
+            state.settle(old_added)
+            persistence = token_persistence(
+                old_doc, old_timestamp, old_added, window, None,
+                interner=interner, token_stats=token_stats,
+                bound=bound if window.adaptive else None)
+        old_doc['persistence'] = persistence
+        yield old_doc
+        if verbose:
+            sys.stderr.write(".")
+            sys.stderr.flush()
+        bound = window.ending()
+
+
+def flush_window(state, window, interner, sunset, token_stats, metrics,
+                 verbose):
+    """
+    Generates the revisions that are left in a page's window once the page's
+    history has ended.
+    """
+    while len(window) > 0:
+        old_doc, old_timestamp, old_added = window.popleft()
+        with metrics.timer('window'):
+            state.settle(old_added)
+            persistence = token_persistence(
+                old_doc, old_timestamp, old_added, window, sunset,
+                interner=interner, token_stats=token_stats,
+                bound="end" if window.adaptive else None)
+        metrics.count('window_flushes')
+        old_doc['persistence'] = persistence
+        yield old_doc
+        if verbose:
+            sys.stderr.write("_")
+            sys.stderr.flush()
+
+
+def visible_seconds(timestamp, next_timestamp, sunset):
+    """
+    Returns the number of seconds that a revision was visible until the next
+    revision (or the sunset, if `next_timestamp` is `None`).
+    """
+    if next_timestamp is not None:
+        seconds_visible = next_timestamp - timestamp
+    else:
+        seconds_visible = sunset - timestamp
+
+    if seconds_visible < 0:
+        logger.warn("Seconds visible {0} is less than zero."
+                    .format(seconds_visible))
+        seconds_visible = 0
+
+    return seconds_visible
+
+
+def load_page_state(state_store, page_id, rev_docs):
+    """
+    Loads the saved state of a page and drops the revisions from `rev_docs`
+    (a :class:`more_itertools.peekable` of ``(rev_doc, timestamp)`` pairs)
+    that it already includes.  Returns `None` if no usable state was saved.
+    """
+    saved = state_store.load(page_id)
+    if saved is None:
+        return None
+
+    _, _, _, (last_doc, last_timestamp) = saved
+    last = (last_timestamp, last_doc['id'])
+    while rev_docs and (rev_docs.peek()[1], rev_docs.peek()[0]['id']) <= last:
+        next(rev_docs)
+
+    if rev_docs:
+        next_doc, _ = rev_docs.peek()
+        last_id = next_doc.get('diff', {}).get('last_id', last_doc['id'])
+        if last_id != last_doc['id']:
+            logger.warning("Revision {0} of page {1} was not diffed against "
+                           "the saved revision {2}.  Ignoring saved state."
+                           .format(next_doc['id'], page_id, last_doc['id']))
+            return None
+
+    return saved
+
+
+def token_persistence(rev_doc, timestamp, tokens_added, window, sunset,
+                      interner=None, token_stats=None, bound=None):
 
     if sunset is None:
         # Use the last revision in the window
-        sunset = Timestamp(window[-1][0]['timestamp'])
+        _, sunset, _ = window[-1]
 
-    seconds_possible = max(sunset - Timestamp(rev_doc['timestamp']), 0)
+    seconds_possible = max(sunset - timestamp, 0)
 
-    return {
+    persistence_doc = {
         'revisions_processed': len(window),
-        'non_self_processed': sum(rd['user'] != rev_doc['user']
-                                  for rd, _ in window),
-        'seconds_possible': seconds_possible,
-        'tokens': [td for td in generate_token_docs(rev_doc, tokens_added)]
+        'non_self_processed': window.non_self(rev_doc['user']),
+        'seconds_possible': seconds_possible
     }
+    if bound is not None:
+        persistence_doc['window_bound'] = bound
+    if token_stats is None:
+        persistence_doc['tokens'] = \
+            [td for td in generate_token_docs(rev_doc, tokens_added,
+                                              interner=interner)]
+    else:
+        token_stats(persistence_doc,
+                    generate_token_values(rev_doc, tokens_added,
+                                          interner=interner))
+
+    return persistence_doc
+
+
+def generate_token_docs(rev_doc, tokens_added, interner=None):
+    if isinstance(tokens_added, TokenColumns):
+        yield from tokens_added.token_docs()
+        return
+
+    text = interner.intern if interner is not None else str
+    for token in tokens_added:
+        if isinstance(token, AggregateToken):
+            yield {
+                "text": text(token),
+                "persisted": token.persisted,
+                "non_self_persisted": token.non_self_persisted,
+                "seconds_visible": token.seconds_visible
+            }
+        else:
+            yield {
+                "text": text(token),
+                "persisted": len(token.revisions) - 1,
+                "non_self_persisted": sum(u != rev_doc['user']
+                                          for u, _ in token.revisions),
+                "seconds_visible": sum(sv for _, sv in token.revisions)
+            }
+
+
+def generate_token_values(rev_doc, tokens_added, interner=None):
+    if isinstance(tokens_added, TokenColumns):
+        yield from tokens_added.token_values()
+        return
+
+    text = interner.intern if interner is not None else str
+    user = rev_doc['user']
+    for token in tokens_added:
+        if isinstance(token, AggregateToken):
+            yield (text(token), token.persisted, token.non_self_persisted,
+                   token.seconds_visible)
+        else:
+            yield (text(token), len(token.revisions) - 1,
+                   sum(u != user for u, _ in token.revisions),
+                   sum(sv for _, sv in token.revisions))
 
 
-def generate_token_docs(rev_doc, tokens_added):
-    for token in tokens_added:
-        yield {
-            "text": str(token),
-            "persisted": len(token.revisions) - 1,
-            "non_self_persisted": sum(u != rev_doc['user']
-                                      for u, _ in token.revisions),
-            "seconds_visible": sum(sv for _, sv in token.revisions)
-        }
-
-streamer = mwcli.Streamer(
+streamer = Streamer(
     __doc__,
     __name__,
     _diffs2persistence,
@@ -9,11 +9,17 @@ r"""
         dump2stats [<input-file>...] --config=<path> --sunset=<date>
                    [--namespaces=<ids>] [--timeout=<secs>]
                    [--window=<revs>] [--revert-radius=<revs>]
+                   [--window-memory=<MB>] [--window-span=<days>]
+                   [--spill-tokens=<num>] [--spill-dir=<path>]
+                   [--aggregate] [--columnar] [--shared-texts=<num>]
+                   [--page-states=<path>] [--blame]
                    [--min-persisted=<num>] [--min-visible=<days>]
-                   [--include=<regex>] [--exclude=<regex>]
+                   [--include=<regex>] [--exclude=<regex>] [--batch=<revs>]
                    [--keep-text] [--keep-diff] [--keep-tokens]
-                   [--threads=<num>] [--output=<path>] [--compress=<type>]
-                   [--verbose] [--debug]
+                   [--threads=<num>] [--page-workers=<num>] [--pipeline]
+                   [--output=<path>] [--compress=<type>] [--checkpoint=<pages>]
+                   [--json-codec=<name>] [--metrics=<path>] [--prescan]
+                   [--split=<MB>] [--verbose] [--debug]
 
     Options:
         -h|--help               Print this documentation
@@ -32,8 +38,40 @@ r"""
         --window=<revs>         The size of the window of revisions from which
                                 persistence data will be generated.
                                 [default: 50]
+        --window-memory=<MB>    Also end a revision's window when the tokens
+                                that the window tracks are estimated to use
+                                more than this many megabytes.
+                                [default: <none>]
+        --window-span=<days>    Also end a revision's window once it spans
+                                this many days.  [default: <none>]
+        --spill-tokens=<num>    Write the revisions of a page to temporary
+                                files while they are in the window once the
+                                page has more than this many tokens.
+                                [default: <none>]
+        --spill-dir=<path>      The directory to write spilled revisions to.
+                                [default: <tmp>]
         --revert-radius=<revs>  The number of revisions back that a revert can
                                 reference. [default: 15]
+        --aggregate             Keep only running counters for each token
+                                rather than a record of every revision it
+                                persisted through.  Saves a lot of memory.
+        --columnar              Store token state in numpy arrays rather than
+                                in Token objects.  Requires numpy.
+        --shared-texts=<num>    The maximum number of distinct token texts to
+                                intern across pages.  Token texts are always
+                                interned within a page.  [default: 0]
+        --page-states=<path>    The path to a database of saved page states.
+                                Pages with a saved state only process the
+                                revisions that are newer than it, and the
+                                state of every page is saved.  Revisions
+                                that were still in a page's window when its
+                                state was saved are output again with
+                                updated statistics, so output appended to a
+                                previous run's repeats their ids.  Keep the
+                                last copy of each.  [default: <none>]
+        --blame                 Add a 'blame' field to each revision that
+                                records the revision that added each of its
+                                tokens as [<tokens>, <rev_id>] runs.
         --min-persisted=<num>   The minimum number of revisions a token must
                                 survive before being considered "persisted"
                                 [default: 5]
@@ -44,46 +82,83 @@ r"""
                                 [default: <all>]
         --exclude=<regex>       A regex matching tokens to exclude
                                 [default: <none>]
+        --batch=<revs>          Compute statistics for this many revisions at a
+                                time with numpy (only if tokens are kept).
+                                The output is identical.  Requires numpy.
+                                [default: 0]
         --keep-text             If set, the 'text' field will be populated in
                                 the output JSON.
         --keep-diff             If set, the 'diff' field will be populated in
                                 the output JSON.
         --keep-tokens           If set, the 'tokens' field will be populated in
-                                the output JSON.
+                                the output JSON.  Otherwise, statistics are
+                                computed straight from the token state
+                                without generating token documents.
         --threads=<num>         If a collection of files are provided, how many
                                 processor threads should be prepare?
                                 [default: <cpu_count>]
+        --page-workers=<num>    How many processes should the pages of each
+                                input be split between?  Output order is
+                                preserved.  The token filter's hit rate is
+                                not logged with page workers. [default: 1]
+        --pipeline              Run reading, diffing and persistence in
+                                separate processes that are connected by
+                                bounded queues so that they overlap.  Ignored
+                                if there are page workers.
         --output=<path>         Write output to a directory with one output
                                 file per input path.  [default: <stdout>]
         --compress=<type>       If set, output written to the output-dir will
                                 be compressed in this format. [default: bz2]
+        --checkpoint=<pages>    Record a checkpoint next to each output file
+                                after every <pages> pages.  Re-running an
+                                interrupted command resumes from the
+                                checkpoints.  Requires --output.
+                                [default: <none>]
+        --json-codec=<name>     The JSON library to read and write documents
+                                with: json, orjson or ujson.  Falls back to
+                                json if the library is not installed.
+                                [default: json]
+        --metrics=<path>        Periodically write timings and counters for
+                                each processing stage to a JSON file (see
+                                mwpersistence.metrics).  [default: <none>]
+        --prescan               Read the input files once before processing
+                                to estimate how long each will take.  The
+                                longest are started first.
+        --split=<MB>            Split multistream bz2 dumps into parts of
+                                about this many megabytes that are processed
+                                separately (see mwpersistence.schedule).  Each
+                                part gets its own output file.
+                                [default: <none>]
         --verbose               Print progress information to stderr.
         --debug                 Print debug logging to stderr.
 """
 import logging
 
-import mwcli
 import mwxml
 
+from ..metrics import NO_METRICS
+from ..streamer import Streamer
 from .revdocs2stats import process_args as revdocs2stats_args
 from .revdocs2stats import revdocs2stats
 
 logger = logging.getLogger(__name__)
 
 
-def dump2stats(dump, *args, **kwargs):
+def dump2stats(dump, *args, metrics=None, **kwargs):
+    metrics = metrics or NO_METRICS
 
-    rev_docs = mwxml.utilities.dump2revdocs(dump)
-    stats_docs = revdocs2stats(rev_docs, *args, **kwargs)
+    rev_docs = metrics.timed('read', mwxml.utilities.dump2revdocs(dump))
+    stats_docs = revdocs2stats(rev_docs, *args, metrics=metrics, **kwargs)
 
     yield from stats_docs
 
 
-streamer = mwcli.Streamer(
+streamer = Streamer(
     __doc__,
     __name__,
     dump2stats,
     revdocs2stats_args,
-    file_reader=mwxml.Dump.from_file
+    file_reader=mwxml.Dump.from_file,
+    input_page_id=lambda page: page.id
 )
 main = streamer.main
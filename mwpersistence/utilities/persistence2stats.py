@@ -7,16 +7,23 @@ r"""
 
     Usage:
         persistence2stats (-h | --help)
-        persistence2stats [<input-file>...] [--min-persisted=<num>]
-                          [--min-visible=<hours>] [--include=<regex>]
-                          [--exclude=<regex>] [--keep-tokens] [--threads=<num>]
-                          [--output=<path>] [--compress=<type>] [--verbose]
-                          [--debug]
+        persistence2stats [<input-file>...] [--input-format=<type>]
+                          [--min-persisted=<num>] [--min-visible=<hours>]
+                          [--include=<regex>] [--exclude=<regex>]
+                          [--batch=<revs>] [--keep-tokens] [--threads=<num>]
+                          [--output=<path>] [--compress=<type>]
+                          [--checkpoint=<pages>] [--json-codec=<name>]
+                          [--metrics=<path>] [--prescan]
+                          [--verbose] [--debug]
 
     Options:
         -h --help               Print this documentation
         <input-file>            The path to a file containing persistence data.
                                 [default: <stdin>]
+        --input-format=<type>   "json" or "columnar".  Columnar input files are
+                                the revisions.json of directories written by
+                                `diffs2persistence --output-format=columnar`.
+                                [default: json]
         --min-persisted=<revs>  The minimum number of revisions a token must
                                 survive before being considered "persisted"
                                 [default: 5]
@@ -27,6 +34,9 @@ r"""
                                 insensitive) [default: <all>]
         --exclude=<regex>       A regex matching tokens to exclude (case
                                 insensitive) [default: <none>]
+        --batch=<revs>          Compute statistics for this many revisions at a
+                                time with numpy.  The output is identical.
+                                Requires numpy.  [default: 0]
         --keep-tokens           Do not drop 'tokens' field data from the JSON
                                 document.
         --threads=<num>         If a collection of files are provided, how many
@@ -36,36 +46,65 @@ r"""
                                 file per input path.  [default: <stdout>]
         --compress=<type>       If set, output written to the output-dir will
                                 be compressed in this format. [default: bz2]
+        --checkpoint=<pages>    Record a checkpoint next to each output file
+                                after every <pages> pages.  Re-running an
+                                interrupted command resumes from the
+                                checkpoints.  Requires --output.
+                                [default: <none>]
+        --json-codec=<name>     The JSON library to read and write documents
+                                with: json, orjson or ujson.  Falls back to
+                                json if the library is not installed.
+                                [default: json]
+        --metrics=<path>        Periodically write timings and counters for
+                                each processing stage to a JSON file (see
+                                mwpersistence.metrics).  [default: <none>]
+        --prescan               Read the input files once before processing
+                                to estimate how long each will take.  The
+                                longest are started first.
         --verbose               Print out progress information
         --debug                 Print debug logging to stderr.
 """
 import logging
 import re
 import sys
+from itertools import chain
 from math import log
+from operator import itemgetter
 
-import mwcli
 import mwxml.utilities
+from more_itertools import chunked
+
+from ..columnar_format import ColumnarReader
+from ..metrics import NO_METRICS
+from ..streamer import Streamer
+from ..token_filter import TokenFilter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 logger = logging.getLogger(__name__)
 
+TOKEN_FIELDS = itemgetter('persisted', 'non_self_persisted',
+                          'seconds_visible')
+
 
 def process_args(args):
 
     if args['--include'] == "<all>":
         include = None
     else:
-        include_re = re.compile(args['--include'], re.UNICODE | re.I)
-        include = lambda t: bool(include_re.match(t))
+        include = re.compile(args['--include'], re.UNICODE | re.I)
 
     if args['--exclude'] == "<none>":
         exclude = None
     else:
-        exclude_re = re.compile(args['--exclude'], re.UNICODE | re.I)
-        exclude = lambda t: bool(exclude_re.match(t))
+        exclude = re.compile(args['--exclude'], re.UNICODE | re.I)
 
     return {'min_persisted': int(args['--min-persisted']),
             'min_visible': float(args['--min-visible']) * (60 * 60),
+            'batch_size': int(args['--batch']),
             'keep_tokens': bool(args['--keep-tokens']),
             'include': include,
             'exclude': exclude}
@@ -86,7 +125,8 @@ def drop_tokens(rev_docs):
 
 
 def persistence2stats(rev_docs, min_persisted=5, min_visible=1209600,
-                      include=None, exclude=None, verbose=False):
+                      include=None, exclude=None, batch_size=0,
+                      token_filter=None, metrics=None, verbose=False):
     """
     Processes a sorted and page-partitioned sequence of revision documents into
     and adds statistics to the 'persistence' field each token "added" in the
@@ -106,88 +146,395 @@ def persistence2stats(rev_docs, min_persisted=5, min_visible=1209600,
         min_visible : `int`
             The minimum number of seconds that a token must be visible in order
             to be considered "persistent".
-        include : `func`
-            A function that returns `True` when a token should be included in
-            statistical processing
-        exclude : `str` | `re.SRE_Pattern`
-            A function that returns `True` when a token should *not* be
-            included in statistical processing (Takes precedence over
-            'include')
+        include : `func` | `str` | `re.SRE_Pattern`
+            A function (or regular expression to match) that returns `True`
+            when a token should be included in statistical processing
+        exclude : `func` | `str` | `re.SRE_Pattern`
+            A function (or regular expression to match) that returns `True`
+            when a token should *not* be included in statistical processing
+            (Takes precedence over 'include')
+        batch_size : `int`
+            If set, statistics are computed for this many revisions at a time
+            with `numpy` (see
+            :func:`~mwpersistence.utilities.persistence2stats.batch_stats`).
+            The output is identical.
+        token_filter : :class:`~mwpersistence.token_filter.TokenFilter`
+            A memoized classifier to use in place of `include` and `exclude`
+            (e.g. to share its cache between calls).  Constructed from
+            `include` and `exclude` if not set.
+        metrics : :class:`~mwpersistence.metrics.Metrics`
+            If set, records the time spent in the ``stats`` stage.
         verbose : `bool`
             Prints out dots and stuff to stderr
 
     :Returns:
         A generator of rev_docs with a 'persistence' field containing
-        statistics about individual tokens.
+        statistics about individual tokens.  If `rev_docs` is a
+        :class:`~mwpersistence.columnar_format.ColumnarReader`, statistics
+        are computed straight from its columns and the rev_docs have no
+        'tokens'.
     """
-    rev_docs = mwxml.utilities.normalize(rev_docs)
-
     min_persisted = int(min_persisted)
     min_visible = int(min_visible)
-    include = include if include is not None else lambda t: True
-    exclude = exclude if exclude is not None else lambda t: False
+    batch_size = int(batch_size)
+    metrics = metrics or NO_METRICS
+    if token_filter is None:
+        token_filter = TokenFilter(include, exclude)
+        report_filter = token_filter.filters
+    else:
+        report_filter = False
+
+    if isinstance(rev_docs, ColumnarReader):
+        stats_docs = columnar_stats(rev_docs, min_persisted, min_visible,
+                                    token_filter,
+                                    batch_size=batch_size or 1000,
+                                    verbose=verbose)
+    elif batch_size > 0:
+        if np is None:
+            raise ImportError("Batched statistics require numpy.")
+        rev_docs = mwxml.utilities.normalize(rev_docs)
+        stats_docs = chain.from_iterable(
+            batch_stats(batch, min_persisted, min_visible, token_filter,
+                        verbose=verbose)
+            for batch in chunked(rev_docs, batch_size))
+    else:
+        rev_docs = mwxml.utilities.normalize(rev_docs)
+        stats_docs = loop_stats(rev_docs, min_persisted, min_visible,
+                                token_filter, verbose=verbose)
+
+    yield from metrics.timed('stats', stats_docs)
+
+    if report_filter:
+        report_hit_rate(token_filter)
+
+
+def report_hit_rate(token_filter):
+    logger.info("Token filter hit rate: {0:.1%} of {1} classifications "
+                "({2} texts cached)"
+                .format(token_filter.hit_rate,
+                        token_filter.hits + token_filter.misses,
+                        len(token_filter.decisions)))
 
+
+def loop_stats(rev_docs, min_persisted, min_visible, token_filter,
+               verbose=False):
     for rev_doc in rev_docs:
         persistence_doc = rev_doc['persistence']
-        stats_doc = {
-            'tokens_added': 0,
-            'persistent_tokens': 0,
-            'non_self_persistent_tokens': 0,
-            'sum_log_persisted': 0,
-            'sum_log_non_self_persisted': 0,
-            'sum_log_seconds_visible': 0,
-            'censored': False,
-            'non_self_censored': False
-        }
-
-        filtered_docs = (t for t in persistence_doc['tokens']
-                         if include(t['text']) and not exclude(t['text']))
-        for token_doc in filtered_docs:
-            if verbose:
-                sys.stderr.write(".")
-                sys.stderr.flush()
-
-            stats_doc['tokens_added'] += 1
-            stats_doc['sum_log_persisted'] += log(token_doc['persisted'] + 1)
-            stats_doc['sum_log_non_self_persisted'] += \
-                log(token_doc['non_self_persisted'] + 1)
-            stats_doc['sum_log_seconds_visible'] += \
-                log(token_doc['seconds_visible'] + 1)
-
-            # Look for time threshold
-            if token_doc['seconds_visible'] >= min_visible:
-                stats_doc['persistent_tokens'] += 1
-                stats_doc['non_self_persistent_tokens'] += 1
-            else:
-                # Look for review threshold
-                stats_doc['persistent_tokens'] += \
-                    token_doc['persisted'] >= min_persisted
 
-                stats_doc['non_self_persistent_tokens'] += \
-                    token_doc['non_self_persisted'] >= min_persisted
+        if token_filter.filters:
+            filtered_docs = (t for t in persistence_doc['tokens']
+                             if token_filter(t['text']))
+        else:
+            filtered_docs = persistence_doc['tokens']
+
+        revision_stats(persistence_doc, map(TOKEN_FIELDS, filtered_docs),
+                       min_persisted, min_visible, verbose=verbose)
+
+        yield rev_doc
+
+
+def add_stats(persistence_doc, token_values, min_persisted=5,
+              min_visible=1209600, token_filter=None):
+    """
+    Adds statistics to a persistence document straight from the values of
+    its tokens, so that no token documents need to be constructed.  Pass this
+    (with its keyword arguments bound) as the `token_stats` of
+    :func:`~mwpersistence.utilities.diffs2persistence`.  The statistics are
+    identical to those of
+    :func:`~mwpersistence.utilities.persistence2stats`.
+
+    :Parameters:
+        persistence_doc : `dict`
+            A 'persistence' field without 'tokens'
+        token_values : `iterable` ( `tuple` )
+            A ``(text, persisted, non_self_persisted, seconds_visible)``
+            tuple for each token added in the revision
+        min_persisted : `int`
+            See :func:`~mwpersistence.utilities.persistence2stats`
+        min_visible : `int`
+            See :func:`~mwpersistence.utilities.persistence2stats`
+        token_filter : :class:`~mwpersistence.token_filter.TokenFilter`
+            Decides which tokens to include
+    """
+    if token_filter is not None and token_filter.filters:
+        values = (value[1:] for value in token_values
+                  if token_filter(value[0]))
+    else:
+        values = (value[1:] for value in token_values)
+
+    revision_stats(persistence_doc, values, min_persisted, min_visible)
+
+
+def revision_stats(persistence_doc, token_values, min_persisted, min_visible,
+                   verbose=False):
+    """
+    Adds statistics to a persistence document from a
+    ``(persisted, non_self_persisted, seconds_visible)`` tuple for each of
+    the (included) tokens added in the revision.
+    """
+    stats_doc = {
+        'tokens_added': 0,
+        'persistent_tokens': 0,
+        'non_self_persistent_tokens': 0,
+        'sum_log_persisted': 0,
+        'sum_log_non_self_persisted': 0,
+        'sum_log_seconds_visible': 0,
+        'censored': False,
+        'non_self_censored': False
+    }
+
+    for persisted, non_self_persisted, seconds_visible in token_values:
+        if verbose:
+            sys.stderr.write(".")
+            sys.stderr.flush()
+
+        stats_doc['tokens_added'] += 1
+        stats_doc['sum_log_persisted'] += log(persisted + 1)
+        stats_doc['sum_log_non_self_persisted'] += \
+            log(non_self_persisted + 1)
+        stats_doc['sum_log_seconds_visible'] += log(seconds_visible + 1)
+
+        # Look for time threshold
+        if seconds_visible >= min_visible:
+            stats_doc['persistent_tokens'] += 1
+            stats_doc['non_self_persistent_tokens'] += 1
+        else:
+            # Look for review threshold
+            stats_doc['persistent_tokens'] += persisted >= min_persisted
+
+            stats_doc['non_self_persistent_tokens'] += \
+                non_self_persisted >= min_persisted
+
+            # Check for censoring
+            if persistence_doc['seconds_possible'] < min_visible:
+                stats_doc['censored'] = True
+                stats_doc['non_self_censored'] = True
 
-                # Check for censoring
-                if persistence_doc['seconds_possible'] < min_visible:
+            else:
+                if persistence_doc['revisions_processed'] < min_persisted:
                     stats_doc['censored'] = True
+
+                if persistence_doc['non_self_processed'] < min_persisted:
                     stats_doc['non_self_censored'] = True
 
-                else:
-                    if persistence_doc['revisions_processed'] < min_persisted:
-                        stats_doc['censored'] = True
+    if verbose:
+        sys.stderr.write("\n")
+        sys.stderr.flush()
+
+    persistence_doc.update(stats_doc)
 
-                    if persistence_doc['non_self_processed'] < min_persisted:
-                        stats_doc['non_self_censored'] = True
+
+def columnar_stats(reader, min_persisted, min_visible, token_filter,
+                   batch_size=1000, verbose=False):
+    """
+    Computes the same statistics as
+    :func:`~mwpersistence.utilities.persistence2stats` from the token columns
+    of a :class:`~mwpersistence.columnar_format.ColumnarReader`.  Each
+    distinct token text is classified once.
+
+    :Returns:
+        A generator of rev_docs with statistics added to their 'persistence'
+        field
+    """
+    if token_filter.filters:
+        keep = np.array([token_filter(text) for text in reader.texts],
+                        dtype=bool)
+    else:
+        keep = None
+
+    for rev_docs, lengths, columns in reader.batches(batch_size):
+        persisted = columns['persisted']
+        non_self_persisted = columns['non_self_persisted']
+        seconds_visible = columns['seconds_visible']
+        if keep is not None and len(persisted) > 0:
+            kept = keep[columns['text']]
+            ends = np.cumsum(lengths)
+            lengths = _counts(kept, ends - lengths, ends)
+            persisted = persisted[kept]
+            non_self_persisted = non_self_persisted[kept]
+            seconds_visible = seconds_visible[kept]
+
+        yield from column_stats(rev_docs, lengths, persisted,
+                                non_self_persisted, seconds_visible,
+                                min_persisted, min_visible, verbose=verbose)
+
+
+def batch_stats(rev_docs, min_persisted, min_visible, token_filter,
+                verbose=False):
+    """
+    Computes the same statistics as
+    :func:`~mwpersistence.utilities.persistence2stats` for a batch of
+    revision documents at once.  The token documents of all revisions are
+    collected into arrays (see
+    :func:`~mwpersistence.utilities.persistence2stats.column_stats`).
+    Requires `numpy`.
+
+    :Returns:
+        A list of rev_docs with statistics added to their 'persistence' field
+    """
+    rev_docs = list(rev_docs)
+    token_lists, lengths = [], []
+    for rev_doc in rev_docs:
+        tokens = rev_doc['persistence']['tokens']
+        if token_filter.filters:
+            tokens = [t for t in tokens if token_filter(t['text'])]
+        token_lists.append(tokens)
+        lengths.append(len(tokens))
+
+    # Integer values are exactly representable as float64
+    values = chain.from_iterable(map(TOKEN_FIELDS,
+                                     chain.from_iterable(token_lists)))
+    columns = np.fromiter(values, dtype=np.float64,
+                          count=3 * sum(lengths)).reshape(-1, 3)
+    persisted, non_self_persisted, seconds_visible = columns.T
+
+    return column_stats(rev_docs, lengths, persisted, non_self_persisted,
+                        seconds_visible, min_persisted, min_visible,
+                        verbose=verbose)
+
+
+def column_stats(rev_docs, lengths, persisted, non_self_persisted,
+                 seconds_visible, min_persisted, min_visible, verbose=False):
+    """
+    Computes revision statistics from arrays of the token values of a
+    sequence of revisions.  Logs are looked up from a table of the distinct
+    values computed with :func:`math.log`, and sums are accumulated in token
+    order, so the output is identical to the per-token loop.
+
+    :Parameters:
+        rev_docs : `list` ( `dict` )
+            Revision documents with a 'persistence' field
+        lengths : `iterable` ( `int` )
+            The number of (included) tokens in each revision
+        persisted, non_self_persisted, seconds_visible : `numpy.ndarray`
+            The values of the tokens of all revisions in order
+
+    :Returns:
+        A list of rev_docs with statistics added to their 'persistence' field
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    sum_log_persisted = _sequential_sums(
+        _logs(persisted), starts, lengths).tolist()
+    sum_log_non_self_persisted = _sequential_sums(
+        _logs(non_self_persisted), starts, lengths).tolist()
+    sum_log_seconds_visible = _sequential_sums(
+        _logs(seconds_visible), starts, lengths).tolist()
+
+    visible = seconds_visible >= min_visible
+    persistent_tokens = _counts(
+        visible | (persisted >= min_persisted), starts, ends).tolist()
+    non_self_persistent_tokens = _counts(
+        visible | (non_self_persisted >= min_persisted), starts, ends).tolist()
+    not_visible = _counts(~visible, starts, ends).tolist()
+
+    for i, rev_doc in enumerate(rev_docs):
+        persistence_doc = rev_doc['persistence']
+        tokens_added = int(lengths[i])
+
+        censored, non_self_censored = False, False
+        if not_visible[i] > 0:
+            if persistence_doc['seconds_possible'] < min_visible:
+                censored, non_self_censored = True, True
+            else:
+                censored = \
+                    persistence_doc['revisions_processed'] < min_persisted
+                non_self_censored = \
+                    persistence_doc['non_self_processed'] < min_persisted
+
+        if tokens_added > 0:
+            sums = (sum_log_persisted[i], sum_log_non_self_persisted[i],
+                    sum_log_seconds_visible[i])
+        else:
+            sums = (0, 0, 0)
 
         if verbose:
-            sys.stderr.write("\n")
+            sys.stderr.write("." * tokens_added + "\n")
             sys.stderr.flush()
 
-        rev_doc['persistence'].update(stats_doc)
+        persistence_doc.update({
+            'tokens_added': tokens_added,
+            'persistent_tokens': persistent_tokens[i],
+            'non_self_persistent_tokens': non_self_persistent_tokens[i],
+            'sum_log_persisted': sums[0],
+            'sum_log_non_self_persisted': sums[1],
+            'sum_log_seconds_visible': sums[2],
+            'censored': censored,
+            'non_self_censored': non_self_censored
+        })
 
-        yield rev_doc
+    return rev_docs
+
+
+SMALL_LOGS = None
+"""
+A table of log(value + 1) for small integer values.  Grown as needed.
+"""
+
+
+def _logs(values):
+    # math.log() and numpy.log() can disagree in the last bit, so logs are
+    # looked up in tables generated by math.log().
+    global SMALL_LOGS
+
+    if len(values) > 0 and values.min() >= 0 and values.max() < 2 ** 16:
+        indexes = values.astype(np.int64)
+        if np.array_equal(indexes, values):
+            size = int(indexes.max()) + 1
+            if SMALL_LOGS is None or size > len(SMALL_LOGS):
+                SMALL_LOGS = np.array([log(value + 1)
+                                       for value in range(size)],
+                                      dtype=np.float64)
+            return SMALL_LOGS[indexes]
+
+    distinct, inverse = np.unique(values, return_inverse=True)
+    table = np.array([log(value + 1) for value in distinct.tolist()],
+                     dtype=np.float64)
+    return table[inverse.reshape(-1)]
+
+
+def _counts(mask, starts, ends):
+    cumulative = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return cumulative[ends] - cumulative[starts]
+
+
+SUM_CELLS = 2 ** 20
+"""
+The maximum number of cells in a padded matrix of values to be summed.
+"""
+
+
+def _sequential_sums(values, starts, lengths):
+    # Sums each revision's values in order (as the per-token loop does) by
+    # accumulating along the rows of a zero-padded matrix.  Rows are grouped
+    # by length to limit padding.
+    sums = np.zeros(len(lengths), dtype=np.float64)
+    order = np.argsort(lengths, kind='stable')
+    sorted_lengths = lengths[order].tolist()
+
+    i = 0
+    while i < len(order):
+        j = i + 1
+        while j < len(order) and \
+                sorted_lengths[j] * (j + 1 - i) <= SUM_CELLS:
+            j += 1
+
+        width = sorted_lengths[j - 1]
+        if width > 0:
+            rows = order[i:j]
+            columns = np.arange(width)
+            present = columns < lengths[rows, None]
+            matrix = np.zeros((len(rows), width), dtype=np.float64)
+            matrix[present] = values[(starts[rows, None] + columns)[present]]
+            sums[rows] = np.cumsum(matrix, axis=1)[:, -1]
+        i = j
+
+    return sums
 
 
-streamer = mwcli.Streamer(
+streamer = Streamer(
     __doc__,
     __name__,
     _persistence2stats,
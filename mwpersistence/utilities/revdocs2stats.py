@@ -10,10 +10,18 @@ r"""
         revdocs2stats [<input-file>...] --config=<path> --sunset=<date>
                       [--namespaces=<ids>] [--timeout=<secs>]
                       [--window=<revs>] [--revert-radius=<revs>]
+                      [--window-memory=<MB>] [--window-span=<days>]
+                      [--spill-tokens=<num>] [--spill-dir=<path>]
+                      [--aggregate] [--columnar] [--shared-texts=<num>]
+                      [--page-states=<path>] [--blame]
                       [--min-persisted=<num>] [--min-visible=<days>]
-                      [--include=<regex>] [--exclude=<regex>]
+                      [--include=<regex>] [--exclude=<regex>] [--batch=<revs>]
                       [--keep-text] [--keep-diff] [--keep-tokens]
-                      [--threads=<num>] [--output=<path>] [--compress=<type>]
+                      [--threads=<num>] [--page-workers=<num>]
+                      [--pipeline]
+                      [--output=<path>] [--compress=<type>]
+                      [--checkpoint=<pages>] [--json-codec=<name>]
+                      [--metrics=<path>] [--prescan]
                       [--verbose] [--debug]
 
     Options:
@@ -33,8 +41,40 @@ r"""
         --window=<revs>         The size of the window of revisions from which
                                 persistence data will be generated.
                                 [default: 50]
+        --window-memory=<MB>    Also end a revision's window when the tokens
+                                that the window tracks are estimated to use
+                                more than this many megabytes.
+                                [default: <none>]
+        --window-span=<days>    Also end a revision's window once it spans
+                                this many days.  [default: <none>]
+        --spill-tokens=<num>    Write the revisions of a page to temporary
+                                files while they are in the window once the
+                                page has more than this many tokens.
+                                [default: <none>]
+        --spill-dir=<path>      The directory to write spilled revisions to.
+                                [default: <tmp>]
         --revert-radius=<revs>  The number of revisions back that a revert can
                                 reference. [default: 15]
+        --aggregate             Keep only running counters for each token
+                                rather than a record of every revision it
+                                persisted through.  Saves a lot of memory.
+        --columnar              Store token state in numpy arrays rather than
+                                in Token objects.  Requires numpy.
+        --shared-texts=<num>    The maximum number of distinct token texts to
+                                intern across pages.  Token texts are always
+                                interned within a page.  [default: 0]
+        --page-states=<path>    The path to a database of saved page states.
+                                Pages with a saved state only process the
+                                revisions that are newer than it, and the
+                                state of every page is saved.  Revisions
+                                that were still in a page's window when its
+                                state was saved are output again with
+                                updated statistics, so output appended to a
+                                previous run's repeats their ids.  Keep the
+                                last copy of each.  [default: <none>]
+        --blame                 Add a 'blame' field to each revision that
+                                records the revision that added each of its
+                                tokens as [<tokens>, <rev_id>] runs.
         --min-persisted=<num>   The minimum number of revisions a token must
                                 survive before being considered "persisted"
                                 [default: 5]
@@ -45,33 +85,67 @@ r"""
                                 [default: <all>]
         --exclude=<regex>       A regex matching tokens to exclude
                                 [default: <none>]
+        --batch=<revs>          Compute statistics for this many revisions at a
+                                time with numpy (only if tokens are kept).
+                                The output is identical.  Requires numpy.
+                                [default: 0]
         --keep-text             If set, the 'text' field will be populated in
                                 the output JSON.
         --keep-diff             If set, the 'diff' field will be populated in
                                 the output JSON.
         --keep-tokens           If set, the 'tokens' field will be populated in
-                                the output JSON.
+                                the output JSON.  Otherwise, statistics are
+                                computed straight from the token state
+                                without generating token documents.
         --threads=<num>         If a collection of files are provided, how many
                                 processor threads should be prepare?
                                 [default: <cpu_count>]
+        --page-workers=<num>    How many processes should the pages of each
+                                input be split between?  Output order is
+                                preserved.  The token filter's hit rate is
+                                not logged with page workers. [default: 1]
+        --pipeline              Run reading, diffing and persistence in
+                                separate processes that are connected by
+                                bounded queues so that they overlap.  Ignored
+                                if there are page workers.
         --output=<path>         Write output to a directory with one output
                                 file per input path.  [default: <stdout>]
         --compress=<type>       If set, output written to the output-dir will
                                 be compressed in this format. [default: bz2]
+        --checkpoint=<pages>    Record a checkpoint next to each output file
+                                after every <pages> pages.  Re-running an
+                                interrupted command resumes from the
+                                checkpoints.  Requires --output.
+                                [default: <none>]
+        --json-codec=<name>     The JSON library to read and write documents
+                                with: json, orjson or ujson.  Falls back to
+                                json if the library is not installed.
+                                [default: json]
+        --metrics=<path>        Periodically write timings and counters for
+                                each processing stage to a JSON file (see
+                                mwpersistence.metrics).  [default: <none>]
+        --prescan               Read the input files once before processing
+                                to estimate how long each will take.  The
+                                longest are started first.
         --verbose               Print progress information to stderr.
         --debug                 Print debug logging to stderr.
 """
 import logging
+from functools import partial
 
-import mwcli
 import mwxml.utilities
 
 import mwdiffs.utilities
 
-from .diffs2persistence import process_args as diffs2persistence_args
+from ..metrics import NO_METRICS
+from ..parallel import map_pages, run_pipeline
+from ..store import skip_saved
+from ..streamer import Streamer
+from ..token_filter import TokenFilter
+from .diffs2persistence import persistence_args as diffs2persistence_args
 from .diffs2persistence import diffs2persistence, drop_diff
 from .persistence2stats import process_args as persistence2stats_args
-from .persistence2stats import drop_tokens, persistence2stats
+from .persistence2stats import add_stats, persistence2stats, report_hit_rate
 
 logger = logging.getLogger(__name__)
 
@@ -80,33 +154,99 @@ def process_args(args):
     kwargs = mwdiffs.utilities.dump2diffs_args(args)
     kwargs.update(diffs2persistence_args(args))
     kwargs.update(persistence2stats_args(args))
+    kwargs['pipeline'] = args['--pipeline']
     return kwargs
 
 
 def revdocs2stats(rev_docs, diff_engine, namespaces, timeout, window_size,
                   revert_radius, sunset, min_persisted, min_visible,
-                  include, exclude, keep_text=False, keep_diff=False,
-                  keep_tokens=False, verbose=False):
-
-    diff_docs = mwdiffs.utilities.revdocs2diffs(rev_docs, diff_engine,
-                                                namespaces, timeout)
-    if not keep_text:
-        diff_docs = mwdiffs.utilities.drop_text(diff_docs)
-
-    persistence_docs = diffs2persistence(
-        diff_docs, window_size, revert_radius, sunset, verbose=verbose)
-    if not keep_diff:
-        persistence_docs = drop_diff(persistence_docs)
-
-    stats_docs = persistence2stats(
-        persistence_docs, min_persisted, min_visible, include, exclude)
-    if not keep_tokens:
-        stats_docs = drop_tokens(stats_docs)
-
-    yield from stats_docs
-
-
-streamer = mwcli.Streamer(
+                  include, exclude, window_bytes=None, window_seconds=None,
+                  spill_tokens=None, spill_dir=None, aggregate=False,
+                  columnar=False,
+                  shared_texts=0, page_workers=1, state_store=None,
+                  blame=False, batch_size=0, token_filter=None,
+                  keep_text=False, keep_diff=False, keep_tokens=False,
+                  pipeline=False, metrics=None, verbose=False):
+
+    if token_filter is None:
+        # Share one memoized classifier between all pages
+        token_filter = TokenFilter(include, exclude)
+        report_filter = token_filter.filters
+    else:
+        report_filter = False
+
+    metrics = metrics or NO_METRICS
+
+    if int(page_workers) > 1:
+        # The filter's counts stay in the workers, so the hit rate is only
+        # reported when pages are processed in this process
+        yield from metrics.timed('workers', map_pages(
+            revdocs2stats, rev_docs, page_workers,
+            diff_engine=diff_engine, namespaces=namespaces, timeout=timeout,
+            window_size=window_size, revert_radius=revert_radius,
+            sunset=sunset, min_persisted=min_persisted,
+            min_visible=min_visible, include=include, exclude=exclude,
+            window_bytes=window_bytes, window_seconds=window_seconds,
+            spill_tokens=spill_tokens, spill_dir=spill_dir,
+            aggregate=aggregate, columnar=columnar, shared_texts=shared_texts,
+            state_store=state_store, blame=blame, batch_size=batch_size,
+            token_filter=token_filter, keep_text=keep_text,
+            keep_diff=keep_diff, keep_tokens=keep_tokens, verbose=verbose))
+        return
+
+    if keep_tokens:
+        token_stats = None
+    else:
+        # Token documents would just be dropped, so compute stats straight
+        # from the token state
+        token_stats = partial(add_stats, min_persisted=int(min_persisted),
+                              min_visible=int(min_visible),
+                              token_filter=token_filter)
+
+    def read(rev_docs):
+        if state_store is not None:
+            # Don't diff revisions that a saved page state already includes
+            rev_docs = skip_saved(rev_docs, state_store)
+        return rev_docs
+
+    def diff(rev_docs):
+        diff_docs = metrics.timed('diff', mwdiffs.utilities.revdocs2diffs(
+            rev_docs, diff_engine, namespaces, timeout))
+        if not keep_text:
+            diff_docs = mwdiffs.utilities.drop_text(diff_docs)
+        return diff_docs
+
+    def stats(diff_docs):
+        persistence_docs = diffs2persistence(
+            diff_docs, window_size, revert_radius, sunset,
+            window_bytes=window_bytes, window_seconds=window_seconds,
+            spill_tokens=spill_tokens, spill_dir=spill_dir,
+            aggregate=aggregate, columnar=columnar,
+            shared_texts=shared_texts, state_store=state_store, blame=blame,
+            token_stats=token_stats, metrics=metrics, verbose=verbose)
+        if not keep_diff:
+            persistence_docs = drop_diff(persistence_docs)
+
+        if token_stats is None:
+            yield from persistence2stats(
+                persistence_docs, min_persisted, min_visible, include,
+                exclude, batch_size=batch_size, token_filter=token_filter,
+                metrics=metrics)
+        else:
+            yield from persistence_docs
+
+        if report_filter:
+            report_hit_rate(token_filter)
+
+    if pipeline:
+        # Each stage runs in its own process.  Their timings stay there.
+        yield from metrics.timed('pipeline', run_pipeline(
+            rev_docs, [read, diff, stats]))
+    else:
+        yield from stats(diff(read(rev_docs)))
+
+
+streamer = Streamer(
     __doc__,
     __name__,
     revdocs2stats,
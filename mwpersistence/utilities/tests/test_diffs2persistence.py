@@ -1,6 +1,22 @@
+import io
+import json
+import os
+import sys
+import tempfile
+from copy import deepcopy
+from functools import partial
+
+import deltas
+from nose.plugins.skip import SkipTest
 from nose.tools import eq_
 
-from ..diffs2persistence import diffs2persistence
+from ...benchmarks.generator import PageHistoryGenerator, add_diffs
+from ...columnar import np
+from ...metrics import Metrics
+from ...store import StateStore
+from ...token_filter import TokenFilter
+from ..diffs2persistence import diffs2persistence, main
+from ..persistence2stats import add_stats, drop_tokens, persistence2stats
 
 test_diff_docs = [
     {"sha1": "aaa",
@@ -68,3 +84,229 @@ def test_diffs2persistence():
     eq_([t['persisted'] for t in docs[3]['persistence']['tokens']],
         [0, 0, 0, 0, 0, 0])
     eq_(docs[3]['persistence']['revisions_processed'], 0)
+
+
+def test_diffs2persistence_aggregate():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs)))
+    aggregate_docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                            aggregate=True))
+
+    eq_([d['persistence'] for d in aggregate_docs],
+        [d['persistence'] for d in docs])
+
+
+def test_diffs2persistence_columnar():
+    if np is None:
+        raise SkipTest("numpy is not installed")
+
+    docs = list(diffs2persistence(deepcopy(test_diff_docs)))
+    columnar_docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                           columnar=True))
+
+    eq_([d['persistence'] for d in columnar_docs],
+        [d['persistence'] for d in docs])
+
+
+def test_diffs2persistence_seconds():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  sunset="1970-01-01T00:00:10Z"))
+
+    eq_(docs[0]['persistence']['seconds_possible'], 10)
+    eq_([t['seconds_visible'] for t in docs[0]['persistence']['tokens']],
+        [10, 10, 10, 10, 10, 10])
+    eq_([t['seconds_visible'] for t in docs[1]['persistence']['tokens']],
+        [1, 1, 1, 1])
+    eq_(docs[3]['persistence']['seconds_possible'], 10)
+
+
+def test_diffs2persistence_page_workers():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  sunset="1970-01-01T00:00:10Z"))
+    parallel_docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                           sunset="1970-01-01T00:00:10Z",
+                                           page_workers=2))
+
+    eq_(parallel_docs, docs)
+
+
+def test_diffs2persistence_state_store():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  sunset="1970-01-01T00:00:10Z"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        state_store = StateStore(os.path.join(directory, "states.db"))
+        old_docs = deepcopy(test_diff_docs[:2] + test_diff_docs[3:])
+        list(diffs2persistence(old_docs, sunset="1970-01-01T00:00:05Z",
+                               state_store=state_store))
+        eq_(len(state_store), 2)
+
+        # Revisions that were still in the window are emitted again
+        incremental_docs = list(diffs2persistence(
+            deepcopy(test_diff_docs), sunset="1970-01-01T00:00:10Z",
+            state_store=state_store))
+
+    eq_(incremental_docs, docs)
+
+
+def test_diffs2persistence_token_stats():
+    kwargs = {'min_persisted': 1, 'min_visible': 5,
+              'token_filter': TokenFilter(exclude=r"\s+")}
+    docs = list(drop_tokens(persistence2stats(
+        diffs2persistence(deepcopy(test_diff_docs),
+                          sunset="1970-01-01T00:00:10Z"), **kwargs)))
+
+    token_stats = partial(add_stats, **kwargs)
+    for options in [{}, {'aggregate': True}, {'columnar': True}]:
+        if options.get('columnar') and np is None:
+            continue
+        fused_docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                            sunset="1970-01-01T00:00:10Z",
+                                            token_stats=token_stats,
+                                            **options))
+        eq_(fused_docs, docs)
+
+
+def test_diffs2persistence_window_bounds():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs)))
+    eq_(['window_bound' in d['persistence'] for d in docs],
+        [False, False, False, False])
+
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  window_seconds=1))
+    eq_([d['persistence']['window_bound'] for d in docs],
+        ["seconds", "seconds", "end", "end"])
+    eq_(docs[0]['persistence']['revisions_processed'], 1)
+
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  window_bytes=0))
+    eq_([d['persistence']['window_bound'] for d in docs],
+        ["bytes", "bytes", "end", "end"])
+
+
+def test_diffs2persistence_spill():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        spilled_docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                              spill_tokens=6,
+                                              spill_dir=directory))
+        eq_(os.listdir(directory), [])
+
+    eq_(spilled_docs, docs)
+
+
+def test_diffs2persistence_interleaved():
+    interleaved = deepcopy(test_diff_docs)
+    interleaved = [interleaved[0], interleaved[3]] + interleaved[1:3]
+
+    options = [{}, {'aggregate': True, 'blame': True}]
+    if np is not None:
+        options.append({'columnar': True})
+    for kwargs in options:
+        docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                      sunset="1970-01-01T00:00:10Z",
+                                      **kwargs))
+        # Every page is evicted to disk and restored with one page per pool
+        for pool_pages in (10, 1):
+            interleaved_docs = list(diffs2persistence(
+                deepcopy(interleaved), sunset="1970-01-01T00:00:10Z",
+                interleaved=True, pool_pages=pool_pages, **kwargs))
+            eq_(sorted(interleaved_docs, key=lambda d: d['id']), docs)
+
+
+def test_diffs2persistence_interleaved_batches():
+    generator = PageHistoryGenerator(pages=3, revisions=100, page_length=50)
+    rev_docs = list(add_diffs(generator, deltas.SegmentMatcher()))
+    docs = list(diffs2persistence(deepcopy(rev_docs),
+                                  sunset="2030-01-01T00:00:00Z"))
+
+    # The pages take turns, so only the page that was edited last is in the
+    # pool.  The others' revisions are held back and applied in batches.
+    pages = [[d for d in rev_docs if d['page']['id'] == page_id]
+             for page_id in (1, 2, 3)]
+    interleaved = [d for revisions in zip(*pages) for d in revisions]
+    metrics = Metrics()
+    interleaved_docs = list(diffs2persistence(
+        interleaved, sunset="2030-01-01T00:00:00Z", interleaved=True,
+        pool_pages=1, metrics=metrics))
+    eq_(sorted(interleaved_docs, key=lambda d: d['id']),
+        sorted(docs, key=lambda d: d['id']))
+    assert metrics.counters['evictions'] < 300 / 10
+
+
+def test_diffs2persistence_blame():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs)))
+    eq_(['blame' in d for d in docs], [False, False, False, False])
+
+    docs = list(diffs2persistence(deepcopy(test_diff_docs), blame=True))
+    eq_([d['blame'] for d in docs],
+        [[[6, 10]], [[5, 10], [4, 11], [1, 10]], [[6, 10]], [[6, 20]]])
+
+
+def test_diffs2persistence_stdin():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  sunset="1970-01-01T00:00:10Z"))
+
+    lines = "".join(json.dumps(d) + "\n" for d in test_diff_docs)
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin = io.TextIOWrapper(io.BytesIO(lines.encode('utf-8')))
+    sys.stdout = io.StringIO()
+    try:
+        main(["--sunset=1970-01-01T00:00:10Z", "--prescan"])
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdin, sys.stdout = stdin, stdout
+
+    eq_([(d['id'], d['persistence'])
+         for d in map(json.loads, output.splitlines())],
+        [(d['id'], d['persistence']) for d in docs])
+
+
+def test_diffs2persistence_page_workers_files():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  sunset="1970-01-01T00:00:10Z"))
+
+    # Each input file is read in a daemonic process that can't start page
+    # workers of its own
+    directory = tempfile.mkdtemp()
+    paths = []
+    for i in range(2):
+        path = os.path.join(directory, "{0}.json".format(i))
+        with open(path, "w") as f:
+            for doc in test_diff_docs:
+                f.write(json.dumps(doc) + "\n")
+        paths.append(path)
+
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        main(paths + ["--sunset=1970-01-01T00:00:10Z", "--page-workers=2"])
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+    eq_(sorted((d['id'], d['persistence'])
+               for d in map(json.loads, output.splitlines())),
+        sorted((d['id'], d['persistence']) for d in docs * 2))
+
+
+def test_diffs2persistence_interleaved_checkpoint():
+    docs = list(diffs2persistence(deepcopy(test_diff_docs),
+                                  sunset="1970-01-01T00:00:10Z"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "input.json")
+        with open(path, "w") as f:
+            for doc in test_diff_docs:
+                f.write(json.dumps(doc) + "\n")
+        output_dir = os.path.join(directory, "output")
+        os.mkdir(output_dir)
+
+        # Interleaved output can't be checkpointed by page
+        main([path, "--sunset=1970-01-01T00:00:10Z", "--interleaved",
+              "--output=" + output_dir, "--compress=json",
+              "--checkpoint=1"])
+        eq_(sorted(os.listdir(output_dir)), ["input.json"])
+        with open(os.path.join(output_dir, "input.json")) as f:
+            eq_([(d['id'], d['persistence']) for d in map(json.loads, f)],
+                [(d['id'], d['persistence']) for d in docs])
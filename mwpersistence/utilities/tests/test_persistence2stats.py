@@ -1,6 +1,13 @@
+import json
+import os
+import tempfile
+from copy import deepcopy
+
+from nose.plugins.skip import SkipTest
 from nose.tools import eq_
 
-from ..persistence2stats import persistence2stats
+from ...columnar_format import ColumnarReader, ColumnarWriter
+from ..persistence2stats import np, persistence2stats
 
 test_persistence_docs = [
     {"sha1": "aaa",
@@ -100,3 +107,40 @@ def test_persistence2stats():
 
     assert docs[0]['persistence']['sum_log_seconds_visible'] > 0, \
            docs[0]['persistence']['sum_log_seconds_visible']
+
+
+def test_persistence2stats_batch():
+    if np is None:
+        raise SkipTest("numpy is not installed")
+
+    kwargs = {'min_persisted': 2, 'min_visible': 10,
+              'exclude': lambda t: len(t.strip()) == 0}
+    docs = persistence2stats(deepcopy(test_persistence_docs), **kwargs)
+    batch_docs = persistence2stats(deepcopy(test_persistence_docs),
+                                   batch_size=3, **kwargs)
+
+    eq_([json.dumps(d) for d in batch_docs], [json.dumps(d) for d in docs])
+
+
+def test_persistence2stats_columnar():
+    if np is None:
+        raise SkipTest("numpy is not installed")
+
+    kwargs = {'min_persisted': 2, 'min_visible': 10,
+              'exclude': lambda t: len(t.strip()) == 0}
+    docs = list(persistence2stats(deepcopy(test_persistence_docs), **kwargs))
+    for doc in docs:
+        doc['persistence'].pop('tokens', None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "persistence.columnar")
+        with ColumnarWriter(path) as writer:
+            for doc in test_persistence_docs:
+                writer.write(doc)
+
+        eq_(list(ColumnarReader(path)), test_persistence_docs)
+
+        columnar_docs = persistence2stats(ColumnarReader(path), batch_size=2,
+                                          **kwargs)
+        eq_([json.dumps(d) for d in columnar_docs],
+            [json.dumps(d) for d in docs])
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+
+import docopt
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_
+
+from ..revdocs2stats import process_args, revdocs2stats, streamer
+
+CONFIG = """
+diff_engine: segment_matcher
+
+tokenizers:
+  wikitext_split:
+    module: deltas.tokenizers.wikitext_split
+
+diff_engines:
+  segment_matcher:
+    class: deltas.algorithms.SegmentMatcher
+    segmenter: western_psw
+    tokenizer: wikitext_split
+
+segmenters:
+  western_psw:
+    class: deltas.segmenters.ParagraphsSentencesAndWhitespace
+"""
+
+REV_DOCS = [
+    {'id': rev_id, 'text': text, 'sha1': sha1,
+     'timestamp': "1970-01-01T00:00:0{0}Z".format(rev_id),
+     'page': {'id': 1, 'title': "Foo", 'namespace': 0},
+     'user': {'text': user, 'id': None}}
+    for rev_id, text, sha1, user in [
+        (1, "Apples are red.", "aaa", "a"),
+        (2, "Apples are blue.", "bbb", "b"),
+        (3, "Apples are red.", "aaa", "a")]]
+
+
+def parse_args(*argv):
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.yaml")
+        with open(config_path, 'w') as f:
+            f.write(CONFIG)
+
+        args = docopt.docopt(streamer.doc, argv=[
+            "--config=" + config_path, "--sunset=1970-01-01T00:00:10Z",
+            "--min-persisted=1"] + list(argv))
+        return process_args(args)
+
+
+def test_revdocs2stats_args():
+    kwargs = parse_args()
+
+    # Every argument must be accepted
+    stats_docs = revdocs2stats([dict(d) for d in REV_DOCS], **kwargs)
+    if not hasattr(time, 'clock'):
+        raise SkipTest("mwdiffs requires time.clock()")
+
+    stats_docs = list(stats_docs)
+    eq_([d['id'] for d in stats_docs], [1, 2, 3])
+    eq_(stats_docs[1]['persistence']['tokens_added'], 1)
+
+
+def test_revdocs2stats_pipeline():
+    kwargs = parse_args("--pipeline")
+    eq_(kwargs['pipeline'], True)
+    if not hasattr(time, 'clock'):
+        raise SkipTest("mwdiffs requires time.clock()")
+
+    stats_docs = list(revdocs2stats([dict(d) for d in REV_DOCS], **kwargs))
+    eq_([d['id'] for d in stats_docs], [1, 2, 3])
+    eq_(stats_docs[1]['persistence']['tokens_added'], 1)
@@ -0,0 +1,200 @@
+"""
+The processing window used by
+:func:`~mwpersistence.utilities.diffs2persistence`.
+
+A revision's window is the sequence of revisions that follow it.  Its
+statistics are generated when its window ends.  A window always ends after
+`maxlen` revisions, but it can also be bounded by the estimated memory used
+by the tokens that the window tracks or by the time that it spans, so that
+large articles don't hold on to too many tokens while small pages keep long
+windows.  The revision documents of a window can be spilled to disk (see
+:mod:`mwpersistence.spill`).
+
+.. autoclass:: mwpersistence.window.Window
+    :members:
+"""
+from collections import Counter, deque
+
+from .spill import Spilled
+from .util import user_key
+
+TOKEN_BYTES = 200
+"""
+The approximate memory used by a tracked :class:`~mwpersistence.Token`
+"""
+
+AGGREGATE_TOKEN_BYTES = 160
+"""
+The approximate memory used by a tracked
+:class:`~mwpersistence.AggregateToken`
+"""
+
+COLUMNAR_TOKEN_BYTES = 48
+"""
+The approximate memory used by a token tracked in a
+:class:`~mwpersistence.columnar.ColumnarDiffState`
+"""
+
+
+class Window:
+    """
+    Constructs a window of ``(rev_doc, timestamp, tokens_added)`` entries
+    that keeps a count of revisions per user as entries enter and leave so
+    that window statistics can be computed in constant time.
+
+    :Parameters:
+        maxlen : `int`
+            The maximum number of entries.  Appending to a full window drops
+            the oldest entry.
+        max_bytes : `int`
+            If set, the tail entry's window ends when the tokens added by the
+            entries are estimated to use more than this many bytes
+        max_seconds : `int`
+            If set, the tail entry's window ends when it spans at least this
+            many seconds
+        token_bytes : `int`
+            The estimated number of bytes used by each token
+        spill : :class:`~mwpersistence.spill.SpillFile`
+            Stores the revision documents of entries that are pushed with
+            ``spill=True``.  They are loaded back when they leave the window.
+    """
+    __slots__ = ('entries', 'maxlen', 'max_bytes', 'max_seconds',
+                 'token_bytes', 'tokens', 'user_revisions', 'spill')
+
+    def __init__(self, maxlen, max_bytes=None, max_seconds=None,
+                 token_bytes=TOKEN_BYTES, spill=None):
+        self.entries = deque()
+        self.maxlen = int(maxlen)
+        self.max_bytes = int(max_bytes) if max_bytes is not None else None
+        self.max_seconds = max_seconds
+        self.token_bytes = int(token_bytes)
+        self.tokens = 0
+        self.user_revisions = Counter()
+        self.spill = spill
+
+    @property
+    def adaptive(self):
+        """
+        `True` if the window is bounded by memory or time.
+        """
+        return self.max_bytes is not None or self.max_seconds is not None
+
+    def append(self, entry):
+        """
+        Adds an entry to the head of the window.  Drops the entry at the tail
+        if the window is full.
+        """
+        if len(self.entries) >= self.maxlen:
+            self.popleft()
+        self.push(entry)
+
+    def push(self, entry, spill=False):
+        """
+        Adds an entry to the head of the window without dropping any
+        entries.  See :func:`~mwpersistence.window.Window.ending`.  If `spill`
+        is set, the entry's revision document is written to the window's
+        :class:`~mwpersistence.spill.SpillFile` until it leaves the window.
+        Until then, it is a :class:`~mwpersistence.spill.Spilled` reference.
+        """
+        rev_doc, timestamp, tokens_added = entry
+        key = user_key(rev_doc['user'])
+        size = len(tokens_added)
+        if spill:
+            entry = (self.spill.dump(rev_doc), timestamp, tokens_added)
+        self.entries.append((entry, key, size))
+        self.user_revisions[key] += 1
+        self.tokens += size
+
+    def popleft(self):
+        """
+        Removes and returns the entry at the tail of the window.
+        """
+        entry, key, size = self.entries.popleft()
+        self.user_revisions[key] -= 1
+        if self.user_revisions[key] == 0:
+            del self.user_revisions[key]
+        self.tokens -= size
+        rev_doc, timestamp, tokens_added = entry
+        if isinstance(rev_doc, Spilled):
+            entry = (self.spill.load(rev_doc), timestamp, tokens_added)
+        return entry
+
+    def ending(self):
+        """
+        Checks whether the window of the entry at the tail (the entries
+        after it) has reached a bound.
+
+        :Returns:
+            "revisions", "bytes" or "seconds" for the bound that was reached
+            or `None`
+        """
+        if len(self.entries) < 2:
+            return None
+        elif len(self.entries) - 1 >= self.maxlen:
+            return "revisions"
+        elif self.max_bytes is not None and \
+                self.tokens * self.token_bytes > self.max_bytes:
+            return "bytes"
+        elif self.max_seconds is not None:
+            (_, tail_timestamp, _), _, _ = self.entries[0]
+            (_, head_timestamp, _), _, _ = self.entries[-1]
+            if head_timestamp - tail_timestamp >= self.max_seconds:
+                return "seconds"
+        return None
+
+    def nbytes(self):
+        """
+        Returns the estimated memory used by the tokens added by the entries.
+        """
+        return self.tokens * self.token_bytes
+
+    def non_self(self, user):
+        """
+        Returns the number of revisions in the window that were not saved by
+        `user`.
+        """
+        return len(self.entries) - self.user_revisions.get(user_key(user), 0)
+
+    def full(self):
+        return len(self.entries) >= self.maxlen
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        entry, _, _ = self.entries[index]
+        return entry
+
+    def __iter__(self):
+        return (entry for entry, _, _ in self.entries)
+
+    def __getstate__(self):
+        state = {slot: getattr(self, slot) for slot in self.__slots__}
+        if self.spill is not None:
+            # Spilled documents are stored with the window
+            state['entries'] = deque(
+                ((self._read(entry), key, size)
+                 for entry, key, size in self.entries))
+        state['spill'] = None
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # Pickled with the default protocol for slots
+            _, state = state
+        self.max_bytes, self.max_seconds = None, None
+        self.token_bytes, self.spill = TOKEN_BYTES, None
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        if 'tokens' not in state:
+            self.entries = deque(
+                (entry, key, len(entry[2]))
+                for entry, key in self.entries)
+            self.tokens = sum(size for _, _, size in self.entries)
+
+    def _read(self, entry):
+        rev_doc, timestamp, tokens_added = entry
+        if isinstance(rev_doc, Spilled):
+            return (self.spill.read(rev_doc), timestamp, tokens_added)
+        else:
+            return entry
@@ -21,6 +21,7 @@ setup(
     license="MIT",
     url="https://github.com/mediawiki-utilities/python-mwpersistence",
     packages=find_packages(),
+    package_data={'mwpersistence.benchmarks': ['baselines/*.json']},
     entry_points={
         'console_scripts': [
             'mwpersistence=mwpersistence.mwpersistence:main'
@@ -28,6 +29,11 @@ setup(
     },
     long_description=read('README.md'),
     install_requires=list(requirements('requirements.txt')),
+    extras_require={
+        'columnar': ['numpy'],
+        'orjson': ['orjson'],
+        'ujson': ['ujson']
+    },
     classifiers=[
         "Development Status :: 4 - Beta",
         "Topic :: Software Development :: Libraries :: Python Modules",